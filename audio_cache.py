@@ -0,0 +1,127 @@
+import os
+import sys
+from collections import OrderedDict
+import numpy as np
+import librosa
+
+# Decodes each audio file once and keeps the samples in a memory-bounded LRU cache shared by every extractor.
+
+# Maximum number of bytes of decoded audio kept in memory
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+_cache = OrderedDict()
+_cache_bytes = 0
+
+def set_cache_limit(max_bytes):
+    """
+    Set the maximum number of bytes of decoded audio kept in the cache.
+
+    Parameters:
+    - max_bytes: int, cache size limit in bytes
+    """
+    global MAX_CACHE_BYTES
+    MAX_CACHE_BYTES = max_bytes
+    _evict()
+
+def clear_cache():
+    """Remove every decoded signal from the cache."""
+    global _cache_bytes
+    _cache.clear()
+    _cache_bytes = 0
+
+def cache_info():
+    """
+    Return the current state of the cache.
+
+    Returns:
+    - dict with the number of cached signals, bytes used and the byte limit
+    """
+    return {"entries": len(_cache), "bytes": _cache_bytes, "max_bytes": MAX_CACHE_BYTES}
+
+def _cache_key(file_path, sr):
+    # Include size and modification time so a re-trimmed or converted file is decoded again
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, sr)
+
+def _evict():
+    global _cache_bytes
+    while _cache and _cache_bytes > MAX_CACHE_BYTES:
+        _, (y, _) = _cache.popitem(last=False)
+        _cache_bytes -= y.nbytes
+
+def _store(key, y, sr):
+    global _cache_bytes
+    # Cached arrays are shared between extractors, so guard them against in-place modification
+    y.setflags(write=False)
+    _cache[key] = (y, sr)
+    _cache_bytes += y.nbytes
+    _evict()
+    return y, sr
+
+def load_audio(file_path, sr=None):
+    """
+    Load a mono float32 audio signal, decoding each file only once.
+
+    The native-rate signal is cached on first use. Requests for another sample rate are
+    resampled from the cached native signal and cached separately, keyed by target rate.
+
+    Parameters:
+    - file_path: str, path to the audio file
+    - sr: int, target sample rate (default is None, which keeps the native rate)
+
+    Returns:
+    - (y, sr) tuple of the read-only signal and its sample rate
+    """
+    native_key = _cache_key(file_path, None)
+    if native_key in _cache:
+        _cache.move_to_end(native_key)
+        y, native_sr = _cache[native_key]
+    else:
+        y, native_sr = librosa.load(file_path, sr=None, mono=True, dtype=np.float32)
+        y, native_sr = _store(native_key, y, native_sr)
+
+    if sr is None or sr == native_sr:
+        return y, native_sr
+
+    key = _cache_key(file_path, sr)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    # Same resampler librosa.load uses by default, so values match a direct librosa.load(file_path, sr=sr)
+    y_resampled = librosa.resample(y, orig_sr=native_sr, target_sr=sr, res_type="soxr_hq")
+    return _store(key, y_resampled, sr)
+
+def resolve_audio(audio, sr=None, target_sr=None):
+    """
+    Return a decoded signal from either a file path or an already decoded array.
+
+    Parameters:
+    - audio: str or numpy array, path to an audio file or a decoded mono signal
+    - sr: int, sample rate of audio when it is an array (ignored for paths)
+    - target_sr: int, sample rate the caller needs (default is None, which keeps the input rate)
+
+    Returns:
+    - (y, sr) tuple of the signal and its sample rate
+    """
+    if isinstance(audio, (str, os.PathLike)):
+        return load_audio(audio, sr=target_sr)
+
+    if sr is None:
+        raise ValueError("sr is required when passing a decoded signal")
+
+    y = np.asarray(audio)
+    if target_sr is not None and target_sr != sr:
+        y = librosa.resample(y, orig_sr=sr, target_sr=target_sr, res_type="soxr_hq")
+        sr = target_sr
+    return y, sr
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python audio_cache.py <wav_file_path>")
+        sys.exit(1)
+    else:
+        y, sr = load_audio(sys.argv[1])
+        print(f"Loaded {len(y)} samples at {sr} Hz")
+        load_audio(sys.argv[1], sr=22050)
+        print(f"Cache: {cache_info()}")
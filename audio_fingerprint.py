@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import numpy as np
+import librosa
+
+from audio_cache import load_audio
+from feature_store import append_to_store, load_store, read_from_store
+
+# Acoustic fingerprints for finding re-encoded copies of the same recording.
+#
+# Each frame gets a 32-bit sub-fingerprint in the style of Haitsma & Kalker: the signs of the
+# time differences of the energy differences between 33 adjacent log-spaced bands. Re-encoding
+# flips only a few of these bits, so copies share many exact sub-fingerprints. The index looks up
+# exact hits of each sub-fingerprint and of its single bit flips (so copies with many flipped bits are
+# still found) to get candidate (recording, time offset) pairs, and confirms them with the bit error
+# rate of the aligned fingerprints, so a query never scans every recording.
+#
+# Fingerprints are kept in a feature store (see feature_store.py) in the index directory, next to
+# fingerprints.files.json, which records the path, size and modification time of each recording.
+
+FINGERPRINT_SAMPLE_RATE = 5512
+FRAME_LENGTH = 2048 # 0.37 s
+HOP_LENGTH = 64 # 11.6 ms
+N_BANDS = 33
+BAND_FMIN = 300
+BAND_FMAX = 2000
+
+# Aligned fingerprints with at most this share of differing bits are the same recording
+# (unrelated recordings differ in about half of the bits, re-encoded copies in well under a fifth)
+MATCH_BIT_ERROR_RATE = 0.25
+# Frames compared when confirming a candidate (about 3 s, shorter recordings use their full length)
+MATCH_FRAMES = 256
+# Sub-fingerprints occurring more often than this (e.g. silence) say nothing about a match
+MAX_KEY_HITS = 200
+# Best candidate alignments confirmed per query
+MAX_CANDIDATES = 5
+
+INDEX_FILES_FILE = "fingerprints.files.json"
+
+def _band_matrix(n_fft, sr):
+    edges = np.geomspace(BAND_FMIN, BAND_FMAX, N_BANDS + 1)
+    frequencies = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    bands = np.zeros((N_BANDS, len(frequencies)), dtype=np.float32)
+    for band in range(N_BANDS):
+        bands[band, (frequencies >= edges[band]) & (frequencies < edges[band + 1])] = 1
+    return bands
+
+def fingerprint_signal(y, sr):
+    """
+    Compute the sub-fingerprints of a mono signal.
+
+    Parameters:
+    - y: numpy array, mono signal
+    - sr: int, sample rate of y
+
+    Returns:
+    - numpy array of uint32, one sub-fingerprint per frame
+    """
+    y = np.asarray(y, dtype=np.float32)
+    if sr != FINGERPRINT_SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=FINGERPRINT_SAMPLE_RATE, res_type="soxr_hq")
+    if len(y) < FRAME_LENGTH:
+        return np.zeros(0, dtype=np.uint32)
+
+    power = np.abs(librosa.stft(y, n_fft=FRAME_LENGTH, hop_length=HOP_LENGTH, center=False)) ** 2
+    energies = _band_matrix(FRAME_LENGTH, FINGERPRINT_SAMPLE_RATE) @ power
+    band_differences = energies[:-1] - energies[1:]
+    bits = (band_differences[:, 1:] - band_differences[:, :-1]) > 0
+
+    packed = np.packbits(bits, axis=0).astype(np.uint32)
+    return (packed[0] << 24) | (packed[1] << 16) | (packed[2] << 8) | packed[3]
+
+def fingerprint_file(file_path):
+    """Compute the sub-fingerprints of an audio file (see fingerprint_signal)."""
+    y, sr = load_audio(file_path, sr=FINGERPRINT_SAMPLE_RATE)
+    return fingerprint_signal(y, sr)
+
+def bit_error_rate(a, b):
+    """Return the share of differing bits between two equally long sub-fingerprint arrays."""
+    if len(a) == 0:
+        return 1.0
+    return float(np.unpackbits(np.bitwise_xor(a, b).view(np.uint8)).mean())
+
+def open_fingerprint_index(directory):
+    """
+    Open a fingerprint index, loading it from disk if it exists.
+
+    Recordings whose file no longer exists are left out, so deleted files are never reported
+    as the original of a new upload.
+
+    Parameters:
+    - directory: str, index directory
+
+    Returns:
+    - dict holding the index state, used by find_match and add_fingerprint
+    """
+    os.makedirs(directory, exist_ok=True)
+    files_path = os.path.join(directory, INDEX_FILES_FILE)
+    files = {}
+    if os.path.isfile(files_path):
+        with open(files_path) as files_file:
+            files = json.load(files_file)
+
+    ids, values, offsets, shapes = load_store(directory)
+    slots = []
+    fingerprints = []
+    for file_id, offset, shape in zip(ids, offsets, shapes):
+        if file_id in files and os.path.exists(files[file_id]["path"]):
+            slots.append(file_id)
+            fingerprints.append(np.asarray(read_from_store(values, offset, shape)))
+
+    # Every stored sub-fingerprint, sorted, with the recording and frame it came from
+    keys = np.concatenate(fingerprints) if fingerprints else np.zeros(0, dtype=np.uint32)
+    owners = np.repeat(np.arange(len(slots)), [len(fingerprint) for fingerprint in fingerprints])
+    frames = np.concatenate([np.arange(len(fingerprint)) for fingerprint in fingerprints]) if fingerprints else np.zeros(0, dtype=int)
+    order = np.argsort(keys, kind='stable')
+
+    return {
+        "directory": directory,
+        "files": files,
+        "slots": slots,
+        "fingerprints": fingerprints,
+        "keys": keys[order],
+        "owners": owners[order],
+        "frames": frames[order],
+        # Recordings added since the index was opened: sub-fingerprint -> [(slot, frame), ...]
+        "recent": {}
+    }
+
+def is_indexed(index, file_id, file_path):
+    """Return True if the index has an up to date fingerprint of the file."""
+    entry = index["files"].get(file_id)
+    if entry is None or file_id not in index["slots"]:
+        return False
+    stat = os.stat(file_path)
+    return entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+def find_match(index, fingerprint, exclude_id=None):
+    """
+    Find an indexed recording that the fingerprint is a copy of.
+
+    Parameters:
+    - index: dict returned by open_fingerprint_index
+    - fingerprint: numpy array of uint32 sub-fingerprints
+    - exclude_id: str, ID to ignore (the recording itself, if it is already indexed)
+
+    Returns:
+    - (file_id, bit_error_rate, frame_offset) tuple of the best match, or None
+    """
+    if len(fingerprint) == 0:
+        return None
+
+    # Each sub-fingerprint and its 32 single bit flips
+    flips = np.concatenate([[0], np.left_shift(1, np.arange(32, dtype=np.uint32))]).astype(np.uint32)
+    query_keys = (np.bitwise_xor(fingerprint[:, None], flips[None, :])).ravel()
+    query_key_frames = np.repeat(np.arange(len(fingerprint)), len(flips))
+
+    # Exact hits among the stored recordings
+    low = np.searchsorted(index["keys"], query_keys, side='left')
+    high = np.searchsorted(index["keys"], query_keys, side='right')
+    counts = high - low
+    counts[counts > MAX_KEY_HITS] = 0
+    query_frames = np.repeat(query_key_frames, counts)
+    hit_positions = np.repeat(low, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    hit_slots = index["owners"][hit_positions]
+    hit_offsets = index["frames"][hit_positions] - query_frames
+
+    # ...and among the recordings added since the index was opened
+    recent_slots = []
+    recent_offsets = []
+    for query_frame, key in zip(query_key_frames.tolist(), query_keys.tolist()):
+        hits = index["recent"].get(key, ())
+        if len(hits) <= MAX_KEY_HITS:
+            for slot, frame in hits:
+                recent_slots.append(slot)
+                recent_offsets.append(frame - query_frame)
+
+    hit_slots = np.concatenate([hit_slots, np.asarray(recent_slots, dtype=int)])
+    hit_offsets = np.concatenate([hit_offsets, np.asarray(recent_offsets, dtype=int)])
+    if len(hit_slots) == 0:
+        return None
+
+    # Vote for (recording, alignment) pairs and confirm the strongest ones
+    candidates, votes = np.unique(np.stack([hit_slots, hit_offsets]), axis=1, return_counts=True)
+    best = None
+    for candidate in np.argsort(votes)[::-1][:MAX_CANDIDATES]:
+        slot, offset = int(candidates[0, candidate]), int(candidates[1, candidate])
+        file_id = index["slots"][slot]
+        if file_id == exclude_id:
+            continue
+        reference = index["fingerprints"][slot]
+        query_start, reference_start = max(0, -offset), max(0, offset)
+        length = min(len(fingerprint) - query_start, len(reference) - reference_start, MATCH_FRAMES)
+        if length < min(MATCH_FRAMES, len(fingerprint), len(reference)):
+            continue
+        ber = bit_error_rate(fingerprint[query_start:query_start + length], reference[reference_start:reference_start + length])
+        if ber <= MATCH_BIT_ERROR_RATE and (best is None or ber < best[1]):
+            best = (file_id, ber, offset)
+    return best
+
+def add_fingerprint(index, file_id, file_path, fingerprint):
+    """
+    Add a recording's fingerprint to the index, on disk and in memory.
+
+    Parameters:
+    - index: dict returned by open_fingerprint_index
+    - file_id: str, ID of the recording
+    - file_path: str, path of the recording
+    - fingerprint: numpy array of uint32 sub-fingerprints
+    """
+    fingerprint = np.asarray(fingerprint, dtype=np.uint32)
+    append_to_store(fingerprint, file_id, index["directory"])
+
+    stat = os.stat(file_path) if os.path.exists(file_path) else None
+    index["files"][file_id] = {
+        "path": os.path.abspath(file_path),
+        "size": stat.st_size if stat else None,
+        "mtime_ns": stat.st_mtime_ns if stat else None
+    }
+    files_path = os.path.join(index["directory"], INDEX_FILES_FILE)
+    with open(files_path + ".tmp", 'w') as files_file:
+        json.dump(index["files"], files_file)
+    os.replace(files_path + ".tmp", files_path)
+
+    slot = len(index["slots"])
+    index["slots"].append(file_id)
+    index["fingerprints"].append(fingerprint)
+    for frame, key in enumerate(fingerprint.tolist()):
+        index["recent"].setdefault(key, []).append((slot, frame))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python audio_fingerprint.py <index_directory> <audio_file>")
+        print("Reports whether the audio file is a copy of a recording in the index.")
+        sys.exit(1)
+    else:
+        index = open_fingerprint_index(sys.argv[1])
+        match = find_match(index, fingerprint_file(sys.argv[2]))
+        if match is None:
+            print(f"No match for {sys.argv[2]} among {len(index['slots'])} recordings")
+        else:
+            print(f"{sys.argv[2]} matches {match[0]} (bit error rate {match[1]:.3f}, offset {match[2]} frames)")
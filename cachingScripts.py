@@ -1,8 +1,20 @@
 import os
 import sys
+import json
+import itertools
+import numpy as np
+import pandas as pd
 
 from fileSaveScripts import save_dataframe_to_csv
 
+# Cached feature tables are stored column-major in .npy blocks (one per column dtype) with a
+# .json schema alongside, e.g. mfcc_n_mfcc=13.json + mfcc_n_mfcc=13.0.npy + mfcc_n_mfcc=13.1.npy.
+# Blocks are memory-mapped on read and columns can be selected without reading the others.
+TABLE_SCHEMA_EXTENSION = ".json"
+
+# Feature views (see feature_views.py) are combined feature sets resolved when they are loaded
+VIEW_EXTENSION = ".view.json"
+
 def directory_exists(path: str) -> bool:
     """
     Check if a directory exists.
@@ -33,16 +45,235 @@ def combine_path(file_path, file_name, extension):
     full_path = os.path.join(file_path, f"{file_name}{extension}")   
     return full_path
 
-def cache_features(file_path, df):
-    overwrite_cache = True
-    if not overwrite_cache:
-        if file_exists(file_path):
-            print(f"The file {file_path} exists.")
-            return file_path
+def table_base_path(file_path):
+    """Return a table path without its extension (.csv and .json paths name the same table)."""
+    base, extension = os.path.splitext(file_path)
+    return base if extension in (".csv", TABLE_SCHEMA_EXTENSION, ".npy") else file_path
+
+def table_name(file_path):
+    """Return the name of a table or feature view, its file name without the extension."""
+    file_name = os.path.basename(file_path)
+    if file_name.endswith(VIEW_EXTENSION):
+        return file_name[:-len(VIEW_EXTENSION)]
+    return table_base_path(file_name)
+
+def save_feature_table(df, file_path, fingerprint=None):
+    """
+    Save a DataFrame as a binary feature table.
+
+    Numeric columns are grouped by dtype and each group is saved as one column-major .npy
+    block. Other columns (e.g. IDs) are kept in the schema. The schema is written last,
+    so a half-written table is never picked up.
+
+    Parameters:
+    - df: pandas DataFrame to be saved
+    - file_path: str, path of the table (any extension is removed)
+    - fingerprint: str, fingerprint of the inputs the table was built from (default is None)
+
+    Returns:
+    - str, path of the table's schema file
+    """
+    base = table_base_path(file_path)
+    directory = os.path.dirname(base)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # One pass over the dtypes, so wide tables (hundreds of thousands of columns) stay linear
+    dtypes = df.dtypes.to_numpy()
+    columns = []
+    block_columns = {}
+    block_numbers = {}
+    for position, (name, dtype) in enumerate(zip(df.columns, dtypes)):
+        name = name.item() if isinstance(name, np.generic) else name
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+            dtype_str = np.dtype(dtype).str
+            if dtype_str not in block_columns:
+                block_columns[dtype_str] = []
+                block_numbers[dtype_str] = len(block_numbers)
+            block = block_columns[dtype_str]
+            columns.append({"name": name, "block": block_numbers[dtype_str], "index": len(block)})
+            block.append(position)
         else:
-            return save_dataframe_to_csv(df, file_path)
+            columns.append({"name": name, "values": df.iloc[:, position].tolist()})
+
+    blocks = []
+    for block_index, (dtype, positions) in enumerate(block_columns.items()):
+        values = np.asfortranarray(df.iloc[:, positions].to_numpy(dtype=np.dtype(dtype)))
+        blocks.append(_write_block(base, block_index, values))
+
+    return _write_schema(base, len(df), fingerprint, blocks, columns)
+
+def _write_block(base, block_index, values):
+    # Fortran-ordered arrays are written as they are, without a copy
+    block_path = f"{base}.{block_index}.npy"
+    with open(block_path + ".tmp", 'wb') as block_file:
+        np.save(block_file, values)
+    os.replace(block_path + ".tmp", block_path)
+    return {"file": os.path.basename(block_path), "dtype": values.dtype.str}
+
+def _write_schema(base, rows, fingerprint, blocks, columns):
+    # Columns may be a generator, written one entry at a time so wide tables never hold them all
+    schema_path = base + TABLE_SCHEMA_EXTENSION
+    with open(schema_path + ".tmp", 'w') as schema_file:
+        header = json.dumps({"rows": rows, "fingerprint": fingerprint, "blocks": blocks}, default=str)
+        schema_file.write(header[:-1] + ', "columns": [')
+        for position, column in enumerate(columns):
+            schema_file.write((", " if position else "") + json.dumps(column, default=str))
+        schema_file.write("]}")
+    os.replace(schema_path + ".tmp", schema_path)
+    return schema_path
+
+def save_feature_matrix(matrix, file_path, leading_columns, fingerprint=None):
+    """
+    Save a numeric matrix as a binary feature table without copying it.
+
+    The table has the leading columns first, then one column per matrix column named
+    0, 1, ... like a DataFrame built from the matrix. Loading it gives the same DataFrame
+    save_feature_table would have saved.
+
+    Parameters:
+    - matrix: 2D numpy array, Fortran-ordered to be written without a copy
+    - file_path: str, path of the table (any extension is removed)
+    - leading_columns: dict mapping column names to 1D numpy arrays, one value per matrix row
+    - fingerprint: str, fingerprint of the inputs the table was built from (default is None)
+
+    Returns:
+    - str, path of the table's schema file
+    """
+    base = table_base_path(file_path)
+    directory = os.path.dirname(base)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    blocks = []
+    columns = []
+    for name, values in leading_columns.items():
+        columns.append({"name": name, "block": len(blocks), "index": 0})
+        blocks.append(_write_block(base, len(blocks), np.asarray(values).reshape(-1, 1)))
+    matrix_block = len(blocks)
+    blocks.append(_write_block(base, matrix_block, matrix))
+    matrix_columns = ({"name": index, "block": matrix_block, "index": index} for index in range(matrix.shape[1]))
+
+    return _write_schema(base, matrix.shape[0], fingerprint, blocks, itertools.chain(columns, matrix_columns))
+
+def load_feature_table(file_path, columns=None, mmap=True):
+    """
+    Load a cached feature table, reading only the requested columns.
+
+    Parameters:
+    - file_path: str, path of the table (its schema, a feature view or a legacy .csv file)
+    - columns: list of column names to load (default is None, which loads every column)
+    - mmap: bool, memory-map the blocks instead of reading them into memory (default is True)
+
+    Returns:
+    - pandas DataFrame with the columns in the requested (or saved) order
+    """
+    if file_path.endswith(".csv"):
+        # Legacy or exported CSV table
+        return pd.read_csv(file_path, usecols=columns)
+
+    if file_path.endswith(VIEW_EXTENSION):
+        # Imported here because feature_views builds on compile_features, which imports this module
+        from feature_views import load_feature_view
+        return load_feature_view(file_path, columns)
+
+    base = table_base_path(file_path)
+    with open(base + TABLE_SCHEMA_EXTENSION) as schema_file:
+        schema = json.load(schema_file)
+
+    by_name = {column["name"]: column for column in schema["columns"]}
+    if columns is None:
+        selected = schema["columns"]
     else:
-        return save_dataframe_to_csv(df, file_path)
+        # CSV-loaded tables have string column names, so accept either form
+        selected = [by_name[name] if name in by_name else by_name[int(name)] for name in columns]
+
+    directory = os.path.dirname(base)
+    loaded_blocks = {}
+    frames = []
+    start = 0
+    while start < len(selected):
+        column = selected[start]
+        if "values" in column:
+            frames.append(pd.DataFrame({column["name"]: column["values"]}))
+            start += 1
+            continue
+        # Consecutive columns from the same block become a single slice of that block
+        end = start + 1
+        while end < len(selected) and selected[end].get("block") == column["block"]:
+            end += 1
+        block_index = column["block"]
+        if block_index not in loaded_blocks:
+            block_path = os.path.join(directory, schema["blocks"][block_index]["file"])
+            loaded_blocks[block_index] = np.load(block_path, mmap_mode='r' if mmap else None)
+        indices = [selected_column["index"] for selected_column in selected[start:end]]
+        if indices == list(range(indices[0], indices[-1] + 1)):
+            values = loaded_blocks[block_index][:, indices[0]:indices[-1] + 1]
+        else:
+            values = loaded_blocks[block_index][:, indices]
+        frames.append(pd.DataFrame(values, columns=[selected_column["name"] for selected_column in selected[start:end]], copy=False))
+        start = end
+
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, axis=1, copy=False)
+
+def list_feature_tables(directory):
+    """
+    List the cached feature tables in a directory.
+
+    Parameters:
+    - directory: str, cache directory
+
+    Returns:
+    - list of table paths (schema files and feature views, plus .csv files that have no binary table)
+    """
+    files = sorted(os.listdir(directory))
+    # Views end in .view.json, so they are picked up along with the table schemas
+    tables = [os.path.join(directory, file) for file in files if file.endswith(TABLE_SCHEMA_EXTENSION)]
+    table_bases = {table_base_path(table) for table in tables}
+    tables += [os.path.join(directory, file) for file in files
+               if file.endswith(".csv") and table_base_path(os.path.join(directory, file)) not in table_bases]
+    return tables
+
+def table_fingerprint(file_path):
+    """
+    Return the input fingerprint stored with a cached feature table.
+
+    Parameters:
+    - file_path: str, path of the table (any extension is removed)
+
+    Returns:
+    - str, the fingerprint, or None if the table does not exist or has none
+    """
+    schema_path = table_base_path(file_path) + TABLE_SCHEMA_EXTENSION
+    if not file_exists(schema_path):
+        return None
+    try:
+        with open(schema_path) as schema_file:
+            return json.load(schema_file).get("fingerprint")
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def cache_features(file_path, df, export_csv=False, fingerprint=None):
+    """
+    Cache a compiled feature DataFrame as a binary feature table.
+
+    Whether an existing table can be reused is decided by the caller before compiling,
+    by comparing table_fingerprint with the fingerprint of the current inputs.
+
+    Parameters:
+    - file_path: str, path of the table (any extension is removed)
+    - df: pandas DataFrame to be cached
+    - export_csv: bool, also write the table as CSV next to it (default is False)
+    - fingerprint: str, fingerprint of the inputs df was built from (default is None)
+
+    Returns:
+    - str, path of the table's schema file
+    """
+    if export_csv:
+        save_dataframe_to_csv(df, table_base_path(file_path) + ".csv")
+    return save_feature_table(df, file_path, fingerprint)
 
 
 if __name__ == '__main__':
@@ -1,39 +1,91 @@
 import os
 import sys
+import json
+import hashlib
+import argparse
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 
 from fileSaveScripts import save_dataframe_to_csv
-from cachingScripts import cache_features
-
-def npy_to_dataframe(directory):
-    data = []
-    filenames = []
-
-    # Iterate through all files in the directory
-    for file in os.listdir(directory):
-        if file.endswith(".npy"):
-            file_path = os.path.join(directory, file)
-            # Load the .npy file
-            array_data = np.load(file_path)
-            
-            # Flatten and convert the data to a list
-            if np.isscalar(array_data) or array_data.ndim == 0:
-                array_data = [array_data.item()]
-            else:
-                array_data = array_data.flatten().tolist()
-            
-            # Add the filename (minus .npy) and data to the list
-            filenames.append(os.path.splitext(file)[0])
-            data.append(array_data)
-
-    print(f"Data: {data[:10]}")
-    # Determine the maximum length for padding
-    max_length = max(len(row) for row in data)
-    padded_data = [row + [0] * (max_length - len(row)) for row in data]
-
-    # Convert to DataFrame and insert filenames
-    df = pd.DataFrame(padded_data)
+from cachingScripts import save_feature_matrix, table_fingerprint
+from ground_truth import attach_ground_truth, lookup_hrv, HRV_COLUMN
+from feature_store import is_feature_store, load_store, read_from_store, STORE_INDEX_FILE, STORE_DATA_FILE, STORE_META_FILE
+
+# Bump when the compiled table layout or contents change, so every cached table is rebuilt
+COMPILE_VERSION = 2
+
+# Threads used to read legacy per-recording .npy files (np.load releases the GIL while reading)
+LOAD_THREADS = 8
+
+def _load_npy(file_path):
+    # Memory-map where possible so only the header is read until the values are copied into the matrix
+    try:
+        return np.load(file_path, mmap_mode='r')
+    except ValueError:
+        return np.load(file_path, allow_pickle=True)
+
+def fill_feature_matrix(arrays, n_threads=1, order='C', width=None):
+    """
+    Copy a list of arrays into one zero-padded float32 matrix, one flattened array per row.
+
+    Parameters:
+    - arrays: list of numpy arrays (or scalars)
+    - n_threads: int, number of threads filling rows (default is 1)
+    - order: str, memory layout of the matrix, 'C' or 'F' (default is 'C')
+    - width: int, number of columns (default is None, the largest array size)
+
+    Returns:
+    - numpy array of shape (len(arrays), largest array size)
+    """
+    sizes = [np.size(array) for array in arrays]
+    if width is None:
+        width = max(sizes, default=0)
+    matrix = np.zeros((len(arrays), width), dtype=np.float32, order=order)
+
+    def fill_row(row):
+        matrix[row, :sizes[row]] = np.ravel(arrays[row])
+
+    if n_threads > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(fill_row, range(len(arrays))))
+    else:
+        for row in range(len(arrays)):
+            fill_row(row)
+    return matrix
+
+def load_feature_arrays(directory, n_threads=LOAD_THREADS):
+    """
+    Open every recording's array in a feature directory, without reading the values yet where possible.
+
+    Parameters:
+    - directory: str, feature directory (a feature store or legacy per-recording .npy files)
+    - n_threads: int, number of threads opening legacy .npy files (default is LOAD_THREADS)
+
+    Returns:
+    - (ids, arrays) tuple of lists
+    """
+    if is_feature_store(directory):
+        # The whole feature configuration comes from one read of the store
+        ids, values, offsets, shapes = load_store(directory)
+        return ids, [read_from_store(values, offset, shape) for offset, shape in zip(offsets, shapes)]
+
+    # Legacy layout: one .npy file per recording, read concurrently
+    files = [file for file in os.listdir(directory) if file.endswith(".npy")]
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        arrays = list(executor.map(_load_npy, [os.path.join(directory, file) for file in files]))
+    return [os.path.splitext(file)[0] for file in files], arrays
+
+def npy_to_dataframe(directory, n_threads=LOAD_THREADS):
+    filenames, arrays = load_feature_arrays(directory, n_threads)
+    matrix = fill_feature_matrix(arrays, n_threads)
+    del arrays
+
+    print(f"Data: {matrix.shape[0]} recordings, {matrix.shape[1]} values each")
+
+    # Wrap the padded matrix without copying it and insert filenames
+    df = pd.DataFrame(matrix, copy=False)
     df.insert(0, 'ID', filenames)
     
     #print(df[:10])
@@ -43,31 +95,19 @@ def npy_to_dataframe(directory):
 def merge_with_lookup(input, csv_file):
     # If directory is not a dataframe, convert it to a dataframe
     if not isinstance(input, pd.DataFrame):
-        df_npy = npy_to_dataframe(directory)
+        df_npy = npy_to_dataframe(input)
     else:
         df_npy = input
 
-    # Read the CSV file
-    df_csv = pd.read_csv(csv_file)
-
-    # Merge DataFrames on the filename and Prolific ID
-    merged_df = pd.merge(df_npy, df_csv[['Prolific ID', 'HRV (ms)']], left_on='ID', right_on='Prolific ID')
-
-    # Drop the duplicate column 'Prolific ID' and rename 'filename' to 'PID'
-    merged_df = merged_df.drop(columns=['Prolific ID'])
-
-    # Reorder columns to place 'HRV (ms)' as the second column
-    cols = merged_df.columns.tolist()
-    cols.insert(1, cols.pop(cols.index('HRV (ms)')))
-    merged_df = merged_df[cols]
-
-    return merged_df
+    # Add 'HRV (ms)' as the second column, keeping only recordings with a ground truth value.
+    # The lookup is parsed once per process and matched by index rather than merged.
+    return attach_ground_truth(df_npy, csv_file)
 
 def drop_id_column(df):
     return df.drop(columns=['ID'])
 
 def drop_empty_hrv_rows(df):
-    # Remove rows where 'HRV (ms)' is NaN
+    # Remove rows where 'HRV (ms)' is NaN (merge_with_lookup already leaves none, kept for other callers)
     df_cleaned = df.dropna(subset=['HRV (ms)'])
     return df_cleaned
 
@@ -75,8 +115,8 @@ def get_directories_with_files(base_path, file_extensions):
     directories_with_files = []
 
     for root, dirs, files in os.walk(base_path):
-        # Check if the current directory contains any files with the specified extensions
-        if any(file.endswith(tuple(file_extensions)) for file in files):
+        # Check if the current directory is a feature store or contains any files with the specified extensions
+        if STORE_INDEX_FILE in files or any(file.endswith(tuple(file_extensions)) for file in files):
             directories_with_files.append(root)
 
     return directories_with_files
@@ -94,53 +134,155 @@ def generate_nice_name(path):
         nice_name = nice_name[1:]
     return nice_name
 
-def compile_and_cache_features(path):
+def file_hash(file_path):
+    """Return the SHA-1 of a file's content, or None if it does not exist."""
+    if not os.path.isfile(file_path):
+        return None
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def compile_fingerprint(directory, lookup_hash):
+    """
+    Fingerprint everything the compiled table of a feature directory depends on.
+
+    Covers the recordings and the size of their stored values (the store index and value
+    file size, or the name, size and modification time of each legacy .npy file), the
+    lookup.csv content hash and COMPILE_VERSION.
+
+    Parameters:
+    - directory: str, feature directory
+    - lookup_hash: str, content hash of the ground truth CSV
+
+    Returns:
+    - str, hex digest
+    """
+    inputs = {"compile_version": COMPILE_VERSION, "lookup": lookup_hash}
+    if is_feature_store(directory):
+        # Stores are append-only, so the index and the value file size identify the contents
+        inputs["index"] = file_hash(os.path.join(directory, STORE_INDEX_FILE))
+        inputs["meta"] = file_hash(os.path.join(directory, STORE_META_FILE))
+        inputs["values"] = os.path.getsize(os.path.join(directory, STORE_DATA_FILE))
+    else:
+        inputs["files"] = []
+        for file in sorted(os.listdir(directory)):
+            if file.endswith(".npy"):
+                stat = os.stat(os.path.join(directory, file))
+                inputs["files"].append([file, stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def compile_directory(directory, lookup_hash=None, force=False):
+    """
+    Compile one feature directory into ./cached_features unless its cached table is up to date.
+
+    Parameters:
+    - directory: str, feature directory
+    - lookup_hash: str, content hash of lookup.csv (default is None, which hashes it here)
+    - force: bool, rebuild even if the inputs are unchanged (default is False)
+
+    Returns:
+    - (nice_name, rebuilt) tuple, rebuilt is False when the cached table was reused
+    """
+    nice_name = generate_nice_name(directory)
+    if lookup_hash is None:
+        lookup_hash = file_hash('lookup.csv')
+    fingerprint = compile_fingerprint(directory, lookup_hash)
+    if not force and table_fingerprint(f'./cached_features/{nice_name}') == fingerprint:
+        return nice_name, False
+
+    # Same table as merge_with_lookup, drop_id_column and drop_empty_hrv_rows build, but only the rows
+    # with ground truth are copied, straight into a Fortran-ordered matrix that is saved as it is,
+    # so peak memory stays close to the size of the output
+    ids, arrays = load_feature_arrays(directory)
+    rows, hrv = lookup_hrv(ids, 'lookup.csv')
+    # Padded to the largest recording, with ground truth or not, as npy_to_dataframe does
+    width = max((np.size(array) for array in arrays), default=0)
+    matrix = fill_feature_matrix([arrays[row] for row in rows], LOAD_THREADS, order='F', width=width)
+    del arrays
+    print(f"Data: {matrix.shape[0]} recordings with ground truth, {matrix.shape[1]} values each")
+    save_feature_matrix(matrix, f'./cached_features/{nice_name}', {HRV_COLUMN: hrv}, fingerprint=fingerprint)
+    return nice_name, True
+
+def compile_and_cache_features(path, workers=1, force=False):
+    """
+    Compile every feature directory under path and cache it, reusing tables whose inputs are unchanged.
+
+    Directories are independent, so with workers > 1 they are compiled in separate
+    processes, each holding only the matrix of the directory it is working on.
+
+    Parameters:
+    - path: str, feature root directory
+    - workers: int, number of worker processes (default is 1, serial)
+    - force: bool, rebuild every table even if its inputs are unchanged (default is False)
+
+    Returns:
+    - (rebuilt, reused) tuple of lists of nice names
+    """
     file_extensions = ['.npy', '.csv']
     directories = get_directories_with_files(path, file_extensions)
     num_directories = len(directories)
-    for directory in directories:
-        nice_name = generate_nice_name(directory)
-        print(f'Processing {nice_name}...')
-        print(f'{directories.index(directory) + 1}/{num_directories}')
-        #df = npy_to_dataframe(directory)
-        df = merge_with_lookup(directory, 'lookup.csv')
-        df = drop_id_column(df)
-        df = drop_empty_hrv_rows(df)
-        cache_features(f'./cached_features/{nice_name}.csv', df)
-        print(f'Cached {nice_name} at ./cached_features/{nice_name}.csv')
+    task = partial(compile_directory, lookup_hash=file_hash('lookup.csv'), force=force)
+    rebuilt = []
+    reused = []
 
+    def report(index, nice_name, was_rebuilt):
+        print(f'{index + 1}/{num_directories}')
+        if was_rebuilt:
+            rebuilt.append(nice_name)
+            print(f'Cached {nice_name} at ./cached_features/{nice_name}')
+        else:
+            reused.append(nice_name)
+            print(f'Reused {nice_name}, inputs unchanged')
 
-if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage: python npy_to_dataframe.py <directory>')
-        sys.exit(1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for index, (nice_name, was_rebuilt) in enumerate(executor.map(task, directories)):
+                report(index, nice_name, was_rebuilt)
     else:
-        directory = sys.argv[1]
-        compile_and_cache_features(directory)
-        '''
-        #df = npy_to_dataframe(directory)
-        df = merge_with_lookup(directory, 'lookup.csv')
-        save_dataframe_to_csv(df, '/test_csvs/merged_data.csv')
-        df = drop_id_column(df)
-        save_dataframe_to_csv(df, '/test_csvs/noID_merged_data.csv')
-        df = drop_empty_hrv_rows(df)
-        save_dataframe_to_csv(df, '/test_csvs/noEmptyHrv_merged_data.csv')
-        #print(df)
-        '''
-        '''
-        file_extensions = ['.npy', '.csv'] # List of file extensions to search for within directories
-        base_directory = './speechFeatures'
+        for index, directory in enumerate(directories):
+            print(f'Processing {generate_nice_name(directory)}...')
+            nice_name, was_rebuilt = task(directory)
+            report(index, nice_name, was_rebuilt)
+
+    print(f'Rebuilt {len(rebuilt)} and reused {len(reused)} of {num_directories} feature tables.')
+    return rebuilt, reused
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compile every feature directory into a cached table.")
+    parser.add_argument("directory", type=str, help="The feature directory (e.g. ./speechFeatures).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default 1 runs serially).")
+    parser.add_argument("--force", action="store_true", help="Rebuild every cached table even if its inputs are unchanged.")
+
+    args = parser.parse_args()
+    directory = args.directory
+    compile_and_cache_features(directory, args.workers, args.force)
+    '''
+    #df = npy_to_dataframe(directory)
+    df = merge_with_lookup(directory, 'lookup.csv')
+    save_dataframe_to_csv(df, '/test_csvs/merged_data.csv')
+    df = drop_id_column(df)
+    save_dataframe_to_csv(df, '/test_csvs/noID_merged_data.csv')
+    df = drop_empty_hrv_rows(df)
+    save_dataframe_to_csv(df, '/test_csvs/noEmptyHrv_merged_data.csv')
+    #print(df)
+    '''
+    '''
+    file_extensions = ['.npy', '.csv'] # List of file extensions to search for within directories
+    base_directory = './speechFeatures'
     
-        # Get the list of directories with files
-        directories = get_directories_with_files(base_directory, file_extensions)
-        # Generate and print nice names for each directory
-        print("Directories with files:")
-        for directory in directories:
-            print(directory)
-        
-        print("\nNice names:")
-        for directory in directories:
-            nice_name = generate_nice_name(directory)
-            print(nice_name)
-
-        '''
\ No newline at end of file
+    # Get the list of directories with files
+    directories = get_directories_with_files(base_directory, file_extensions)
+    # Generate and print nice names for each directory
+    print("Directories with files:")
+    for directory in directories:
+        print(directory)
+    
+    print("\nNice names:")
+    for directory in directories:
+        nice_name = generate_nice_name(directory)
+        print(nice_name)
+
+    '''
\ No newline at end of file
@@ -1,57 +1,269 @@
 from pydub import AudioSegment
+from pydub.utils import get_encoder_name, mediainfo_json
 import os
-import sys
+import struct
+import subprocess
+import tempfile
+import argparse
+import numpy as np
+import soundfile as sf
+import soxr
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 # Converts all audio files to a WAV with specified parameters.
+#
+# Files that are already 16 kHz mono 16-bit PCM wavs are recognised from their RIFF header and left alone.
+# Everything else is decoded block by block, by soundfile where it can read the format and otherwise from
+# ffmpeg's float output read through a pipe (so m4a/webm/ogg are never held whole), resampled
+# with a streaming soxr resampler and written to a temporary wav, which then atomically replaces the original.
+# preprocess_audio converts through the same converted_blocks, so both produce the same samples.
 
 # Define the desired parameters
 TARGET_SAMPLE_RATE = 16000
 TARGET_CHANNELS = 1  # Mono
+TARGET_SAMPLE_WIDTH = 2  # 16-bit
 TARGET_FORMAT = "wav"
 TARGET_EXTENSION = ".wav"
 LOG_FILE = "./logs/convertToPCM.log"
 
-# Ensure the script is called with the correct number of arguments
-if len(sys.argv) != 2:
-    print("Usage: python convert_audio.py <directory_path>")
-    sys.exit(1)
-
-input_folder = sys.argv[1]
-
-# Open the log file for writing
-with open(LOG_FILE, "w") as log_file:
-    def log(message):
-        log_file.write(message + "\n")
-        print(message)
-
-    log("Starting conversion process...")
-    log(f"Target Sample Rate: {TARGET_SAMPLE_RATE}")
-    log(f"Target Channels: {TARGET_CHANNELS}")
-    log(f"Target format: {TARGET_FORMAT}")
-    
-    def convert_audio(file_path):
+# soxr quality presets, from fastest to most accurate
+RESAMPLE_QUALITIES = ["QQ", "LQ", "MQ", "HQ", "VHQ"]
+# Frames decoded, resampled and written at a time (about 4 s at 48 kHz)
+BLOCK_FRAMES = 1 << 18
+
+TEMP_SUFFIX = ".converting.tmp"
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def read_wav_header(file_path):
+    """
+    Read the format of a RIFF/WAVE file from its header, without decoding any audio.
+
+    Parameters:
+    - file_path: str, path to the audio file
+
+    Returns:
+    - dict with "format_tag", "channels", "sample_rate" and "bits_per_sample"
+      (PCM subformats of WAVE_FORMAT_EXTENSIBLE are reported as WAVE_FORMAT_PCM),
+      or None if the file is not a wav with a format chunk
+    """
+    with open(file_path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = chunk_header[:4], struct.unpack("<I", chunk_header[4:])[0]
+            if chunk_id != b"fmt ":
+                # Chunks are padded to an even size
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+                continue
+            fmt = f.read(chunk_size)
+            if len(fmt) < 16:
+                return None
+            format_tag, channels, sample_rate, _, _, bits_per_sample = struct.unpack("<HHIIHH", fmt[:16])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                # The subformat GUID starts with the actual format tag
+                format_tag = struct.unpack("<H", fmt[24:26])[0]
+            return {"format_tag": format_tag, "channels": channels, "sample_rate": sample_rate,
+                    "bits_per_sample": bits_per_sample}
+
+def is_conformant(file_path):
+    """Return True if the file is already a wav in the target format, so converting it would change nothing."""
+    if os.path.splitext(file_path)[1].lower() != TARGET_EXTENSION:
+        return False
+    try:
+        header = read_wav_header(file_path)
+    except OSError:
+        return False
+    return (header is not None
+            and header["format_tag"] == WAVE_FORMAT_PCM
+            and header["sample_rate"] == TARGET_SAMPLE_RATE
+            and header["channels"] == TARGET_CHANNELS
+            and header["bits_per_sample"] == TARGET_SAMPLE_WIDTH * 8)
+
+def _soundfile_blocks(file_path):
+    # Decodes block by block, so memory does not grow with the length of the recording
+    with sf.SoundFile(file_path) as audio_file:
+        yield audio_file.samplerate
+        for block in audio_file.blocks(blocksize=BLOCK_FRAMES, dtype='float32', always_2d=True):
+            yield block.mean(axis=1)
+
+def _ffmpeg_blocks(file_path, format=None):
+    # Formats soundfile can't read (e.g. m4a, webm) are decoded by ffmpeg (the one pydub uses), which
+    # writes float32 samples to a pipe read BLOCK_FRAMES at a time, then downmixed and blocked exactly
+    # like _soundfile_blocks
+    stream = next(stream for stream in mediainfo_json(file_path)["streams"] if stream.get("codec_type") == "audio")
+    sample_rate, channels = int(stream["sample_rate"]), int(stream["channels"])
+    command = [get_encoder_name(), "-v", "error", "-nostdin"] + (["-f", format] if format else []) + [
+        "-i", file_path, "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ar", str(sample_rate), "-ac", str(channels), "-"]
+
+    # Errors go to a file, so a chatty decoder can't fill the stderr pipe while stdout is read
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
         try:
-            audio = AudioSegment.from_file(file_path)
-            
-            # Set the desired sample rate and number of channels
-            audio = audio.set_frame_rate(TARGET_SAMPLE_RATE)
-            audio = audio.set_channels(TARGET_CHANNELS)
-            
-            # Export the audio to the same file path, replacing the original
-            base_name = os.path.splitext(file_path)[0]
-            updated_filepath = f"{base_name}.wav"
-            audio.export(updated_filepath, format=TARGET_FORMAT)
-            log(f"Converted {file_path} to PCM format.")
-            log(f"Saved as {updated_filepath}")
+            yield sample_rate
+            block_bytes = BLOCK_FRAMES * channels * 4
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                block = np.frombuffer(data[:len(data) - len(data) % (channels * 4)], dtype='<f4')
+                yield block.reshape(-1, channels).mean(axis=1)
+            if process.wait() != 0:
+                errors.seek(0)
+                raise RuntimeError(f"ffmpeg could not decode {file_path}: {errors.read().decode(errors='replace').strip()}")
+        finally:
+            # Also reached when the caller stops early
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+def _decoded_blocks(file_path, format=None):
+    try:
+        sf.info(file_path)
+    except Exception:
+        return _ffmpeg_blocks(file_path, format)
+    return _soundfile_blocks(file_path)
+
+def to_pcm16(block):
+    """Quantise float samples in [-1, 1] to 16-bit PCM (resampling can overshoot full scale slightly)."""
+    return np.clip(np.round(block * 32768.0), -32768, 32767).astype(np.int16)
+
+def converted_blocks(file_path, quality="HQ", format=None):
+    """
+    Decode an audio file and convert it to the target format block by block.
+
+    Parameters:
+    - file_path: str, path to the audio file
+    - quality: str, soxr resampling quality, one of RESAMPLE_QUALITIES (default is "HQ")
+    - format: str, container format for ffmpeg, for formats soundfile can't read (default is None, guessed)
+
+    Returns:
+    - generator of int16 numpy arrays, mono samples at TARGET_SAMPLE_RATE
+    """
+    blocks = _decoded_blocks(file_path, format)
+    sample_rate = next(blocks)
+    if sample_rate == TARGET_SAMPLE_RATE:
+        for block in blocks:
+            yield to_pcm16(block)
+        return
+
+    resampler = soxr.ResampleStream(sample_rate, TARGET_SAMPLE_RATE, TARGET_CHANNELS, dtype='float32', quality=quality)
+    for block in blocks:
+        yield to_pcm16(resampler.resample_chunk(block))
+    yield to_pcm16(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+
+def load_converted(file_path, quality="HQ", format=None):
+    """
+    Decode an audio file and convert it to the target format in memory.
+
+    Parameters:
+    - file_path: str, path to the audio file
+    - quality: str, soxr resampling quality, one of RESAMPLE_QUALITIES (default is "HQ")
+    - format: str, container format for ffmpeg (default is None, guessed)
+
+    Returns:
+    - pydub AudioSegment with the same samples convert_audio would write
+    """
+    samples = np.concatenate(list(converted_blocks(file_path, quality, format)))
+    return AudioSegment(samples.tobytes(), frame_rate=TARGET_SAMPLE_RATE, sample_width=TARGET_SAMPLE_WIDTH,
+                        channels=TARGET_CHANNELS)
+
+def convert_audio(file_path, quality="HQ"):
+    """
+    Convert one audio file to a 16 kHz mono 16-bit wav, replacing the original.
+
+    The wav is written to a temporary file first and moved into place with os.replace,
+    so an interrupted conversion never leaves a half-written wav or loses the original.
+
+    Parameters:
+    - file_path: str, path to the audio file
+    - quality: str, soxr resampling quality, one of RESAMPLE_QUALITIES (default is "HQ")
+
+    Returns:
+    - (status, messages) tuple, status is "skipped", "converted" or "error"
+    """
+    if is_conformant(file_path):
+        return "skipped", [f"Skipped {file_path}: already in the target format."]
+
+    base_name = os.path.splitext(file_path)[0]
+    updated_filepath = f"{base_name}{TARGET_EXTENSION}"
+    temp_path = f"{updated_filepath}{TEMP_SUFFIX}"
+    try:
+        with sf.SoundFile(temp_path, 'w', samplerate=TARGET_SAMPLE_RATE, channels=TARGET_CHANNELS,
+                          subtype=f"PCM_{TARGET_SAMPLE_WIDTH * 8}", format=TARGET_FORMAT.upper()) as output:
+            for block in converted_blocks(file_path, quality):
+                output.write(block)
+
+        os.replace(temp_path, updated_filepath)
+        messages = [f"Converted {file_path} to PCM format.", f"Saved as {updated_filepath}"]
+        if updated_filepath != file_path:
             os.remove(file_path)
-            log(f"Deleted original file: {file_path}")
-        except Exception as e:
-            log(f"Error converting {file_path}: {e}")
+            messages.append(f"Deleted original file: {file_path}")
+        return "converted", messages
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return "error", [f"Error converting {file_path}: {e}"]
+
+def convert_directory(input_folder, log_file=LOG_FILE, workers=1, quality="HQ"):
+    """
+    Convert every audio file in a directory (recursively) to the target format.
+
+    Parameters:
+    - input_folder: str, directory containing the audio files
+    - log_file: str, path to the log file (default is LOG_FILE)
+    - workers: int, number of worker processes (default is 1, which runs serially)
+    - quality: str, soxr resampling quality, one of RESAMPLE_QUALITIES (default is "HQ")
+
+    Returns:
+    - dict counting the files per status
+    """
+    # Open the log file for writing
+    with open(log_file, "w") as log_handle:
+        def log(message):
+            log_handle.write(message + "\n")
+            print(message)
+
+        log("Starting conversion process...")
+        log(f"Target Sample Rate: {TARGET_SAMPLE_RATE}")
+        log(f"Target Channels: {TARGET_CHANNELS}")
+        log(f"Target format: {TARGET_FORMAT}")
+
+        # Leftovers of an interrupted run are not audio files
+        file_paths = sorted(os.path.join(root, file) for root, _, files in os.walk(input_folder) for file in files
+                            if not file.endswith(TEMP_SUFFIX))
+
+        task = partial(convert_audio, quality=quality)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(task, file_paths, chunksize=4))
+        else:
+            results = [task(file_path) for file_path in file_paths]
+
+        counts = {"skipped": 0, "converted": 0, "error": 0}
+        for status, messages in results:
+            counts[status] += 1
+            for message in messages:
+                log(message)
+
+        log(f"Converted {counts['converted']}, skipped {counts['skipped']} already in the target format, "
+            f"{counts['error']} errors.")
+        log("Conversion process completed.")
+        return counts
 
-    # Iterate over all files in the directory
-    for root, _, files in os.walk(input_folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            convert_audio(file_path)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert every audio file in a directory to a 16 kHz mono 16-bit PCM wav.")
+    parser.add_argument("directory", type=str, help="The directory containing the audio files.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default 1 runs serially).")
+    parser.add_argument("--quality", type=str, default="HQ", choices=RESAMPLE_QUALITIES,
+                        help="soxr resampling quality (default HQ).")
 
-    log("Conversion process completed.")
\ No newline at end of file
+    args = parser.parse_args()
+    convert_directory(args.directory, LOG_FILE, args.workers, args.quality)
@@ -1,10 +1,22 @@
 import os
-import sys
+import argparse
 import hashlib
+import soundfile as sf
 from pydub import AudioSegment
 from tqdm import tqdm
 
+from audio_fingerprint import open_fingerprint_index, is_indexed, find_match, add_fingerprint, fingerprint_file
+
 # Identifies duplicates and deletes a copy.
+#
+# Exact duplicates are found in tiers: files are grouped by their audio length read from the header and
+# only files sharing a group are decoded and hashed. Files whose header soundfile can't read (e.g. webm,
+# m4a) share one group, since a remuxed or re-encoded copy with identical audio can differ in anything
+# short of the decoded samples.
+# Re-encoded copies of the same recording are then found with acoustic fingerprints
+# (see audio_fingerprint.py), kept in a persistent index that later uploads are checked against.
+
+DEFAULT_INDEX_DIRECTORY = "./fingerprint_index"
 
 def write_log(log_file, message):
     with open(log_file, 'a') as f:
@@ -16,29 +28,119 @@ def calculate_hash(file_path):
     raw_data = audio.raw_data
     return hashlib.md5(raw_data).hexdigest()
 
-def find_duplicates(directory, log_file):
-    write_log(log_file, f"Scanning directory: {directory}")
+def length_key(file_path):
+    """
+    Return a key that is equal for files that could hold identical audio, without decoding them.
 
-    if not os.path.isdir(directory):
-        write_log(log_file, f"Directory does not exist: {directory}")
-        return
+    Parameters:
+    - file_path: str, path to the audio file
+
+    Returns:
+    - tuple of (frames, sample rate, channels) read from the header, or the same key
+      for every file in a format soundfile can't read
+    """
+    try:
+        info = sf.info(file_path)
+        return ("frames", info.frames, info.samplerate, info.channels)
+    except Exception:
+        return ("unreadable header",)
+
+def find_exact_duplicates(file_paths, log_file):
+    """
+    Find files with bit-identical decoded audio, decoding only files that share a length.
 
-    hash_dict = {}
-    duplicates = []
+    Parameters:
+    - file_paths: list of str, in the order duplicates are resolved (the first copy is kept)
+    - log_file: str, path to the log file
 
-    # Scan through the directory
-    for root, _, files in os.walk(directory):
-        for file in tqdm(files):
-            file_path = os.path.join(root, file)
+    Returns:
+    - dict mapping each duplicate to the file it duplicates
+    """
+    groups = {}
+    for file_path in file_paths:
+        try:
+            groups.setdefault(length_key(file_path), []).append(file_path)
+        except Exception as e:
+            write_log(log_file, f"Error processing file {file_path}: {e}")
+
+    candidates = [group for group in groups.values() if len(group) > 1]
+    write_log(log_file, f"{sum(len(group) for group in candidates)} of {len(file_paths)} files share a length with another file")
+
+    duplicates = {}
+    for group in tqdm(candidates):
+        hash_dict = {}
+        for file_path in group:
             try:
                 file_hash = calculate_hash(file_path)
                 if file_hash in hash_dict:
-                    duplicates.append(file_path)
+                    duplicates[file_path] = hash_dict[file_hash]
                     write_log(log_file, f"Duplicate found: {file_path} (Duplicate of {hash_dict[file_hash]})")
                 else:
                     hash_dict[file_hash] = file_path
             except Exception as e:
                 write_log(log_file, f"Error processing file {file_path}: {e}")
+    return duplicates
+
+def find_near_duplicates(file_paths, index_directory, log_file):
+    """
+    Check files against the fingerprint index, adding every file that is not a copy of an indexed recording.
+
+    Files already indexed (and unchanged since) are not fingerprinted again.
+
+    Parameters:
+    - file_paths: list of str, in the order duplicates are resolved (the first copy is kept)
+    - index_directory: str, fingerprint index directory
+    - log_file: str, path to the log file
+
+    Returns:
+    - dict mapping each near duplicate to the ID of the recording it copies
+    """
+    index = open_fingerprint_index(index_directory)
+    write_log(log_file, f"Fingerprint index {index_directory} holds {len(index['slots'])} recordings")
+
+    duplicates = {}
+    for file_path in tqdm(file_paths):
+        file_id = os.path.splitext(os.path.basename(file_path))[0]
+        try:
+            if is_indexed(index, file_id, file_path):
+                continue
+            fingerprint = fingerprint_file(file_path)
+            match = find_match(index, fingerprint, exclude_id=file_id)
+            if match is not None:
+                duplicates[file_path] = match[0]
+                write_log(log_file, f"Near duplicate found: {file_path} (Copy of {match[0]}, bit error rate {match[1]:.3f})")
+            else:
+                add_fingerprint(index, file_id, file_path, fingerprint)
+        except Exception as e:
+            write_log(log_file, f"Error fingerprinting file {file_path}: {e}")
+    return duplicates
+
+def find_duplicates(directory, log_file, index_directory=DEFAULT_INDEX_DIRECTORY, report_only=False):
+    """
+    Find exact and near duplicate recordings in a directory and delete every copy but the first.
+
+    Parameters:
+    - directory: str, directory containing the audio files
+    - log_file: str, path to the log file
+    - index_directory: str, fingerprint index directory, or None to only look for exact duplicates
+    - report_only: bool, log duplicates without deleting them (default is False)
+    """
+    write_log(log_file, f"Scanning directory: {directory}")
+
+    if not os.path.isdir(directory):
+        write_log(log_file, f"Directory does not exist: {directory}")
+        return
+
+    file_paths = sorted(os.path.join(root, file) for root, _, files in os.walk(directory) for file in files)
+
+    duplicates = find_exact_duplicates(file_paths, log_file)
+    if index_directory is not None:
+        remaining = [file_path for file_path in file_paths if file_path not in duplicates]
+        duplicates.update(find_near_duplicates(remaining, index_directory, log_file))
+
+    if report_only:
+        write_log(log_file, f"Found {len(duplicates)} duplicates, none deleted")
+        return
 
     # Delete duplicates
     for file_path in duplicates:
@@ -49,11 +151,13 @@ def find_duplicates(directory, log_file):
             write_log(log_file, f"Error deleting file {file_path}: {e}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <directory>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Delete duplicate and re-encoded copies of recordings in a directory.")
+    parser.add_argument("directory", type=str, help="The directory containing the audio files.")
+    parser.add_argument("--index", type=str, default=DEFAULT_INDEX_DIRECTORY, help="Fingerprint index directory.")
+    parser.add_argument("--exact_only", action="store_true", help="Only delete bit-identical copies, without fingerprinting.")
+    parser.add_argument("--report_only", action="store_true", help="Log duplicates without deleting them.")
 
-    directory = sys.argv[1]
+    args = parser.parse_args()
     log_file = "./logs/deleteDuplicates.log"
 
-    find_duplicates(directory, log_file)
+    find_duplicates(args.directory, log_file, None if args.exact_only else args.index, args.report_only)
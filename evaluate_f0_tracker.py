@@ -0,0 +1,101 @@
+import os
+import sys
+import csv
+import numpy as np
+
+from audio_cache import load_audio
+from extract_praat_data import extract_praat_data_batch, read_praat_pitch_arrays
+from featureExtractScripts import extract_f0_yin_batch, F0_TIME_STEP
+
+# Compares the NumPy F0 tracker against Praat on a directory of recordings and saves the agreement per file.
+# Agreement figures should be quoted together with the recordings they were measured on and the command,
+# e.g. python evaluate_f0_tracker.py <wav_directory>, which writes f0_tracker_evaluation.csv.
+
+def compare_with_praat(f0, voiced, pitch_arrays, time_step=F0_TIME_STEP):
+    """
+    Compare one file's NumPy F0 track with Praat's pitch track.
+
+    Praat's first candidate in each frame is the one chosen by its path finder (0 when unvoiced).
+    Each Praat frame time is matched to the nearest NumPy frame.
+
+    Parameters:
+    - f0: numpy array, F0 per frame from extract_f0_yin_batch
+    - voiced: numpy array of bool, voicing per frame from extract_f0_yin_batch
+    - pitch_arrays: dict returned by read_praat_pitch_arrays
+    - time_step: float, seconds between NumPy frames
+
+    Returns:
+    - dict with the number of frames compared, voicing agreement, gross pitch error
+      (share of frames voiced in both with more than 20% deviation) and the median
+      absolute deviation in cents over frames voiced in both
+    """
+    praat_f0 = pitch_arrays['frequency'][:, 0]
+    praat_times = pitch_arrays['x1'] + np.arange(len(praat_f0)) * pitch_arrays['dx']
+    frame_index = np.clip(np.round(praat_times / time_step).astype(int), 0, len(f0) - 1)
+
+    numpy_f0 = f0[frame_index]
+    numpy_voiced = voiced[frame_index]
+    praat_voiced = praat_f0 > 0
+    both_voiced = numpy_voiced & praat_voiced
+
+    if both_voiced.any():
+        deviation = np.abs(numpy_f0[both_voiced] - praat_f0[both_voiced]) / praat_f0[both_voiced]
+        cents = np.abs(1200 * np.log2(numpy_f0[both_voiced] / praat_f0[both_voiced]))
+        gross_pitch_error = float(np.mean(deviation > 0.2))
+        median_cents = float(np.median(cents))
+    else:
+        gross_pitch_error = np.nan
+        median_cents = np.nan
+
+    return {
+        "frames": len(praat_f0),
+        "voicing_agreement": float(np.mean(numpy_voiced == praat_voiced)),
+        "gross_pitch_error": gross_pitch_error,
+        "median_cents": median_cents
+    }
+
+def main(directory, output_file, n_processes=None):
+    file_paths = [os.path.join(directory, file) for file in sorted(os.listdir(directory)) if file.endswith('.wav')]
+    print(f"Found {len(file_paths)} .wav files in the directory.")
+
+    praat_data = extract_praat_data_batch(file_paths, n_processes, parser=read_praat_pitch_arrays)
+
+    results = []
+    for file_path in file_paths:
+        pitch_arrays = praat_data.get(file_path)
+        if not pitch_arrays:
+            print(f"Skipping {file_path}: no Praat output")
+            continue
+        y, sr = load_audio(file_path)
+        (f0, voiced), = extract_f0_yin_batch([y], sr)
+        result = compare_with_praat(f0, voiced, pitch_arrays)
+        result["file"] = os.path.basename(file_path)
+        results.append(result)
+        print(result)
+
+    if not results:
+        print("No files could be compared.")
+        return results
+
+    with open(output_file, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=["file", "frames", "voicing_agreement", "gross_pitch_error", "median_cents"])
+        writer.writeheader()
+        writer.writerows(results)
+
+    frames = np.array([result["frames"] for result in results])
+    for metric in ["voicing_agreement", "gross_pitch_error", "median_cents"]:
+        values = np.array([result[metric] for result in results])
+        valid = ~np.isnan(values)
+        if valid.any():
+            print(f"Overall {metric}: {np.average(values[valid], weights=frames[valid]):.4f}")
+    print(f"Saved per-file results to {output_file}")
+
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python evaluate_f0_tracker.py <wav_directory>")
+        sys.exit(1)
+    else:
+        directory = sys.argv[1]
+        main(directory, "f0_tracker_evaluation.csv")
@@ -1,107 +1,249 @@
 import os
+import io
 import sys
+import argparse
 import numpy as np
+from functools import partial
 
-from featureExtractScripts import higuchi_fd, calculate_dfa2, get_f0_values, extract_mfcc, extract_tempo
-from fileSaveScripts import save_numpy_file, file_exists, save_temp_file
+from audio_cache import load_audio
+from featureExtractScripts import higuchi_fd_multi, calculate_dfa2, calculate_dfa2_multi, get_f0_arrays, get_f0_arrays_batch, extract_f0_yin_batch, extract_mfcc_grid, extract_rhythm_grid, DFA_SAMPLE_RATE
+from fileSaveScripts import save_feature, feature_exists, save_temp_file
+from parallel_extraction import run_in_order
+from extract_praat_data import pitch_arrays_to_ragged
+from extraction_manifest import register_audio
 
-def save_file(data, file_name, *args):
-    with open(log_file, 'a') as log:
-        file_name = file_name.replace('.wav', '')
-        if data is not None:
-            save_numpy_file(data, file_name, *args)
-            log.write(f"File saved as {file_name}\n")
-        else:
-            print(f"Error extracting feature from {file_name}")
-            log.write(f"Error extracting feature from {file_name}\n")
-
-def main(directory,log_file):
+# Features to extract
+extract_hfd = False
+extract_dfa2 = False
+extract_f0 = False
+f0_engine = "praat" # "praat" runs the Praat binary, "numpy" uses the in-process YIN tracker
+extract_mfcc_bool = True
+extract_tempo_bool = True
+
+def save_file(data, file_name, log, *args):
+    file_name = file_name.replace('.wav', '')
+    if data is not None:
+        save_feature(data, file_name, *args)
+        log.write(f"File saved as {file_name}\n")
+    else:
+        print(f"Error extracting feature from {file_name}")
+        log.write(f"Error extracting feature from {file_name}\n")
+
+def save_f0_features(pitch_arrays, file_name, log):
+    """
+    Save the F0 features of one file from its parsed Praat pitch arrays.
+
+    all_f0_values keeps the previous layout (every candidate frequency, frame after frame).
+    frame_candidates is the padded frames x maxnCandidates matrix, which keeps frame boundaries.
+    """
+    feature_name = "f0"
+    if pitch_arrays is None:
+        save_file(None, file_name, log, "speechFeatures", feature_name, "all_f0_values", "default")
+        return
+    all_f0_values, _ = pitch_arrays_to_ragged(pitch_arrays)
+    save_file(all_f0_values, file_name, log, "speechFeatures", feature_name, "all_f0_values", "default")
+    save_file(pitch_arrays['frequency'], file_name, log, "speechFeatures", feature_name, "frame_candidates", "default")
+
+def f0_features_exist(file_name):
+    """Check whether both F0 features saved by save_f0_features are stored and current for a file."""
+    return all(feature_exists(file_name, "speechFeatures", "f0", f0_feature, "default")
+               for f0_feature in ("all_f0_values", "frame_candidates"))
+
+def process_file(file_name, directory):
+    """
+    Extract every enabled feature for a single .wav file.
+
+    Log lines are collected in memory and returned, so files processed by worker
+    processes can be written to the log in the same order as a serial run.
+
+    Parameters:
+    - file_name: str, name of the .wav file inside directory
+    - directory: str, directory containing the file
+
+    Returns:
+    - str, log text for the file
+    """
+    log = io.StringIO()
+    log.write(f"Processing {file_name}\n")
+    file_path = os.path.join(directory, file_name)
+    # Stored features only count as done if they were made from this exact audio content
+    register_audio(file_path)
+
+    if extract_hfd:
+        feature_name = "higuchi_fd"
+        kmax_values = [2, 3, 5, 7, 10]
+        norm_values = [True, False]
+        missing = [(kmax, norm) for kmax in kmax_values for norm in norm_values
+                   if not feature_exists(file_name, "speechFeatures", feature_name, f"kmax={kmax}", f"norm={norm}")]
+        if missing:
+            # Decode once and compute every kmax/norm combination from one set of curve lengths
+            signal, _ = load_audio(file_path)
+            hfd_values = higuchi_fd_multi(signal, kmax_values, norm_values)
+            for kmax, norm in missing:
+                save_file(hfd_values[(kmax, norm)], file_name, log, "speechFeatures", feature_name, f"kmax={kmax}", f"norm={norm}")
+
+    if extract_dfa2:
+        feature_name = "dfa2"
+        nvals_options = [
+            [256, 512, 1024, 2048, 4096, 8192, 16384, 32768],
+            [128, 256, 512, 1024, 2048, 4096],
+            [512, 1024, 2048, 4096, 8192, 16384, 32768, 65536]
+        ]                 
+        overlap_values = [True, False]
+        order_values = [1,2]
+        fit_trend_values = ['poly']
+        fit_exp_values = ['RANSAC']
+        debug_plot_value = False
+
+        missing = [dict(nvals=nvals, overlap=overlap, order=order, fit_trend=fit_trend, fit_exp=fit_exp)
+                   for nvals in nvals_options
+                   for overlap in overlap_values
+                   for order in order_values
+                   for fit_trend in fit_trend_values
+                   for fit_exp in fit_exp_values
+                   if not feature_exists(file_name, "speechFeatures", feature_name, f"overlap={overlap}", f"order={order}", f"nvals={nvals}", f"fit_trend={fit_trend}", f"fit_exp={fit_exp}")]
+        if missing:
+            y, sr = load_audio(file_path, sr=DFA_SAMPLE_RATE)
+            if debug_plot_value:
+                # Debug plots need nolds' own plotting, so compute each configuration separately
+                for config in missing:
+                    extractedFeature, temp_file = calculate_dfa2(y, sr=sr, debug_plot=debug_plot_value, **config)
+                    save_file(extractedFeature, file_name, log, "speechFeatures", feature_name, f"overlap={config['overlap']}", f"order={config['order']}", f"nvals={config['nvals']}", f"fit_trend={config['fit_trend']}", f"fit_exp={config['fit_exp']}")
+                    if temp_file is not None:
+                        save_temp_file(temp_file, file_name, "debug", feature_name, f"overlap={config['overlap']}", f"order={config['order']}", f"nvals={config['nvals']}", f"fit_trend={config['fit_trend']}", f"fit_exp={config['fit_exp']}")
+            else:
+                # One profile per file, each window fluctuation fitted once across all configurations
+                dfa_values = calculate_dfa2_multi(y, missing, sr=sr)
+                for config in missing:
+                    extractedFeature = dfa_values[(tuple(config['nvals']), config['overlap'], config['order'], config['fit_trend'], config['fit_exp'])]
+                    save_file(extractedFeature, file_name, log, "speechFeatures", feature_name, f"overlap={config['overlap']}", f"order={config['order']}", f"nvals={config['nvals']}", f"fit_trend={config['fit_trend']}", f"fit_exp={config['fit_exp']}")
+            
+    if extract_f0 and f0_engine == "praat":
+        if not f0_features_exist(file_name):
+            save_f0_features(get_f0_arrays(file_path), file_name, log)
+    
+    if extract_mfcc_bool:
+        feature_name = "mfcc"
+        n_mfcc_vals = [12, 13, 20]
+        n_fft_vals = [1000, 2000, 4000]
+        hop_length_div_vals = [2, 3, 4] # Hop length is n_fft / hop_length_div
+        n_mels_vals = [40, 80, 128]
+        fmin_vals = 0
+        fmax_vals = [None, 4000, 8000]
+        missing = [(n_mfcc, n_fft, hop_length_div, n_mels, fmax)
+                   for n_mfcc in n_mfcc_vals
+                   for n_fft in n_fft_vals
+                   for hop_length_div in hop_length_div_vals
+                   for n_mels in n_mels_vals
+                   for fmax in fmax_vals
+                   if not feature_exists(file_name, "speechFeatures", feature_name, f"n_mfcc={n_mfcc}", f"n_fft={n_fft}", f"hop_length_div={hop_length_div}", f"n_mels={n_mels}", f"fmax={fmax}")]
+        if missing:
+            # One power spectrogram per (n_fft, hop_length_div) pair serves the whole grid
+            y, sr = load_audio(file_path)
+            mfccs = extract_mfcc_grid(y, missing, sr=sr, fmin=fmin_vals)
+            if mfccs is not None:
+                for n_mfcc, n_fft, hop_length_div, n_mels, fmax in missing:
+                    extractedFeature = mfccs[(n_mfcc, n_fft, hop_length_div, n_mels, fmax)]
+                    save_file(extractedFeature, file_name, log, "speechFeatures", feature_name, f"n_mfcc={n_mfcc}", f"n_fft={n_fft}", f"hop_length_div={hop_length_div}", f"n_mels={n_mels}", f"fmax={fmax}")
+
+    if extract_tempo_bool:
+        feature_name = "tempo"
+        hop_length_vals = [256, 512, 1024]
+        missing = [(rhythm_feature, hop_length)
+                   for hop_length in hop_length_vals
+                   for rhythm_feature in [feature_name, "speech_rate"]
+                   if not feature_exists(file_name, "speechFeatures", rhythm_feature, f"hop_length={hop_length}")]
+        if missing:
+            # Onset envelopes for every hop length come from one shared mel spectrogram
+            y, sr = load_audio(file_path)
+            rhythm = extract_rhythm_grid(y, sorted(set(hop_length for _, hop_length in missing)), sr=sr)
+            if rhythm is not None:
+                for rhythm_feature, hop_length in missing:
+                    save_file(rhythm[hop_length][rhythm_feature], file_name, log, "speechFeatures", rhythm_feature, f"hop_length={hop_length}")
+
+    return log.getvalue()
+
+def extract_f0_batch(directory, file_names, log, n_processes=1):
+    """
+    Extract F0 for every file that is missing it, running several files per Praat process.
+
+    Files that Praat fails on are left missing, so process_file falls back to
+    extracting them one at a time.
+
+    Parameters:
+    - directory: str, directory containing the files
+    - file_names: list of str, names of the .wav files
+    - log: file-like object the log lines are written to
+    - n_processes: int, number of concurrent Praat processes
+    """
+    # These passes run before process_file, which registers the audio of everything else
+    for file_name in file_names:
+        register_audio(os.path.join(directory, file_name))
+    missing = [file_name for file_name in file_names if not f0_features_exist(file_name)]
+    if not missing:
+        return
+
+    f0_arrays = get_f0_arrays_batch([os.path.join(directory, file_name) for file_name in missing], n_processes)
+    for file_name in missing:
+        pitch_arrays = f0_arrays.get(os.path.join(directory, file_name))
+        if pitch_arrays is not None:
+            log.write(f"Processing {file_name}\n")
+            save_f0_features(pitch_arrays, file_name, log)
+
+def extract_f0_numpy(directory, file_names, log, batch_size=32):
+    """
+    Extract F0 with the NumPy YIN tracker for every file that is missing it, a batch of files at a time.
+
+    yin_f0 holds the F0 track and yin_voiced the per-frame voicing decisions that go with it.
+
+    Parameters:
+    - directory: str, directory containing the files
+    - file_names: list of str, names of the .wav files
+    - log: file-like object the log lines are written to
+    - batch_size: int, number of files tracked together (default is 32)
+    """
+    feature_name = "f0"
+    for file_name in file_names:
+        register_audio(os.path.join(directory, file_name))
+    missing = [file_name for file_name in file_names
+               if not all(feature_exists(file_name, "speechFeatures", feature_name, yin_feature, "default")
+                          for yin_feature in ("yin_f0", "yin_voiced"))]
+
+    for start in range(0, len(missing), batch_size):
+        # Group the batch by sample rate, since every signal in a call must share one
+        batches = {}
+        for file_name in missing[start:start + batch_size]:
+            log.write(f"Processing {file_name}\n")
+            try:
+                y, sr = load_audio(os.path.join(directory, file_name))
+                batches.setdefault(sr, []).append((file_name, y))
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                save_file(None, file_name, log, "speechFeatures", feature_name, "yin_f0", "default")
+
+        for sr, batch in batches.items():
+            tracks = extract_f0_yin_batch([y for _, y in batch], sr)
+            for (file_name, _), (f0, voiced) in zip(batch, tracks):
+                save_file(f0, file_name, log, "speechFeatures", feature_name, "yin_f0", "default")
+                save_file(voiced, file_name, log, "speechFeatures", feature_name, "yin_voiced", "default")
+
+def main(directory, log_file, workers=1, chunksize=1, retries=1):
     with open(log_file, 'a') as log:
         if not os.path.exists(directory):
             print(f"The folder {directory} does not exist.")
             log.write(f"The folder {directory} does not exist.\n")
             sys.exit(1)
 
-        saved_file_extension = "npy"
-
-        for file_name in os.listdir(directory):
-            if file_name.endswith('.wav'):
-                log.write(f"Processing {file_name}\n")
-                file_path = os.path.join(directory, file_name)
-
-                extract_hfd = False
-                extract_dfa2 = False
-                extract_f0 = False
-                extract_mfcc_bool = True
-                extract_tempo_bool = True
-                
-                if extract_hfd:
-                    feature_name = "higuchi_fd"
-                    kmax_values = [2, 3, 5, 7, 10]
-                    norm_values = [True, False]
-                    for kmax in kmax_values:
-                        for norm in norm_values:
-                            if not file_exists(file_name, saved_file_extension, "speechFeatures", feature_name, f"kmax={kmax}", f"norm={norm}"):
-                                extractedFeature = higuchi_fd(file_path, kmax, norm)
-                                save_file(extractedFeature, file_name, "speechFeatures", feature_name, f"kmax={kmax}", f"norm={norm}")
-
-                if extract_dfa2:
-                    feature_name = "dfa2"
-                    nvals_options = [
-                        [256, 512, 1024, 2048, 4096, 8192, 16384, 32768],
-                        [128, 256, 512, 1024, 2048, 4096],
-                        [512, 1024, 2048, 4096, 8192, 16384, 32768, 65536]
-                    ]                 
-                    overlap_values = [True, False]
-                    order_values = [1,2]
-                    fit_trend_values = ['poly']
-                    fit_exp_values = ['RANSAC']
-                    debug_plot_value = False
-
-                    for nvals in nvals_options:
-                        for overlap in overlap_values:
-                            for order in order_values:
-                                for fit_trend in fit_trend_values:
-                                    for fit_exp in fit_exp_values:
-                                        if not file_exists(file_name, saved_file_extension, "speechFeatures", feature_name, f"overlap={overlap}", f"order={order}", f"nvals={nvals}", f"fit_trend={fit_trend}", f"fit_exp={fit_exp}"):
-                                            extractedFeature, temp_file = calculate_dfa2(file_path, overlap=overlap, order=order, fit_trend=fit_trend, fit_exp=fit_exp, nvals=nvals, debug_plot=debug_plot_value)
-                                            save_file(extractedFeature, file_name, "speechFeatures", feature_name, f"overlap={overlap}", f"order={order}", f"nvals={nvals}", f"fit_trend={fit_trend}", f"fit_exp={fit_exp}")
-                                            if temp_file is not None:
-                                                save_temp_file(temp_file, file_name, "debug", feature_name, f"overlap={overlap}", f"order={order}", f"nvals={nvals}", f"fit_trend={fit_trend}", f"fit_exp={fit_exp}")
-                        
-                if extract_f0:
-                    feature_name = "f0"
-                    if not file_exists(file_name, saved_file_extension, "speechFeatures", feature_name, "default"):
-                        extractedFeature = np.concatenate(get_f0_values(file_path))
-                        save_file(extractedFeature, file_name, "speechFeatures", feature_name, "all_f0_values", "default")
-                
-                if extract_mfcc_bool:
-                    feature_name = "mfcc"
-                    n_mfcc_vals = [12, 13, 20]
-                    n_fft_vals = [1000, 2000, 4000]
-                    hop_length_div_vals = [2, 3, 4] # Hop length is n_fft / hop_length_div
-                    n_mels_vals = [40, 80, 128]
-                    fmin_vals = 0
-                    fmax_vals = [None, 4000, 8000]
-                    sample_rate = 16000 
-                    for n_mfcc in n_mfcc_vals:
-                        for n_fft in n_fft_vals:
-                            for hop_length_div in hop_length_div_vals:
-                                for n_mels in n_mels_vals:
-                                    for fmax in fmax_vals:
-                                        if not file_exists(file_name, saved_file_extension, "speechFeatures", feature_name, f"n_mfcc={n_mfcc}", f"n_fft={n_fft}", f"hop_length_div={hop_length_div}", f"n_mels={n_mels}", f"fmax={fmax}"):
-                                            extractedFeature = extract_mfcc(file_path, n_mfcc=n_mfcc, n_fft=n_fft, hop_length_div=hop_length_div, n_mels=n_mels, fmax=fmax, sr=sample_rate)
-                                            if extractedFeature is not None:
-                                                save_file(extractedFeature, file_name, "speechFeatures", feature_name, f"n_mfcc={n_mfcc}", f"n_fft={n_fft}", f"hop_length_div={hop_length_div}", f"n_mels={n_mels}", f"fmax={fmax}")
-
-                if extract_tempo_bool:
-                    feature_name = "tempo"
-                    hop_length_vals = [256, 512, 1024]
-                    for hop_length in hop_length_vals:
-                        if not file_exists(file_name, saved_file_extension, "speechFeatures", feature_name, f"hop_length={hop_length}"):
-                            extractedFeature = extract_tempo(file_path)
-                            if extractedFeature is not None:
-                                save_file(extractedFeature, file_name, "speechFeatures", feature_name, f"hop_length={hop_length}")
+        file_names = [file_name for file_name in os.listdir(directory) if file_name.endswith('.wav')]
+
+        if extract_f0 and f0_engine == "numpy":
+            extract_f0_numpy(directory, file_names, log)
+        elif extract_f0:
+            # Praat is run once per batch of files rather than once per file
+            extract_f0_batch(directory, file_names, log, max(workers, 1))
+
+        for file_log in run_in_order(partial(process_file, directory=directory), file_names, workers, chunksize, retries):
+            log.write(file_log)
 
         log.write(f"Feature extraction script completed.\n\n")
 
@@ -109,8 +251,11 @@ if __name__ == "__main__":
 
     log_file = "./logs/extractFeatures.log"
 
-    if len(sys.argv) != 2:
-        print("Usage: python extractFeatures.py <directory>")
-    else:
-        directory = sys.argv[1]
-        main(directory,log_file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract speech features from every .wav file in a directory.")
+    parser.add_argument("directory", type=str, help="The directory containing the audio files.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default 1 runs serially).")
+    parser.add_argument("--chunksize", type=int, default=1, help="Number of files sent to a worker at a time.")
+    parser.add_argument("--retries", type=int, default=1, help="Extra attempts for a file that raises an error.")
+
+    args = parser.parse_args()
+    main(args.directory, log_file, args.workers, args.chunksize, args.retries)
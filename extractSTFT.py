@@ -1,112 +1,170 @@
 import os
+import io
 import sys
+import argparse
 import numpy as np
 import librosa
 import traceback
+from functools import partial
 
-from fileSaveScripts import save_numpy_file, file_exists
+from audio_cache import resolve_audio
+from fileSaveScripts import save_feature, save_feature_chunks, feature_exists
+from parallel_extraction import run_in_order
+from extraction_manifest import register_audio
 
-def save_file(data, file_name, *args):
-    with open(log_file, 'a') as log:
-        file_name = file_name.replace('.wav', '')
-        if data is not None:
-            save_numpy_file(data, file_name, *args)
-            log.write(f"File saved as {file_name}\n")
-        else:
-            print(f"Error extracting feature from {file_name}")
-            log.write(f"Error extracting feature from {file_name}\n")
+# Sample rate the STFT has always been computed at (librosa's default load rate)
+STFT_SAMPLE_RATE = 22050
+
+# Features to extract
+extract_stft_bool = True
+extract_stft_segmented_bool = True
+
+def save_file(data, file_name, log, *args):
+    file_name = file_name.replace('.wav', '')
+    if data is not None:
+        save_feature(data, file_name, *args)
+        log.write(f"File saved as {file_name}\n")
+    else:
+        print(f"Error extracting feature from {file_name}")
+        log.write(f"Error extracting feature from {file_name}\n")
 
 def normalize_stft(stft):
     stft_normalized = librosa.util.normalize(stft)
     return stft_normalized
 
-def extract_stft(file_path, window_length, hop_scale, normalise, log_file):
+def extract_stft(audio, window_length, hop_scale, normalise, log, sr=None):
+    # audio is a file path or a decoded signal at sample rate sr
+    file_path = audio if isinstance(audio, str) else "<decoded signal>"
     try:
-        y, sr = librosa.load(file_path)
+        y, sr = resolve_audio(audio, sr, target_sr=STFT_SAMPLE_RATE)
         hop_length = int(window_length * hop_scale)
         stft = np.abs(librosa.stft(y, n_fft=window_length, hop_length=hop_length))
         if normalise:
             stft = normalize_stft(stft)
-        with open(log_file, 'a') as log:
-            log.write(f"STFT extracted successfully for file {file_path}\n")
+        log.write(f"STFT extracted successfully for file {file_path}\n")
         return stft
     except Exception as e:
         error_message = f"Error extracting STFT for file {file_path}: {e}\n{traceback.format_exc()}\n"
         print(error_message)
-        with open(log_file, 'a') as log:
-            log.write(error_message)
+        log.write(error_message)
         return None
     
 def flatten_numpy_array(array):
     return array.flatten()
 
-def extract_features_from_segments(stft_data, window_length, hop_scale, normalize, log_file):
-    features = []
-    hop_length = int(window_length * hop_scale)
+def segment_batches(stft_data, window_length, hop_scale, normalize, batch_size=64):
+    """
+    Yield flattened STFT segments in batches, using a strided view instead of copying each segment.
+
+    Segments are window_length frames long and start every int(window_length * hop_scale)
+    frames. A final zero-padded segment covers the remaining frames when the total is not
+    a multiple of window_length. Each batch is normalised in one vectorised call.
 
+    Parameters:
+    - stft_data: (frequency bins, frames) STFT magnitude array
+    - window_length: int, segment length in frames
+    - hop_scale: float, segment hop as a fraction of window_length
+    - normalize: bool, normalise each segment
+    - batch_size: int, number of segments per yielded batch (default is 64)
+
+    Returns:
+    - generator of (segments, frequency bins * window_length) arrays
+    """
+    hop_length = int(window_length * hop_scale)
     num_frames = stft_data.shape[1]
-    num_segments = (num_frames - window_length) // hop_length + 1
-    
-    with open(log_file, 'a') as log:
-        for i in range(num_segments):
-            segment = stft_data[:, i * hop_length : i * hop_length + window_length]
-            if normalize:
-                segment = normalize_stft(segment)
-            segment_flattened = flatten_numpy_array(segment)
-            features.append(segment_flattened)
-        
-        # Handle remaining part if the total length is not a multiple of window_length
-        remaining_frames = num_frames % window_length
-        if remaining_frames != 0:
-            segment = stft_data[:, -remaining_frames:]
-            # Pad with zeros to make it of window_length size
-            padding_needed = window_length - remaining_frames
-            segment = np.pad(segment, ((0, 0), (0, padding_needed)), 'constant')
+    num_segments = max((num_frames - window_length) // hop_length + 1, 0)
+
+    if num_segments > 0:
+        # (segments, frequency bins, window_length) view onto stft_data, no copies
+        segments = np.lib.stride_tricks.sliding_window_view(stft_data, window_length, axis=1)[:, ::hop_length][:, :num_segments]
+        segments = segments.transpose(1, 0, 2)
+        for start in range(0, num_segments, batch_size):
+            batch = segments[start:start + batch_size]
             if normalize:
-                segment = normalize_stft(segment)
-            segment_flattened = flatten_numpy_array(segment)
-            features.append(segment_flattened)
-        
-        feature_shape = np.array(features).shape
-        log.write(f"Extracted STFT from segments for file STFT data.\n")
-        log.write(f"Extracted feature with shape: {feature_shape}\n")
-        return np.array(features)
+                batch = librosa.util.normalize(batch, axis=1)
+            yield batch.reshape(len(batch), -1)
 
+    # Handle remaining part if the total length is not a multiple of window_length
+    remaining_frames = num_frames % window_length
+    if remaining_frames != 0:
+        segment = stft_data[:, -remaining_frames:]
+        # Pad with zeros to make it of window_length size
+        padding_needed = window_length - remaining_frames
+        segment = np.pad(segment, ((0, 0), (0, padding_needed)), 'constant')
+        if normalize:
+            segment = normalize_stft(segment)
+        yield segment.reshape(1, -1)
 
-def main(directory,log_file):
+def extract_features_from_segments(stft_data, window_length, hop_scale, normalize, log):
+    features = np.concatenate(list(segment_batches(stft_data, window_length, hop_scale, normalize)))
+
+    feature_shape = features.shape
+    log.write(f"Extracted STFT from segments for file STFT data.\n")
+    log.write(f"Extracted feature with shape: {feature_shape}\n")
+    return features
+
+def process_file(file_name, directory):
+    """
+    Extract the STFT features for a single .wav file.
+
+    Log lines are collected in memory and returned, so files processed by worker
+    processes can be written to the log in the same order as a serial run.
+
+    Parameters:
+    - file_name: str, name of the .wav file inside directory
+    - directory: str, directory containing the file
+
+    Returns:
+    - str, log text for the file
+    """
+    log = io.StringIO()
+    log.write(f"Processing {file_name}\n")
+    file_path = os.path.join(directory, file_name)
+    # Stored features only count as done if they were made from this exact audio content
+    register_audio(file_path)
+
+    if extract_stft_bool:
+        feature_name = "stft"
+        window_values = [320, 512, 1024]
+        hop_scale_values = [0.5, 0.25]
+        norm_values = [True, False]
+        for window in window_values:
+            for hop_scale in hop_scale_values:
+                hop_length = int(window * hop_scale)
+                missing_norms = [norm for norm in norm_values
+                                 if not feature_exists(file_name, "speechFeatures", feature_name, f"window={window}", f"hop_length={hop_length}", f"norm={norm}")]
+                if not missing_norms:
+                    continue
+
+                # One STFT serves both the raw and the normalised variants (decoded once per file through the audio cache)
+                stft = extract_stft(file_path, window, hop_scale, False, log)
+                for norm in missing_norms:
+                    extractedstft = normalize_stft(stft) if norm and stft is not None else stft
+                    if extractedstft is None:
+                        save_file(None, file_name, log, "speechFeatures", feature_name, f"window={window}", f"hop_length={hop_length}", f"norm={norm}")
+                        continue
+                    save_file(flatten_numpy_array(extractedstft), file_name, log, "speechFeatures", feature_name, f"window={window}", f"hop_length={hop_length}", f"norm={norm}")
+                    if(extract_stft_segmented_bool):
+                        # Segments are streamed into the feature store a batch at a time
+                        segment_size = extractedstft.shape[0] * window
+                        num_values = save_feature_chunks(segment_batches(extractedstft, window, hop_scale, norm), file_name.replace('.wav', ''), "speechFeatures", f"{feature_name}_segmented", f"window={window}", f"hop_length={hop_length}", f"norm={norm}")
+                        log.write(f"Extracted STFT from segments for file STFT data.\n")
+                        log.write(f"Extracted feature with shape: {(num_values // segment_size, segment_size)}\n")
+                        log.write(f"File saved as {file_name.replace('.wav', '')}\n")
+
+    return log.getvalue()
+
+def main(directory, log_file, workers=1, chunksize=1, retries=1):
     with open(log_file, 'a') as log:
         if not os.path.exists(directory):
             print(f"The folder {directory} does not exist.")
             log.write(f"The folder {directory} does not exist.\n")
             sys.exit(1)
 
-        saved_file_extension = "npy"
-
-        for file_name in os.listdir(directory):
-            if file_name.endswith('.wav'):
-                log.write(f"Processing {file_name}\n")
-                file_path = os.path.join(directory, file_name)
-
-                extract_stft_bool = True
-                extract_stft_segmented_bool = True
-                
-                if extract_stft_bool:
-                    feature_name = "stft"
-                    window_values = [320, 512, 1024]
-                    hop_scale_values = [0.5, 0.25]
-                    norm_values = [True, False]
-                    for window in window_values:
-                        for hop_scale in hop_scale_values:
-                            hop_length = int(window * hop_scale)
-                            for norm in norm_values:
-                                if not file_exists(file_name, saved_file_extension, "speechFeatures", feature_name, f"window={window}", f"hop_length={hop_length}", f"norm={norm}"):
-                                    extractedstft = extract_stft(file_path, window, hop_scale, norm, log_file)
-                                    extractedstft_flattened = flatten_numpy_array(extractedstft)
-                                    save_file(extractedstft_flattened, file_name, "speechFeatures", feature_name, f"window={window}", f"hop_length={hop_length}", f"norm={norm}")
-                                    if(extract_stft_segmented_bool):
-                                        extractedstft_segmented = extract_features_from_segments(extractedstft, window, hop_scale, norm, log_file)
-                                        extractedstft_segmented_flattened = flatten_numpy_array(extractedstft_segmented)
-                                        save_file(extractedstft_segmented_flattened, file_name, "speechFeatures", f"{feature_name}_segmented", f"window={window}", f"hop_length={hop_length}", f"norm={norm}")
+        file_names = [file_name for file_name in os.listdir(directory) if file_name.endswith('.wav')]
+
+        for file_log in run_in_order(partial(process_file, directory=directory), file_names, workers, chunksize, retries):
+            log.write(file_log)
 
         log.write(f"Feature extraction script completed.\n\n")
 
@@ -114,8 +172,11 @@ if __name__ == "__main__":
 
     log_file = "./logs/extractSTFT.log"
 
-    if len(sys.argv) != 2:
-        print("Usage: python extractFeatures.py <directory>")
-    else:
-        directory = sys.argv[1]
-        main(directory,log_file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract STFT features from every .wav file in a directory.")
+    parser.add_argument("directory", type=str, help="The directory containing the audio files.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default 1 runs serially).")
+    parser.add_argument("--chunksize", type=int, default=1, help="Number of files sent to a worker at a time.")
+    parser.add_argument("--retries", type=int, default=1, help="Extra attempts for a file that raises an error.")
+
+    args = parser.parse_args()
+    main(args.directory, log_file, args.workers, args.chunksize, args.retries)
@@ -62,7 +62,102 @@ def read_praat_output(file_path):
     
     return data
 
-def extract_praat_data(wav_file_path):
+def read_praat_pitch_arrays(file_path, fill_value=0.0):
+    """
+    Parse a Praat Pitch text file into NumPy arrays in a single streaming pass.
+
+    The file is read line by line and the arrays are allocated from the nx and
+    maxnCandidates header values, so memory stays flat however long the recording is.
+    Candidate slots beyond a frame's nCandidates are set to fill_value, which keeps
+    the frame structure that np.concatenate of the per-frame lists loses.
+
+    Parameters:
+    - file_path: str, path to the Praat Pitch text file
+    - fill_value: float, value for unused candidate slots (default is 0.0, Praat's unvoiced frequency)
+
+    Returns:
+    - dict with the header values (xmin, xmax, nx, dx, x1, ceiling, maxnCandidates) and
+      frequency and strength (frames x maxnCandidates), intensity (frames) and
+      n_candidates (frames) arrays
+    """
+    data = {}
+    frame = candidate = -1
+
+    with open(file_path, 'r') as file:
+        for line in file:
+            key, separator, value = line.partition('=')
+            key = key.strip()
+            if not separator:
+                # Section headers such as "frames [12]:" and "candidates [3]:"
+                if key.startswith('frames ['):
+                    index = key[len('frames ['):key.index(']')]
+                    if index:
+                        frame = int(index) - 1
+                        candidate = -1
+                elif key.startswith('candidates ['):
+                    index = key[len('candidates ['):key.index(']')]
+                    if index:
+                        candidate = int(index) - 1
+                continue
+
+            value = value.strip()
+            if key == 'frequency':
+                data['frequency'][frame, candidate] = float(value)
+            elif key == 'strength':
+                data['strength'][frame, candidate] = float(value)
+            elif key == 'intensity':
+                data['intensity'][frame] = float(value)
+            elif key == 'nCandidates':
+                data['n_candidates'][frame] = int(value)
+            elif not value.startswith('"'):
+                data[key] = float(value)
+                if key == 'maxnCandidates':
+                    # nx precedes maxnCandidates in the header, so the arrays can be allocated here
+                    n_frames, max_candidates = int(data['nx']), int(value)
+                    data['frequency'] = np.full((n_frames, max_candidates), fill_value)
+                    data['strength'] = np.full((n_frames, max_candidates), fill_value)
+                    data['intensity'] = np.zeros(n_frames)
+                    data['n_candidates'] = np.zeros(n_frames, dtype=np.int64)
+
+    return data
+
+def pitch_arrays_to_ragged(pitch_arrays, field='frequency'):
+    """
+    Convert padded pitch arrays to a ragged representation.
+
+    Parameters:
+    - pitch_arrays: dict returned by read_praat_pitch_arrays
+    - field: str, 'frequency' or 'strength'
+
+    Returns:
+    - (values, offsets): the valid candidate values of every frame in order, and an array of
+      length frames + 1 where frame i's values are values[offsets[i]:offsets[i + 1]]
+    """
+    n_candidates = pitch_arrays['n_candidates']
+    valid = np.arange(pitch_arrays[field].shape[1])[None, :] < n_candidates[:, None]
+    offsets = np.concatenate(([0], np.cumsum(n_candidates)))
+    return pitch_arrays[field][valid], offsets
+
+def save_pitch_arrays(pitch_arrays, output_file_path, ragged=False):
+    """
+    Save parsed pitch arrays to a .npz file, keeping frame boundaries.
+
+    Parameters:
+    - pitch_arrays: dict returned by read_praat_pitch_arrays
+    - output_file_path: str, path of the .npz file
+    - ragged: bool, store only the valid candidates plus per-frame offsets instead of
+      the padded frames x maxnCandidates arrays (default is False)
+    """
+    arrays = {'intensity': pitch_arrays['intensity'], 'n_candidates': pitch_arrays['n_candidates']}
+    if ragged:
+        arrays['frequency'], arrays['offsets'] = pitch_arrays_to_ragged(pitch_arrays, 'frequency')
+        arrays['strength'], _ = pitch_arrays_to_ragged(pitch_arrays, 'strength')
+    else:
+        arrays['frequency'] = pitch_arrays['frequency']
+        arrays['strength'] = pitch_arrays['strength']
+    np.savez(output_file_path, **arrays)
+
+def extract_praat_data(wav_file_path, parser=read_praat_output):
     # Create a temporary file to save the Praat output
     with tempfile.NamedTemporaryFile(delete=False, suffix='.txt') as temp_praat_output_file:
         temp_praat_output_path = temp_praat_output_file.name
@@ -86,7 +181,7 @@ def extract_praat_data(wav_file_path):
     if os.path.exists(temp_praat_output_path):
         print(f"Praat output file created: {temp_praat_output_path}")
         # Read the pitch data from the Praat output
-        frames_data = read_praat_output(temp_praat_output_path)
+        frames_data = parser(temp_praat_output_path)
         # Debug print to check extracted values
         #print(f"Extracted frames data: {json.dumps(frames_data, indent=2)}")
         # Clean up temporary file
@@ -96,6 +191,68 @@ def extract_praat_data(wav_file_path):
         print(f"Praat output file not found: {temp_praat_output_path}")
         return []
     
+def extract_praat_data_batch(wav_file_paths, n_processes=None, parser=read_praat_output):
+    """
+    Extract Praat pitch data for many audio files with a few long-lived Praat processes.
+
+    The file list is split into n_processes shards. Each shard is handled by a single
+    'praat --run extract_f0_batch.praat' process that loops over its files, so Praat
+    starts once per shard instead of once per file. Shards run concurrently.
+
+    Parameters:
+    - wav_file_paths: list of str, paths to the audio files
+    - n_processes: int, number of concurrent Praat processes (default is the number of CPUs)
+    - parser: function used to parse each Praat output file (default is read_praat_output)
+
+    Returns:
+    - dict mapping each wav file path to its parsed Praat output, or [] if Praat did not produce it
+    """
+    praat_script_path = 'extract_f0_batch.praat'
+    wav_file_paths = list(wav_file_paths)
+    if not wav_file_paths:
+        return {}
+
+    n_processes = max(1, min(n_processes or os.cpu_count() or 1, len(wav_file_paths)))
+    results = {}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Praat resolves relative paths against the script directory, so pass absolute paths
+        output_paths = {path: os.path.join(temp_dir, f"{i}.Pitch") for i, path in enumerate(wav_file_paths)}
+        pending_shards = [wav_file_paths[shard::n_processes] for shard in range(n_processes)]
+
+        while pending_shards:
+            processes = []
+            for shard, shard_paths in enumerate(pending_shards):
+                input_list_path = os.path.join(temp_dir, f"inputs_{shard}.txt")
+                output_list_path = os.path.join(temp_dir, f"outputs_{shard}.txt")
+                with open(input_list_path, 'w') as input_list:
+                    input_list.write("\n".join(os.path.abspath(path) for path in shard_paths) + "\n")
+                with open(output_list_path, 'w') as output_list:
+                    output_list.write("\n".join(output_paths[path] for path in shard_paths) + "\n")
+
+                praat_command = ['praat', '--run', praat_script_path, input_list_path, output_list_path]
+                processes.append(subprocess.Popen(praat_command))
+
+            failed_shards = []
+            for shard_paths, process in zip(pending_shards, processes):
+                if process.wait() != 0:
+                    # Praat stops at the first file it cannot handle; skip that file and rerun the rest
+                    remaining = [path for path in shard_paths if not os.path.exists(output_paths[path])]
+                    print(f"Error running Praat on {remaining[0] if remaining else 'shard'}: exit code {process.returncode}")
+                    if len(remaining) > 1:
+                        failed_shards.append(remaining[1:])
+            pending_shards = failed_shards
+
+        for wav_file_path in wav_file_paths:
+            output_path = output_paths[wav_file_path]
+            if os.path.exists(output_path):
+                results[wav_file_path] = parser(output_path)
+            else:
+                print(f"Praat output file not found for {wav_file_path}")
+                results[wav_file_path] = []
+
+    return results
+
 def save_to_json(data, output_file_path):
     with open(output_file_path, 'w') as json_file:
         json.dump(data, json_file, indent=2)
@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+# Records which audio content, extractor version and parameters produced each stored feature,
+# so a re-run recomputes exactly the features whose inputs changed and skips everything else.
+#
+# The manifest is an append-only JSON lines file in the feature root directory (./speechFeatures).
+# Two kinds of record are written:
+#   {"audio": path, "size": ..., "mtime_ns": ..., "sha1": ...}   content hash of an audio file
+#   {"file": ID, "extractor": ..., "params": ..., "sha1": ..., "version": ...}   one extracted feature
+# Later records replace earlier ones, like the rows of a feature store index. Once most lines are
+# superseded, the manifest is rewritten with only the latest record per key (see compact_manifest).
+
+MANIFEST_FILE = "extraction_manifest.jsonl"
+MANIFEST_LOCK_FILE = "extraction_manifest.lock"
+
+# Superseded lines tolerated before the manifest is compacted, which also needs them to be over half the file
+MIN_SUPERSEDED_LINES = 10000
+
+# Bump an extractor's version when its output changes, every stored value it produced is then recomputed.
+# Extractors are named after the feature directory they write to.
+EXTRACTOR_VERSIONS = {
+    "higuchi_fd": 1,
+    "dfa2": 1,
+    "f0": 1,
+    "mfcc": 1,
+    "tempo": 1,
+    "speech_rate": 1,
+    "stft": 1,
+    "stft_segmented": 1
+}
+
+# Manifests loaded in this process, keyed by absolute path
+_manifests = {}
+
+# Content hash of each recording being extracted in this process, keyed by ID
+_audio_hashes = {}
+
+def manifest_path(root):
+    """Return the path of the manifest for a feature root directory."""
+    return os.path.join(".", root, MANIFEST_FILE)
+
+def _feature_key(args):
+    # Extractor name and a canonical hash of its parameters (the directory components below it)
+    root, extractor, params = args[0], args[1] if len(args) > 1 else "", args[2:]
+    params_hash = hashlib.sha1(json.dumps(sorted(params)).encode()).hexdigest()
+    return root, extractor, params_hash
+
+@contextmanager
+def _locked(root):
+    # Serialises appends from several extraction worker processes with compaction. The lock is a
+    # separate file, because compaction replaces the manifest itself.
+    directory = os.path.dirname(manifest_path(root))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, MANIFEST_LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_manifest(path):
+    # Returns the latest record per key and the number of lines read
+    manifest = {"audio": {}, "features": {}}
+    lines = 0
+    if os.path.isfile(path):
+        with open(path) as manifest_file:
+            for line in manifest_file:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by an interrupted run
+                    continue
+                if "audio" in record:
+                    manifest["audio"][record["audio"]] = (record["size"], record["mtime_ns"], record["sha1"])
+                else:
+                    manifest["features"][(record["file"], record["extractor"], record["params"])] = (record["sha1"], record["version"])
+    return manifest, lines
+
+def compact_manifest(root):
+    """
+    Rewrite the manifest of a feature root directory with only the latest record per key.
+
+    The compacted manifest is written to a temporary file and moved into place with os.replace,
+    while appends from other processes wait, so no record is lost and readers never see a partial file.
+
+    Parameters:
+    - root: str, feature root directory
+
+    Returns:
+    - dict, the manifest as returned by load_manifest
+    """
+    path = manifest_path(root)
+    with _locked(root):
+        # Re-read under the lock, with whatever other processes appended
+        manifest, _ = _read_manifest(path)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), suffix=".tmp", delete=False) as temp_file:
+            for audio_path, (size, mtime_ns, sha1) in manifest["audio"].items():
+                temp_file.write(json.dumps({"audio": audio_path, "size": size, "mtime_ns": mtime_ns, "sha1": sha1}) + "\n")
+            for (file_id, extractor, params_hash), (sha1, version) in manifest["features"].items():
+                temp_file.write(json.dumps({"file": file_id, "extractor": extractor, "params": params_hash,
+                                            "sha1": sha1, "version": version}) + "\n")
+        os.replace(temp_file.name, path)
+    _manifests[os.path.abspath(path)] = manifest
+    return manifest
+
+def load_manifest(root, reload=False):
+    """
+    Load the manifest of a feature root directory into memory, once per process.
+
+    The manifest is compacted when more than MIN_SUPERSEDED_LINES of its lines, and over half of
+    them, have been replaced by later records.
+
+    Parameters:
+    - root: str, feature root directory (e.g. "speechFeatures")
+    - reload: bool, re-read the manifest even if it is already loaded (default is False)
+
+    Returns:
+    - dict with "audio" mapping each audio path to its (size, mtime_ns, sha1) and
+      "features" mapping each (ID, extractor, params hash) to its (sha1, version)
+    """
+    path = manifest_path(root)
+    key = os.path.abspath(path)
+    if reload or key not in _manifests:
+        manifest, lines = _read_manifest(path)
+        _manifests[key] = manifest
+        superseded = lines - len(manifest["audio"]) - len(manifest["features"])
+        if superseded > MIN_SUPERSEDED_LINES and superseded * 2 > lines:
+            compact_manifest(root)
+    return _manifests[key]
+
+def _append_record(root, record):
+    # Opened once the lock is held, so a compaction that replaced the file has finished
+    with _locked(root), open(manifest_path(root), 'a') as manifest_file:
+        manifest_file.write(json.dumps(record) + "\n")
+
+def audio_hash(file_path, root="speechFeatures"):
+    """
+    Return the SHA-1 of an audio file's content.
+
+    Hashes are remembered in the manifest against the file's size and modification time,
+    so an unchanged file is only read once across runs.
+
+    Parameters:
+    - file_path: str, path to the audio file
+    - root: str, feature root directory whose manifest remembers the hash
+
+    Returns:
+    - str, hex digest of the file content
+    """
+    manifest = load_manifest(root)
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    cached = manifest["audio"].get(path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as audio_file:
+        for block in iter(lambda: audio_file.read(1 << 20), b""):
+            sha1.update(block)
+    digest = sha1.hexdigest()
+
+    manifest["audio"][path] = (stat.st_size, stat.st_mtime_ns, digest)
+    _append_record(root, {"audio": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": digest})
+    return digest
+
+def register_audio(file_path, root="speechFeatures"):
+    """
+    Mark a recording as the source of the features about to be checked and saved under its ID.
+
+    Parameters:
+    - file_path: str, path to the audio file
+    - root: str, feature root directory
+
+    Returns:
+    - str, content hash of the recording
+    """
+    file_id = os.path.splitext(os.path.basename(file_path))[0]
+    _audio_hashes[file_id] = audio_hash(file_path, root)
+    return _audio_hashes[file_id]
+
+def is_current(file_name, *args):
+    """
+    Check whether the manifest says a stored feature was made from the current audio by the current extractor.
+
+    Parameters:
+    - file_name: name of the recording (any extension is removed)
+    - *args: directory structure of the feature, starting with the feature root
+
+    Returns:
+    - bool, True if the recording is not registered (nothing to compare against) or its
+      feature was extracted from the same audio content with the same extractor version
+    """
+    file_id = os.path.splitext(file_name)[0]
+    sha1 = _audio_hashes.get(file_id)
+    if sha1 is None:
+        return True
+    root, extractor, params_hash = _feature_key(args)
+    recorded = load_manifest(root)["features"].get((file_id, extractor, params_hash))
+    return recorded == (sha1, EXTRACTOR_VERSIONS.get(extractor, 0))
+
+def registered_hash(file_name):
+    """Return the content hash a recording was registered with in this process, or None."""
+    return _audio_hashes.get(os.path.splitext(file_name)[0])
+
+def record_extraction(file_name, *args, sha1=None):
+    """
+    Record that a registered recording's feature has just been saved.
+
+    Parameters:
+    - file_name: name of the recording (any extension is removed)
+    - *args: directory structure of the feature, starting with the feature root
+    - sha1: str, content hash the feature was extracted from (default is None, the hash the
+      recording was registered with in this process)
+    """
+    file_id = os.path.splitext(file_name)[0]
+    if sha1 is None:
+        sha1 = _audio_hashes.get(file_id)
+    if sha1 is None:
+        return
+    root, extractor, params_hash = _feature_key(args)
+    version = EXTRACTOR_VERSIONS.get(extractor, 0)
+    load_manifest(root)["features"][(file_id, extractor, params_hash)] = (sha1, version)
+    _append_record(root, {"file": file_id, "extractor": extractor, "params": params_hash, "sha1": sha1, "version": version})
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python extraction_manifest.py <speech_features_directory>")
+        print("Prints how many recordings and features the manifest covers.")
+        sys.exit(1)
+    else:
+        manifest = load_manifest(sys.argv[1])
+        print(f"{len(manifest['audio'])} hashed recordings, {len(manifest['features'])} recorded features")
@@ -1,82 +1,173 @@
+import functools
 import numpy as np
 import librosa
 import nolds
+from nolds.measures import poly_fit
 import tempfile
 
-from extract_praat_data import extract_praat_data, get_frequencies_per_frame
+from audio_cache import load_audio, resolve_audio
+from extract_praat_data import extract_praat_data, extract_praat_data_batch, get_frequencies_per_frame, read_praat_pitch_arrays
 
-def higuchi_fd(file_path, kmax, norm):
+# Sample rate the DFA has always been computed at (librosa's default load rate)
+DFA_SAMPLE_RATE = 22050
+
+# Pitch range and time step used by extract_f0.praat
+F0_MIN = 75
+F0_MAX = 600
+F0_TIME_STEP = 0.01
+
+def higuchi_curve_lengths(signal, kmax):
     """
-    Compute the Higuchi Fractal Dimension (HFD) of a signal.
+    Compute the Higuchi curve lengths L(m, k) for every k up to kmax in a single pass.
+
+    For each lag k the absolute increments |x[j + k] - x[j]| are taken once over the
+    whole signal and reshaped into a (rows, k) strided view, so every start offset m
+    is summed in one vectorized call instead of a Python loop per sample.
+
+    Parameters:
+    signal (np.ndarray): Decoded mono signal.
+    kmax (int): Largest k value to compute.
+
+    Returns:
+    np.ndarray: (kmax, kmax) array where entry [m - 1, k - 1] is L(m, k) (zero for m > k).
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    N = len(signal)
+    Lmk = np.zeros((kmax, kmax))
+    for k in range(1, kmax + 1):
+        m = np.arange(1, k + 1)
+        n_mk = (N - m) // k
+        counts = n_mk - 1
+        if counts.max() <= 0:
+            continue
+
+        # Increments starting at sample 1, padded so that row i, column m - 1 holds |x[m + (i + 1) * k] - x[m + i * k]|
+        increments = np.abs(signal[k + 1:] - signal[1:N - k])
+        rows = -(-len(increments) // k)
+        increments = np.pad(increments, (0, rows * k - len(increments))).reshape(rows, k)
+
+        valid = np.arange(rows)[:, None] < counts[None, :]
+        Lmki = np.where(valid, increments, 0.0).sum(axis=0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            norm_factor = (N - 1) / (k * n_mk * k)
+        Lmk[:k, k - 1] = np.where(counts > 0, norm_factor * Lmki, 0.0)
+
+    return Lmk
+
+
+def higuchi_fd_from_curve_lengths(Lmk, kmax):
+    """
+    Compute the Higuchi Fractal Dimension from precomputed curve lengths.
 
     Parameters:
-    file_path (str): Path to the input audio file.
+    Lmk (np.ndarray): Curve lengths from higuchi_curve_lengths, computed for at least kmax.
     kmax (int): Maximum k value for the HFD calculation.
-    norm (bool): If True, normalize the signal.
 
     Returns:
     float: Higuchi Fractal Dimension of the signal, or None if an error occurs.
     """
+    Lk = np.sum(Lmk[:kmax, :kmax], axis=0) / kmax
+
+    # Remove zero or negative values before taking the log
+    Lk = Lk[Lk > 0]
+    if len(Lk) == 0:
+        print("Error: All Lk values are non-positive, cannot compute logarithm.")
+        return None
+
+    lnLk = np.log(Lk)
+    lnk = np.log(1.0 / np.arange(1, len(Lk) + 1))
+
+    if len(lnk) < 2:
+        print("Error: Not enough valid points for polyfit.")
+        return None
+
+    try:
+        HFD = -np.polyfit(lnk, lnLk, 1)[0]
+    except np.linalg.LinAlgError as e:
+        print(f"Polyfit error: {e}")
+        return None
+
+    return HFD
+
+
+def higuchi_fd_multi(signal, kmax_values, norm_values=(True, False)):
+    """
+    Compute the Higuchi Fractal Dimension for several kmax and normalisation settings at once.
+
+    The curve lengths are computed once for the largest kmax; smaller kmax values use the
+    leading sub-matrix. Normalising the signal only rescales every increment by 1 / std,
+    so the normalised curve lengths are derived from the raw ones rather than recomputed.
+
+    Parameters:
+    signal (np.ndarray): Decoded mono signal.
+    kmax_values (list of int): kmax values to compute.
+    norm_values (list of bool): Normalisation settings to compute.
+
+    Returns:
+    dict: Maps (kmax, norm) to the HFD value, or None where it could not be computed.
+    """
+    results = {(kmax, norm): None for kmax in kmax_values for norm in norm_values}
     try:
-        # Load the audio file
-        signal, _ = librosa.load(file_path, sr=None)
+        signal = np.asarray(signal, dtype=np.float64)
 
         # Ensure the audio is mono
         if signal.ndim > 1:
             signal = librosa.to_mono(signal)
 
-        # Optionally normalize the signal
-        if norm:
-            signal = (signal - np.mean(signal)) / np.std(signal)
-
         N = len(signal)
-        if kmax >= N:
-            print(f"Error: kmax ({kmax}) must be smaller than the length of the signal ({N}).")
-            return None
-
-        Lmk = np.zeros((kmax, kmax))
-        for k in range(1, kmax + 1):
-            for m in range(1, k + 1):
-                Lmki = 0
-                for i in range(1, int(np.floor((N - m) / k))):
-                    Lmki += abs(signal[m + i * k] - signal[m + (i - 1) * k])
-                norm_factor = (N - 1) / (k * int(np.floor((N - m) / k)) * k)
-                Lmk[m - 1, k - 1] = norm_factor * Lmki
-
-        Lk = np.sum(Lmk, axis=0) / kmax
-
-        # Remove zero or negative values before taking the log
-        Lk = Lk[Lk > 0]
-        if len(Lk) == 0:
-            print("Error: All Lk values are non-positive, cannot compute logarithm.")
-            return None
-
-        lnLk = np.log(Lk)
-        lnk = np.log(1.0 / np.arange(1, len(Lk) + 1))
-
-        if len(lnk) < 2:
-            print("Error: Not enough valid points for polyfit.")
-            return None
+        valid_kmax = []
+        for kmax in kmax_values:
+            if kmax >= N:
+                print(f"Error: kmax ({kmax}) must be smaller than the length of the signal ({N}).")
+            else:
+                valid_kmax.append(kmax)
+        if not valid_kmax:
+            return results
 
-        try:
-            HFD = -np.polyfit(lnk, lnLk, 1)[0]
-        except np.linalg.LinAlgError as e:
-            print(f"Polyfit error: {e}")
-            return None
+        Lmk_raw = higuchi_curve_lengths(signal, max(valid_kmax))
+
+        for norm in norm_values:
+            Lmk = Lmk_raw / np.std(signal) if norm else Lmk_raw
+            for kmax in valid_kmax:
+                results[(kmax, norm)] = higuchi_fd_from_curve_lengths(Lmk, kmax)
 
-        return HFD
+        return results
 
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return results
+
+
+def higuchi_fd(signal, kmax, norm):
+    """
+    Compute the Higuchi Fractal Dimension (HFD) of a signal.
+
+    Parameters:
+    signal (np.ndarray or str): Decoded mono signal, or path to the input audio file.
+    kmax (int): Maximum k value for the HFD calculation.
+    norm (bool): If True, normalize the signal.
+
+    Returns:
+    float: Higuchi Fractal Dimension of the signal, or None if an error occurs.
+    """
+    try:
+        if isinstance(signal, str):
+            signal, _ = load_audio(signal)
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
 
+    return higuchi_fd_multi(signal, [kmax], [norm])[(kmax, norm)]
 
-def calculate_dfa2(audio_file_path, **kwargs):
+
+def calculate_dfa2(audio, sr=None, **kwargs):
     """
     Calculate the DFA2 value of an audio file.
     
     Parameters:
-    - audio_file_path: str, path to the audio file
+    - audio: str or numpy array, path to the audio file or a decoded mono signal
+    - sr: int, sample rate of audio when it is an array (resampled to DFA_SAMPLE_RATE if different)
     - nvals: list of int, window sizes for DFA (default is calculated internally by nolds)
     - overlap: bool, whether to use overlapping windows (default is True)
     - order: int, order of polynomial for detrending (default is 1)
@@ -105,12 +196,8 @@ def calculate_dfa2(audio_file_path, **kwargs):
     params.update(kwargs)
     
     try:
-        # Load audio file
-        y, sr = librosa.load(audio_file_path)
-        
-        # Ensure the audio is mono
-        if y.ndim > 1:
-            y = np.mean(y, axis=1)
+        # Load audio file at the DFA sample rate
+        y, sr = resolve_audio(audio, sr, target_sr=DFA_SAMPLE_RATE)
 
         # If debug_plot is enabled and no plot_file is provided, create a temporary file
         temp_file_path = None
@@ -142,6 +229,108 @@ def calculate_dfa2(audio_file_path, **kwargs):
         print(f"An error occurred: {e}")
         return None, None
     
+def dfa_fluctuation(walk, n, overlap, order):
+    """
+    Compute the mean DFA fluctuation of a signal profile for one window size.
+
+    Every window is detrended at once by projecting it onto an orthonormal polynomial
+    basis of the given order, which gives the same residuals as a least squares
+    polynomial fit per window.
+
+    Parameters:
+    - walk: numpy array, cumulative sum of the mean-removed signal
+    - n: int, window size
+    - overlap: bool, whether windows overlap by half (as in nolds.dfa)
+    - order: int, order of the detrending polynomial
+
+    Returns:
+    - float, mean fluctuation over all windows
+    """
+    total_N = len(walk)
+    if overlap:
+        # Same window starts as nolds: range(0, len(walk) - n, n // 2)
+        n_windows = len(range(0, total_N - n, n // 2))
+        windows = np.lib.stride_tricks.sliding_window_view(walk, n)[::n // 2][:n_windows]
+    else:
+        windows = walk[:total_N - (total_N % n)].reshape((total_N // n, n))
+
+    # Orthonormal basis of the polynomials of degree <= order on the (rescaled) window positions
+    x = np.linspace(-1.0, 1.0, n)
+    basis, _ = np.linalg.qr(np.vander(x, order + 1))
+    residuals = windows - (windows @ basis) @ basis.T
+
+    flucs = np.sqrt(np.sum(residuals ** 2, axis=1) / n)
+    return np.sum(flucs) / len(flucs)
+
+def calculate_dfa2_multi(audio, configs, sr=None):
+    """
+    Calculate DFA values for several configurations of one signal, sharing the work between them.
+
+    The profile is built once, and each (window size, overlap, order) fluctuation is
+    computed once and reused by every nvals list that contains that window size.
+    Configurations with a fit_trend other than 'poly' fall back to nolds.dfa.
+
+    Parameters:
+    - audio: str or numpy array, path to the audio file or a decoded mono signal
+    - configs: list of dicts with nvals, overlap, order, fit_trend and fit_exp keys
+    - sr: int, sample rate of audio when it is an array (resampled to DFA_SAMPLE_RATE if different)
+
+    Returns:
+    - dict mapping (tuple(nvals), overlap, order, fit_trend, fit_exp) to the DFA value,
+      or None where it could not be computed
+    """
+    results = {}
+    try:
+        y, sr = resolve_audio(audio, sr, target_sr=DFA_SAMPLE_RATE)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return {(tuple(c['nvals']), c['overlap'], c['order'], c['fit_trend'], c['fit_exp']): None for c in configs}
+
+    data = np.asarray(y, dtype=np.float64)
+    total_N = len(data)
+    walk = np.cumsum(data - np.mean(data))
+    fluctuations_cache = {}
+
+    for config in configs:
+        nvals = config['nvals']
+        key = (tuple(nvals), config['overlap'], config['order'], config['fit_trend'], config['fit_exp'])
+        try:
+            if config['fit_trend'] != 'poly':
+                results[key] = nolds.dfa(data, nvals=nvals, overlap=config['overlap'], order=config['order'],
+                                         fit_trend=config['fit_trend'], fit_exp=config['fit_exp'])
+                continue
+
+            # Same validation as nolds.dfa
+            if len(nvals) < 2:
+                raise ValueError("at least two nvals are needed")
+            if np.min(nvals) < 2:
+                raise ValueError("nvals must be at least two")
+            if np.max(nvals) >= total_N:
+                raise ValueError("nvals cannot be larger than the input size")
+
+            fluctuations = []
+            for n in nvals:
+                fluctuation_key = (n, config['overlap'], config['order'])
+                if fluctuation_key not in fluctuations_cache:
+                    fluctuations_cache[fluctuation_key] = dfa_fluctuation(walk, n, config['overlap'], config['order'])
+                fluctuations.append(fluctuations_cache[fluctuation_key])
+            fluctuations = np.array(fluctuations)
+
+            # Filter zero fluctuations before fitting the exponent, as nolds does
+            nonzero = np.where(fluctuations != 0)
+            if len(fluctuations[nonzero]) == 0:
+                results[key] = np.nan
+                continue
+            poly = poly_fit(np.log(np.array(nvals)[nonzero]), np.log(fluctuations[nonzero]), 1, fit=config['fit_exp'])
+            results[key] = poly[0]
+            print(f"DFA2 value: {results[key]}")
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            results[key] = None
+
+    return results
+
 def get_f0_values(file_path):
     try:
         praat_json = extract_praat_data(file_path)
@@ -152,7 +341,161 @@ def get_f0_values(file_path):
         print(f"An error occurred: {e}")
         return None
 
-def extract_mfcc(file_path, **kwargs):
+def get_f0_arrays(file_path):
+    """
+    Get the Praat pitch candidates of a file as frame-aligned arrays.
+
+    Parameters:
+    - file_path: str, path to the audio file
+
+    Returns:
+    - dict of pitch arrays (see extract_praat_data.read_praat_pitch_arrays), or None if an error occurs
+    """
+    try:
+        pitch_arrays = extract_praat_data(file_path, parser=read_praat_pitch_arrays)
+        return pitch_arrays if pitch_arrays else None
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
+
+def get_f0_arrays_batch(file_paths, n_processes=None):
+    """
+    Get the Praat pitch candidates of many files as frame-aligned arrays using batched Praat processes.
+
+    Parameters:
+    - file_paths: list of str, paths to the audio files
+    - n_processes: int, number of concurrent Praat processes (default is the number of CPUs)
+
+    Returns:
+    - dict mapping each file path to its pitch arrays, or None if extraction failed
+    """
+    try:
+        praat_data = extract_praat_data_batch(file_paths, n_processes, parser=read_praat_pitch_arrays)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return {file_path: None for file_path in file_paths}
+
+    return {file_path: (pitch_arrays if pitch_arrays else None) for file_path, pitch_arrays in praat_data.items()}
+
+def _yin_cmndf(frames, window_length, max_lag):
+    """
+    Compute the YIN cumulative mean normalised difference function for a block of frames.
+
+    Parameters:
+    - frames: (n_frames, window_length + max_lag) array of signal frames
+    - window_length: int, integration window in samples
+    - max_lag: int, largest lag in samples
+
+    Returns:
+    - (n_frames, max_lag + 1) array of normalised differences
+    """
+    frame_length = frames.shape[1]
+    n_fft = 1 << int(np.ceil(np.log2(frame_length + window_length)))
+
+    # Autocorrelation of the first window against every lag, for every frame in one FFT call
+    spectrum = np.fft.rfft(frames, n_fft, axis=1)
+    window_spectrum = np.fft.rfft(frames[:, :window_length], n_fft, axis=1)
+    autocorrelation = np.fft.irfft(np.conj(window_spectrum) * spectrum, n_fft, axis=1)[:, :max_lag + 1]
+
+    # Energy of the window starting at each lag, from a running sum of squares
+    energy = np.cumsum(np.pad(frames ** 2, ((0, 0), (1, 0))), axis=1)
+    lag_energy = energy[:, window_length:window_length + max_lag + 1] - energy[:, :max_lag + 1]
+
+    difference = np.maximum(energy[:, [window_length]] + lag_energy - 2 * autocorrelation, 0)
+    difference[:, 0] = 0
+
+    cumulative_mean = np.cumsum(difference[:, 1:], axis=1) / np.arange(1, max_lag + 1)
+    cmndf = np.ones_like(difference)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cmndf[:, 1:] = np.where(cumulative_mean > 0, difference[:, 1:] / cumulative_mean, 1.0)
+    return cmndf
+
+def extract_f0_yin_batch(signals, sr, fmin=F0_MIN, fmax=F0_MAX, time_step=F0_TIME_STEP,
+                         threshold=0.15, silence_threshold=0.03, block_frames=4096):
+    """
+    Track F0 for a batch of decoded signals with a vectorised YIN estimator.
+
+    Frames from every signal are stacked and processed together in blocks, so the
+    difference function for the whole batch is computed with a handful of FFT calls.
+    Frame i of each signal is centred on i * time_step seconds. The defaults follow
+    extract_f0.praat (75 to 600 Hz, 0.01 s step). Unvoiced frames get F0 = 0, like Praat.
+
+    Parameters:
+    - signals: list of mono numpy arrays, all at sample rate sr
+    - sr: int, sample rate of the signals
+    - fmin: float, lowest F0 in Hz (default is 75)
+    - fmax: float, highest F0 in Hz (default is 600)
+    - time_step: float, seconds between frames (default is 0.01)
+    - threshold: float, YIN threshold on the normalised difference (default is 0.15)
+    - silence_threshold: float, frames whose peak is below this fraction of the signal's
+      peak are unvoiced (default is 0.03, Praat's silence threshold)
+    - block_frames: int, number of frames processed per block, bounding memory (default is 4096)
+
+    Returns:
+    - list of (f0, voiced) tuples of per-frame arrays, one per signal
+    """
+    hop_length = max(1, int(round(time_step * sr)))
+    min_lag = max(1, int(np.floor(sr / fmax)))
+    max_lag = int(np.ceil(sr / fmin))
+    window_length = max_lag
+    frame_length = window_length + max_lag
+
+    # Frame every signal (centred frames) and stack them so the whole batch is processed together
+    framed = []
+    frame_peaks = []
+    frame_counts = []
+    for signal in signals:
+        signal = np.asarray(signal, dtype=np.float64)
+        padded = np.pad(signal, (frame_length // 2, frame_length // 2 + hop_length))
+        n_frames = 1 + len(signal) // hop_length
+        frames = np.lib.stride_tricks.sliding_window_view(padded, frame_length)[::hop_length][:n_frames]
+        signal_peak = np.max(np.abs(signal)) if len(signal) else 0.0
+        framed.append(frames)
+        frame_peaks.append(np.max(np.abs(frames), axis=1) / signal_peak if signal_peak > 0 else np.zeros(len(frames)))
+        frame_counts.append(len(frames))
+
+    if not framed:
+        return []
+    all_frames = np.concatenate(framed)
+    all_peaks = np.concatenate(frame_peaks)
+
+    periods = np.zeros(len(all_frames))
+    voiced = np.zeros(len(all_frames), dtype=bool)
+    lags = np.arange(max_lag + 1)
+    for start in range(0, len(all_frames), block_frames):
+        block = all_frames[start:start + block_frames]
+        cmndf = _yin_cmndf(block, window_length, max_lag)
+
+        # Troughs below the threshold inside the allowed lag range; the first one is the period
+        in_range = (lags >= min_lag) & (lags < max_lag)
+        is_trough = np.zeros_like(cmndf, dtype=bool)
+        is_trough[:, 1:-1] = (cmndf[:, 1:-1] <= cmndf[:, :-2]) & (cmndf[:, 1:-1] < cmndf[:, 2:])
+        candidates = is_trough & (cmndf < threshold) & in_range
+        has_candidate = candidates.any(axis=1)
+        global_minimum = np.argmin(np.where(in_range, cmndf, np.inf), axis=1)
+        best = np.where(has_candidate, np.argmax(candidates, axis=1), global_minimum)
+
+        # Parabolic interpolation around the chosen lag
+        rows = np.arange(len(block))
+        left = cmndf[rows, np.maximum(best - 1, 0)]
+        centre = cmndf[rows, best]
+        right = cmndf[rows, np.minimum(best + 1, max_lag)]
+        curvature = left - 2 * centre + right
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shift = np.where(curvature > 0, 0.5 * (left - right) / curvature, 0.0)
+        periods[start:start + len(block)] = best + np.clip(shift, -1, 1)
+        voiced[start:start + len(block)] = has_candidate
+
+    voiced &= all_peaks >= silence_threshold
+    f0 = np.where(voiced, sr / np.maximum(periods, 1), 0.0)
+
+    results = []
+    for offset, count in zip(np.cumsum([0] + frame_counts[:-1]), frame_counts):
+        results.append((f0[offset:offset + count], voiced[offset:offset + count]))
+    return results
+
+def extract_mfcc(audio, **kwargs):
     # Define default parameters for MFCC extraction
     params = {
         'n_mfcc': 13,
@@ -161,16 +504,16 @@ def extract_mfcc(file_path, **kwargs):
         'n_mels': 128,
         'fmin': 0,
         'fmax': None,
-        'sr': 16000  # This initial sr will be overwritten by librosa.load
+        'sr': 16000  # Only used for decoded arrays, files are loaded at their native sampling rate
     }
 
-    # Load the audio file
-    y, sr = librosa.load(file_path, sr=None)  # sr=None lets librosa use the native sampling rate
-    print(f"Sample rate: {sr}")
-
     # Update default parameters with any provided keyword arguments
     params.update(kwargs)
 
+    # Load the audio file
+    y, sr = resolve_audio(audio, params['sr'])
+    print(f"Sample rate: {sr}")
+
     # Update the sample rate using librosa's sr variable
     params['sr'] = sr
 
@@ -192,10 +535,62 @@ def extract_mfcc(file_path, **kwargs):
         print(f"An error occurred: {e}")
         return None
 
-def extract_tempo(file_path, **kwargs):
+@functools.lru_cache(maxsize=None)
+def mel_filterbank(sr, n_fft, n_mels, fmin, fmax):
+    # Filterbanks only depend on these parameters, so build each one once per process
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmin=fmin, fmax=fmax)
+    mel_basis.setflags(write=False)
+    return mel_basis
+
+def extract_mfcc_grid(audio, combinations, sr=16000, fmin=0):
+    """
+    Extract MFCCs for a whole grid of parameter combinations, sharing work between them.
+
+    Only n_fft and hop_length_div change the power spectrogram, so each distinct pair is
+    computed once. Mel filterbanks are cached per (n_fft, n_mels, fmax), and the n_mfcc
+    variants are slices of a single DCT computed for the largest requested n_mfcc.
+    Each result matches extract_mfcc called with the same parameters.
+
+    Parameters:
+    - audio: str or numpy array, path to the audio file or a decoded mono signal
+    - combinations: iterable of (n_mfcc, n_fft, hop_length_div, n_mels, fmax) tuples
+    - sr: int, sample rate of audio when it is an array (files use their native rate)
+    - fmin: float, lowest frequency of the mel filterbank (default is 0)
+
+    Returns:
+    - dict mapping each combination tuple to its MFCC array, or None if an error occurs
+    """
+    try:
+        y, sr = resolve_audio(audio, sr)
+
+        # Group combinations by the spectrogram they need, then by the filterbank
+        spectrogram_groups = {}
+        for n_mfcc, n_fft, hop_length_div, n_mels, fmax in combinations:
+            mel_groups = spectrogram_groups.setdefault((n_fft, hop_length_div), {})
+            mel_groups.setdefault((n_mels, fmax), []).append(n_mfcc)
+
+        mfccs = {}
+        for (n_fft, hop_length_div), mel_groups in spectrogram_groups.items():
+            hop_length_val = n_fft // hop_length_div
+            power_spectrogram = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length_val)) ** 2
+
+            for (n_mels, fmax), n_mfcc_vals in mel_groups.items():
+                mel_basis = mel_filterbank(sr, n_fft, n_mels, fmin, fmax)
+                S = np.einsum("...ft,mf->...mt", power_spectrogram, mel_basis, optimize=True)
+                mfcc = librosa.feature.mfcc(S=librosa.power_to_db(S), sr=sr, n_mfcc=max(n_mfcc_vals))
+                for n_mfcc in n_mfcc_vals:
+                    mfccs[(n_mfcc, n_fft, hop_length_div, n_mels, fmax)] = mfcc[:n_mfcc]
+
+        return mfccs
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
+
+def extract_tempo(audio, **kwargs):
     
-    # Load audio file
-    y, sr = librosa.load(file_path, sr=None)
+    # Load audio file (sr is only used for decoded arrays)
+    y, sr = resolve_audio(audio, kwargs.get('sr'))
 
     # Define default parameters
     hop_length = 512
@@ -215,4 +610,71 @@ def extract_tempo(file_path, **kwargs):
         return tempo
     except Exception as e:
         print(f"An error occurred: {e}")
-        return None
\ No newline at end of file
+        return None
+
+# Onset envelopes use librosa's default onset_strength spectrogram size
+ONSET_N_FFT = 2048
+
+def extract_rhythm_grid(audio, hop_lengths, sr=None):
+    """
+    Extract tempo and speech-rate features for several hop lengths from one shared spectrogram.
+
+    The mel power spectrogram is computed once at the greatest common divisor of the hop
+    lengths. With centred frames, every (hop_length / base hop)-th column is exactly the frame
+    librosa would compute at hop_length, so each onset envelope matches
+    librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length).
+
+    Speech-rate features are [onset_rate, ioi_mean, ioi_std, ioi_median]: detected onsets per
+    second and the mean, standard deviation and median inter-onset interval in seconds
+    (0 when there are fewer than two onsets).
+
+    Parameters:
+    - audio: str or numpy array, path to the audio file or a decoded mono signal
+    - hop_lengths: iterable of int hop lengths
+    - sr: int, sample rate of audio when it is an array (files use their native rate)
+
+    Returns:
+    - dict mapping each hop length to {"tempo": tempo array, "speech_rate": feature array},
+      or None if an error occurs
+    """
+    try:
+        y, sr = resolve_audio(audio, sr)
+        hop_lengths = sorted(set(hop_lengths))
+        duration = len(y) / sr
+
+        base_hop = functools.reduce(np.gcd, hop_lengths)
+        if base_hop * 4 < hop_lengths[0]:
+            # Hop lengths share no useful divisor, a finer spectrogram would cost more than it saves
+            base_hop = None
+        else:
+            mel_power = librosa.feature.melspectrogram(y=y, sr=sr, n_fft=ONSET_N_FFT, hop_length=int(base_hop))
+
+        rhythm = {}
+        for hop_length in hop_lengths:
+            if base_hop is None:
+                S = librosa.feature.melspectrogram(y=y, sr=sr, n_fft=ONSET_N_FFT, hop_length=hop_length)
+            else:
+                S = mel_power[:, ::hop_length // base_hop]
+            onset_env = librosa.onset.onset_strength(S=librosa.power_to_db(S), sr=sr, n_fft=ONSET_N_FFT, hop_length=hop_length)
+
+            # Same estimate librosa.beat.beat_track returns, without running the beat tracker
+            if onset_env.any():
+                tempo = librosa.feature.tempo(onset_envelope=onset_env, sr=sr, hop_length=hop_length)
+            else:
+                tempo = np.zeros(1)
+
+            onset_times = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr, hop_length=hop_length, units='time')
+            intervals = np.diff(onset_times)
+            if len(intervals) > 0:
+                ioi_stats = [np.mean(intervals), np.std(intervals), np.median(intervals)]
+            else:
+                ioi_stats = [0.0, 0.0, 0.0]
+            onset_rate = len(onset_times) / duration if duration > 0 else 0.0
+
+            rhythm[hop_length] = {"tempo": tempo, "speech_rate": np.array([onset_rate] + ioi_stats)}
+
+        return rhythm
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
@@ -0,0 +1,206 @@
+import sys
+import numpy as np
+from joblib import Memory
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_selection import f_regression
+from sklearn.kernel_approximation import Nystroem
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+# Degree 2 feature expansion that fits in a memory budget.
+#
+# The memory of each strategy is estimated before anything is computed (the output and everything the
+# strategy holds while fitting and transforming), and the largest strategy that fits the budget is used:
+#   "full"          every square and pairwise product (PolynomialFeatures(degree=2)), for narrow feature sets
+#   "interactions"  every original column plus the pairwise products of the top-k columns most
+#                   correlated with the target, k as large as the budget allows
+#   "nystroem"      a Nystroem approximation of the degree 2 polynomial kernel, for feature sets too wide
+#                   for even the original columns and a few products, with as many components as fit
+#   "none"          the original columns, when not even one kernel component fits
+# Everything is computed and returned as float32 (scikit-learn keeps float32 inputs in float32).
+#
+# Models are trained in a Pipeline of preprocessing (expansion then scaling) and the model (see
+# build_pipeline), so the preprocessing is fitted on training rows only. The fitted preprocessing is
+# memoised on disk as one step: every trial and model fitted on the same rows (the same CV fold)
+# reuses it instead of refitting, and each fold's expanded matrix is cached once.
+
+# Bytes the expanded training matrix may take
+EXPANSION_MEMORY_BUDGET = 512 * 1024 * 1024
+# Most components used by the kernel approximation
+MAX_NYSTROEM_COMPONENTS = 2000
+# Most rows transformed at a time by the kernel approximation
+TRANSFORM_BATCH_ROWS = 4096
+
+# Where fitted preprocessing steps are cached, and how large the cache may grow
+PIPELINE_CACHE_DIRECTORY = "./cached_pipelines"
+PIPELINE_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+
+FLOAT_BYTES = np.dtype(np.float32).itemsize
+
+def full_expansion_width(n_features):
+    """Return the number of columns of a full degree 2 expansion without bias."""
+    return n_features + n_features * (n_features + 1) // 2
+
+def nystroem_batch_rows(n_samples, n_features, memory_budget=EXPANSION_MEMORY_BUDGET):
+    """Return the rows transformed at a time by the kernel approximation, so a batch takes at most a quarter of the budget."""
+    return int(max(1, min(TRANSFORM_BATCH_ROWS, n_samples, memory_budget // (4 * FLOAT_BYTES * (n_features + 1)))))
+
+def nystroem_bytes(n_samples, n_features, n_components, batch_rows):
+    """
+    Estimate the peak memory of the kernel approximation.
+
+    Counts the output, the basis (n_components x n_features) with the scaled rows it is fitted
+    from and the copy the kernel makes of it, the kernel and normalisation matrices made while
+    fitting, and the scaled rows of one batch with the kernel's copies of them.
+    """
+    return FLOAT_BYTES * (n_samples * n_components
+                          + 3 * n_components * n_features
+                          + 2 * n_components * n_components
+                          + 2 * batch_rows * (n_features + n_components))
+
+def choose_strategy(n_samples, n_features, memory_budget=EXPANSION_MEMORY_BUDGET):
+    """
+    Choose how to expand a feature matrix within a memory budget.
+
+    Parameters:
+    - n_samples: int, number of rows
+    - n_features: int, number of columns
+    - memory_budget: int, bytes the expansion may take
+
+    Returns:
+    - (strategy, size) tuple, size is the number of top columns for "interactions",
+      the number of components for "nystroem" and the output width for "full" and "none"
+    """
+    max_columns = memory_budget // (FLOAT_BYTES * max(n_samples, 1))
+    if full_expansion_width(n_features) <= max_columns:
+        return "full", full_expansion_width(n_features)
+
+    # Largest k with n_features + k * (k - 1) / 2 output columns plus the k copied top columns in the budget
+    spare_columns = max_columns - n_features
+    top_k = int((np.sqrt(1 + 8 * spare_columns) - 1) // 2) if spare_columns > 0 else 0
+    if top_k >= 2:
+        return "interactions", min(top_k, n_features)
+
+    batch_rows = nystroem_batch_rows(n_samples, n_features, memory_budget)
+    components = np.arange(int(max(1, min(MAX_NYSTROEM_COMPONENTS, n_samples))), 0, -1)
+    fits = nystroem_bytes(n_samples, n_features, components, batch_rows) <= memory_budget
+    if fits.any():
+        return "nystroem", int(components[np.argmax(fits)])
+
+    return "none", n_features
+
+class BoundedPolynomialFeatures(BaseEstimator, TransformerMixin):
+    """
+    Degree 2 feature expansion whose output fits in a memory budget.
+
+    Parameters:
+    - memory_budget: int, bytes the expanded training matrix may take (default is EXPANSION_MEMORY_BUDGET)
+    - random_state: int, seed of the kernel approximation (default is 42)
+    """
+
+    def __init__(self, memory_budget=EXPANSION_MEMORY_BUDGET, random_state=42):
+        self.memory_budget = memory_budget
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        X = np.asarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        self.n_features_in_ = n_features
+        self.strategy_, size = choose_strategy(n_samples, n_features, self.memory_budget)
+
+        if self.strategy_ == "full":
+            self.expander_ = PolynomialFeatures(degree=2, include_bias=False).fit(X)
+        elif self.strategy_ == "interactions":
+            # Columns most correlated with the target (highest variance without one)
+            if y is not None:
+                scores = np.nan_to_num(f_regression(X, np.asarray(y, dtype=np.float64))[0])
+            else:
+                scores = X.var(axis=0)
+            self.top_columns_ = np.sort(np.argsort(scores)[::-1][:size])
+        elif self.strategy_ == "nystroem":
+            # Inputs are scaled so that no feature dominates the kernel. The scaler is fitted a batch
+            # at a time, since a single fit makes float64 copies of the whole matrix, and only the
+            # rows that become the basis are scaled for Nystroem, which keeps nothing else from them.
+            self.batch_rows_ = nystroem_batch_rows(n_samples, n_features, self.memory_budget)
+            self.scaler_ = StandardScaler()
+            for start in range(0, n_samples, self.batch_rows_):
+                self.scaler_.partial_fit(X[start:start + self.batch_rows_])
+            basis_rows = np.sort(np.random.RandomState(self.random_state).permutation(n_samples)[:size])
+            self.expander_ = Nystroem(kernel='poly', degree=2, n_components=size,
+                                      random_state=self.random_state).fit(self.scaler_.transform(X[basis_rows]))
+
+        print(f"Feature expansion: {self.strategy_} ({n_features} columns -> {self._output_width()} columns)")
+        return self
+
+    def _output_width(self):
+        if self.strategy_ == "full":
+            return self.expander_.n_output_features_
+        if self.strategy_ == "interactions":
+            return self.n_features_in_ + len(self.top_columns_) * (len(self.top_columns_) - 1) // 2
+        if self.strategy_ == "none":
+            return self.n_features_in_
+        return self.expander_.n_components
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if self.strategy_ == "full":
+            return self.expander_.transform(X).astype(np.float32, copy=False)
+        if self.strategy_ == "none":
+            return X
+
+        output = np.empty((X.shape[0], self._output_width()), dtype=np.float32)
+        if self.strategy_ == "interactions":
+            output[:, :self.n_features_in_] = X
+            top = X[:, self.top_columns_]
+            start = self.n_features_in_
+            for i in range(len(self.top_columns_) - 1):
+                width = len(self.top_columns_) - i - 1
+                np.multiply(top[:, [i]], top[:, i + 1:], out=output[:, start:start + width])
+                start += width
+        else:
+            for start in range(0, X.shape[0], self.batch_rows_):
+                batch = self.scaler_.transform(X[start:start + self.batch_rows_])
+                output[start:start + self.batch_rows_] = self.expander_.transform(batch)
+        return output
+
+def preprocessing_memory(location=PIPELINE_CACHE_DIRECTORY):
+    """Return the on-disk cache of fitted preprocessing steps."""
+    return Memory(location, verbose=0)
+
+def trim_preprocessing_cache(memory, bytes_limit=PIPELINE_CACHE_BYTES):
+    """Delete the least recently used cached preprocessing steps beyond bytes_limit."""
+    memory.reduce_size(bytes_limit=bytes_limit)
+
+def build_pipeline(model, memory=None):
+    """
+    Build the pipeline that expands and scales the features before the model.
+
+    The steps are named "preprocess" (itself a Pipeline of "expand" and "scale") and "model".
+    With a memory, the preprocessing fitted on a given set of rows and its output are cached
+    (keyed by the step parameters and the rows' values). Expansion and scaling form a single
+    step so that only the scaled matrix is cached, not the expanded one as well.
+
+    Parameters:
+    - model: unfitted scikit-learn regressor
+    - memory: joblib Memory returned by preprocessing_memory, or None to not cache (default is None)
+
+    Returns:
+    - sklearn Pipeline
+    """
+    preprocess = Pipeline([
+        ("expand", BoundedPolynomialFeatures()),
+        ("scale", StandardScaler())
+    ])
+    return Pipeline([
+        ("preprocess", preprocess),
+        ("model", model)
+    ], memory=memory)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python feature_expansion.py <n_samples> <n_features>")
+        print("Prints the expansion strategy chosen for a feature matrix of that size.")
+        sys.exit(1)
+    else:
+        strategy, size = choose_strategy(int(sys.argv[1]), int(sys.argv[2]))
+        print(f"{strategy} ({size})")
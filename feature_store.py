@@ -0,0 +1,315 @@
+import os
+import sys
+import csv
+import json
+import fcntl
+import shutil
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+
+# Stores every recording's values for one feature configuration in a single appendable array file.
+#
+# A feature configuration directory (e.g. ./speechFeatures/mfcc/n_mfcc=13/...) holds:
+#   features.bin        raw values of every recording, concatenated in append order
+#   features.json       dtype of the values
+#   features.index.csv  one "ID,offset,shape" row per recording (offset in values, shape as "13x312")
+# Later rows for an ID replace earlier ones, so re-extracting a recording is just another append.
+#
+# Parallel extraction workers hand their values back to the parent process, which appends them in input
+# order (see parallel_extraction.py), so a parallel run writes the same bytes as a serial one.
+
+STORE_DATA_FILE = "features.bin"
+STORE_META_FILE = "features.json"
+STORE_INDEX_FILE = "features.index.csv"
+STORE_LOCK_FILE = "features.lock"
+
+# Opened stores, keyed by absolute directory path, so existence checks never touch the disk
+_stores = {}
+
+def store_directory(*args):
+    """Return the directory of the store for the given directory structure."""
+    return os.path.join(".", *args)
+
+def is_feature_store(directory):
+    """Return True if directory contains a feature store."""
+    return os.path.isfile(os.path.join(directory, STORE_INDEX_FILE))
+
+def _parse_shape(shape_text):
+    return tuple(int(dim) for dim in shape_text.split("x")) if shape_text else ()
+
+def _format_shape(shape):
+    return "x".join(str(dim) for dim in shape)
+
+def _read_index(directory):
+    index = {}
+    index_path = os.path.join(directory, STORE_INDEX_FILE)
+    if os.path.isfile(index_path):
+        with open(index_path, newline='') as index_file:
+            for row in csv.DictReader(index_file):
+                index[row["ID"]] = (int(row["offset"]), _parse_shape(row["shape"]))
+    return index
+
+def _read_dtype(directory):
+    meta_path = os.path.join(directory, STORE_META_FILE)
+    if os.path.isfile(meta_path):
+        with open(meta_path) as meta_file:
+            return np.dtype(json.load(meta_file)["dtype"])
+    return None
+
+@contextmanager
+def _locked(directory):
+    # Serialises appends from several extraction worker processes
+    with open(os.path.join(directory, STORE_LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def open_store(directory, reload=False):
+    """
+    Open the feature store in directory, reading its index into memory once per process.
+
+    Parameters:
+    - directory: str, feature configuration directory
+    - reload: bool, re-read the index even if the store is already open (default is False)
+
+    Returns:
+    - dict with the store "directory", value "dtype" (None until the first append) and
+      "index" mapping each ID to its (offset, shape)
+    """
+    key = os.path.abspath(directory)
+    if reload or key not in _stores:
+        _stores[key] = {
+            "directory": directory,
+            "dtype": _read_dtype(directory),
+            "index": _read_index(directory)
+        }
+    return _stores[key]
+
+def store_contains(file_name, *args):
+    """
+    Check whether a recording already has values in a feature store.
+
+    Parameters:
+    - file_name: name of the recording (any extension is removed)
+    - *args: additional arguments representing directory structure
+
+    Returns:
+    - bool, True if the store has an entry for the recording
+    """
+    file_id = os.path.splitext(file_name)[0]
+    return file_id in open_store(store_directory(*args))["index"]
+
+def append_to_store(data, file_name, *args):
+    """
+    Append a recording's values to a feature store.
+
+    Parameters:
+    - data: numpy array (or scalar) to be saved
+    - file_name: name of the recording (any extension is removed)
+    - *args: additional arguments representing directory structure
+    """
+    directory = store_directory(*args)
+    os.makedirs(directory, exist_ok=True)
+    store = open_store(directory)
+    file_id = os.path.splitext(file_name)[0]
+    array = np.asarray(data)
+
+    with _locked(directory):
+        # Another process may have created the store or appended to it since it was opened
+        dtype = _read_dtype(directory)
+        if dtype is None:
+            dtype = array.dtype
+            with open(os.path.join(directory, STORE_META_FILE), 'w') as meta_file:
+                json.dump({"dtype": dtype.str}, meta_file)
+
+        index_path = os.path.join(directory, STORE_INDEX_FILE)
+        write_header = not os.path.isfile(index_path)
+
+        with open(os.path.join(directory, STORE_DATA_FILE), 'ab') as data_file:
+            offset = data_file.tell() // dtype.itemsize
+            data_file.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+        with open(index_path, 'a', newline='') as index_file:
+            writer = csv.writer(index_file)
+            if write_header:
+                writer.writerow(["ID", "offset", "shape"])
+            writer.writerow([file_id, offset, _format_shape(array.shape)])
+
+    store["dtype"] = dtype
+    store["index"][file_id] = (offset, array.shape)
+
+def stage_chunks(chunks, *args):
+    """
+    Write a recording's values from an iterable of chunks to a temporary file in the store directory.
+
+    Memory stays at the size of one chunk. The staged values are added to the store by
+    append_staged_to_store, or dropped by discard_staged.
+
+    Parameters:
+    - chunks: iterable of numpy arrays, flattened in order
+    - *args: additional arguments representing directory structure
+
+    Returns:
+    - (temp_path, dtype, size) tuple describing the staged values
+    """
+    directory = store_directory(*args)
+    os.makedirs(directory, exist_ok=True)
+
+    dtype = _read_dtype(directory)
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as temp_file:
+        temp_path = temp_file.name
+        try:
+            for chunk in chunks:
+                chunk = np.asarray(chunk)
+                if dtype is None:
+                    dtype = chunk.dtype
+                temp_file.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+                size += chunk.size
+        except BaseException:
+            temp_file.close()
+            os.remove(temp_path)
+            raise
+    if dtype is None:
+        dtype = np.dtype(np.float64)
+    return temp_path, dtype, size
+
+def discard_staged(staged):
+    """Delete values staged by stage_chunks without adding them to the store."""
+    if os.path.exists(staged[0]):
+        os.remove(staged[0])
+
+def append_staged_to_store(staged, file_name, *args):
+    """
+    Append values staged by stage_chunks to a feature store as one flat array, and delete the staged file.
+
+    The staged file is copied into the store under the lock, so other writers only wait for the copy.
+
+    Parameters:
+    - staged: (temp_path, dtype, size) tuple returned by stage_chunks
+    - file_name: name of the recording (any extension is removed)
+    - *args: additional arguments representing directory structure
+
+    Returns:
+    - int, number of values appended
+    """
+    temp_path, dtype, size = staged
+    directory = store_directory(*args)
+    store = open_store(directory)
+    file_id = os.path.splitext(file_name)[0]
+
+    try:
+        with _locked(directory):
+            store_dtype = _read_dtype(directory)
+            if store_dtype is None:
+                store_dtype = dtype
+                with open(os.path.join(directory, STORE_META_FILE), 'w') as meta_file:
+                    json.dump({"dtype": store_dtype.str}, meta_file)
+
+            index_path = os.path.join(directory, STORE_INDEX_FILE)
+            write_header = not os.path.isfile(index_path)
+
+            with open(os.path.join(directory, STORE_DATA_FILE), 'ab') as data_file:
+                offset = data_file.tell() // store_dtype.itemsize
+                if store_dtype == dtype:
+                    with open(temp_path, 'rb') as temp_file:
+                        shutil.copyfileobj(temp_file, data_file)
+                else:
+                    # Another process created the store with a different dtype in the meantime
+                    values = np.memmap(temp_path, dtype=dtype, mode='r') if size else np.zeros(0, dtype=dtype)
+                    for start in range(0, size, 1 << 20):
+                        data_file.write(np.asarray(values[start:start + (1 << 20)], dtype=store_dtype).tobytes())
+                    del values
+
+            with open(index_path, 'a', newline='') as index_file:
+                writer = csv.writer(index_file)
+                if write_header:
+                    writer.writerow(["ID", "offset", "shape"])
+                writer.writerow([file_id, offset, _format_shape((size,))])
+    finally:
+        os.remove(temp_path)
+
+    store["dtype"] = store_dtype
+    store["index"][file_id] = (offset, (size,))
+    return size
+
+def append_chunks_to_store(chunks, file_name, *args):
+    """
+    Append a recording's values to a feature store from an iterable of chunks.
+
+    Chunks are streamed to a temporary file first (stage_chunks) and then copied into the
+    store under the lock (append_staged_to_store). The recording is stored as one flat array
+    of all chunk values.
+
+    Parameters:
+    - chunks: iterable of numpy arrays, flattened in order
+    - file_name: name of the recording (any extension is removed)
+    - *args: additional arguments representing directory structure
+
+    Returns:
+    - int, number of values appended
+    """
+    return append_staged_to_store(stage_chunks(chunks, *args), file_name, *args)
+
+def load_store(directory, mmap=True):
+    """
+    Load every recording in a feature store with a single read of the value file.
+
+    Parameters:
+    - directory: str, feature configuration directory
+    - mmap: bool, memory-map the value file instead of reading it into memory (default is True)
+
+    Returns:
+    - (ids, values, offsets, shapes): list of IDs, the flat value array, and each ID's offset and shape
+    """
+    store = open_store(directory, reload=True)
+    data_path = os.path.join(directory, STORE_DATA_FILE)
+    if not store["index"] or os.path.getsize(data_path) == 0:
+        return [], np.zeros(0, dtype=store["dtype"] or np.float64), [], []
+
+    if mmap:
+        values = np.memmap(data_path, dtype=store["dtype"], mode='r')
+    else:
+        values = np.fromfile(data_path, dtype=store["dtype"])
+
+    ids = list(store["index"].keys())
+    offsets = [store["index"][file_id][0] for file_id in ids]
+    shapes = [store["index"][file_id][1] for file_id in ids]
+    return ids, values, offsets, shapes
+
+def read_from_store(values, offset, shape):
+    """Return one recording's array as a view into the values returned by load_store."""
+    size = int(np.prod(shape)) if shape else 1
+    return values[offset:offset + size].reshape(shape)
+
+def migrate_npy_directory(directory):
+    """
+    Append every per-recording .npy file in a directory to a feature store in the same directory.
+
+    Parameters:
+    - directory: str, directory containing per-recording .npy files
+
+    Returns:
+    - int, number of recordings added to the store
+    """
+    store = open_store(directory)
+    added = 0
+    for file in sorted(os.listdir(directory)):
+        if file.endswith(".npy") and os.path.splitext(file)[0] not in store["index"]:
+            append_to_store(np.load(os.path.join(directory, file)), file, directory)
+            added += 1
+    return added
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python feature_store.py <speech_features_directory>")
+        print("Converts every directory of per-recording .npy files into a feature store.")
+        sys.exit(1)
+    else:
+        for root, dirs, files in os.walk(sys.argv[1]):
+            if any(file.endswith(".npy") for file in files):
+                added = migrate_npy_directory(root)
+                print(f"Added {added} recordings to the feature store in {root}")
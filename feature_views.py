@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from cachingScripts import VIEW_EXTENSION
+from compile_features import npy_to_dataframe, merge_with_lookup, generate_nice_name
+
+# A feature view describes a combined feature set ("A + B + ... joined on ID") without saving its values.
+# Views are small .view.json files that list the feature directories they combine. They are resolved
+# when a model is trained, from per-directory feature sets that are kept in memory and reused by the
+# views that follow and include them.
+
+# Bytes of feature values kept in memory for reuse between views. Views listed in order share their
+# first sets, so a few sets are enough; the least recently used sets are dropped first.
+MAX_CACHED_SET_BYTES = 2 * 1024 * 1024 * 1024
+
+# Loaded feature sets, keyed by (directory, lookup file), least recently used first
+_feature_sets = OrderedDict()
+
+def save_feature_view(directories, file_path, lookup_file='lookup.csv'):
+    """
+    Save a view combining the feature sets of several directories.
+
+    Parameters:
+    - directories: list of str, feature directories to combine, in column order
+    - file_path: str, path of the view (VIEW_EXTENSION is added if missing)
+    - lookup_file: str, ground truth CSV the view is joined with (default is 'lookup.csv')
+
+    Returns:
+    - str, path of the saved view
+    """
+    if not file_path.endswith(VIEW_EXTENSION):
+        file_path += VIEW_EXTENSION
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_path, 'w') as view_file:
+        json.dump({"sets": list(directories), "lookup": lookup_file}, view_file, indent=4)
+    return file_path
+
+def is_feature_view(file_path):
+    """Return True if file_path names a feature view."""
+    return file_path.endswith(VIEW_EXTENSION)
+
+def _set_bytes(feature_set):
+    # Size of the float32 feature columns, which is nearly all of a set's memory
+    return feature_set.shape[0] * (feature_set.shape[1] - 2) * np.dtype(np.float32).itemsize
+
+def load_feature_set(directory, lookup_file='lookup.csv'):
+    """
+    Load one directory's features joined with the ground truth, reusing recently loaded sets.
+
+    Sets are kept while they fit in MAX_CACHED_SET_BYTES (the last one loaded is always kept).
+    The returned DataFrame is shared between views, so it must not be modified.
+
+    Parameters:
+    - directory: str, feature directory
+    - lookup_file: str, ground truth CSV
+
+    Returns:
+    - pandas DataFrame with 'ID', 'HRV (ms)' and the feature columns
+    """
+    key = (directory, lookup_file)
+    if key in _feature_sets:
+        _feature_sets.move_to_end(key)
+        return _feature_sets[key]
+
+    feature_set = merge_with_lookup(npy_to_dataframe(directory), lookup_file)
+    _feature_sets[key] = feature_set
+    cached_bytes = sum(_set_bytes(cached) for cached in _feature_sets.values())
+    while len(_feature_sets) > 1 and cached_bytes > MAX_CACHED_SET_BYTES:
+        _, dropped = _feature_sets.popitem(last=False)
+        cached_bytes -= _set_bytes(dropped)
+    return feature_set
+
+def resolve_feature_view(directories, lookup_file='lookup.csv'):
+    """
+    Build the table of a combined feature set.
+
+    Recordings present in every set are kept, in the order of the first set. Feature
+    columns of each set are copied once into a single preallocated matrix.
+
+    Parameters:
+    - directories: list of str, feature directories to combine, in column order
+    - lookup_file: str, ground truth CSV
+
+    Returns:
+    - pandas DataFrame with 'HRV (ms)' followed by the features of every set, rows with
+      no HRV value removed (the same table compile_features caches for a single set)
+    """
+    feature_sets = [load_feature_set(directory, lookup_file) for directory in directories]
+
+    ids = pd.Index(feature_sets[0]['ID'])
+    for feature_set in feature_sets[1:]:
+        ids = ids[ids.isin(feature_set['ID'])]
+
+    rows = [pd.Index(feature_set['ID']).get_indexer(ids) for feature_set in feature_sets]
+    hrv = feature_sets[0]['HRV (ms)'].to_numpy()[rows[0]]
+    keep = ~np.isnan(hrv)
+
+    widths = [feature_set.shape[1] - 2 for feature_set in feature_sets]
+    matrix = np.empty((int(keep.sum()), sum(widths)), dtype=np.float32)
+    start = 0
+    for feature_set, set_rows, width in zip(feature_sets, rows, widths):
+        matrix[:, start:start + width] = feature_set.iloc[:, 2:].to_numpy()[set_rows[keep]]
+        start += width
+
+    df = pd.DataFrame(matrix, copy=False)
+    df.insert(0, 'HRV (ms)', hrv[keep])
+    return df
+
+def load_feature_view(file_path, columns=None):
+    """
+    Load the table of a saved feature view.
+
+    Parameters:
+    - file_path: str, path of the view
+    - columns: list of column names to return (default is None, which returns every column)
+
+    Returns:
+    - pandas DataFrame, see resolve_feature_view
+    """
+    with open(file_path) as view_file:
+        view = json.load(view_file)
+    df = resolve_feature_view(view["sets"], view.get("lookup", 'lookup.csv'))
+    if columns is not None:
+        # Cached tables loaded from CSV use string column names, so accept either form
+        df = df[[name if name in df.columns else int(name) for name in columns]]
+    return df
+
+def view_name(directories):
+    """Return the name of a view combining directories, e.g. "mfcc_...+tempo_hop_length=512"."""
+    return "+".join(generate_nice_name(directory) for directory in directories)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python feature_views.py <view_file>')
+        sys.exit(1)
+    else:
+        df = load_feature_view(sys.argv[1])
+        print(f'{sys.argv[1]}: {df.shape[0]} recordings, {df.shape[1] - 1} features')
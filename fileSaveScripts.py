@@ -1,6 +1,14 @@
 import os
 import numpy as np
 import shutil
+from contextlib import contextmanager
+
+from feature_store import store_contains, append_to_store, stage_chunks, append_staged_to_store, discard_staged
+from extraction_manifest import is_current, record_extraction, registered_hash
+
+# Features saved inside collect_saves are held back instead of written, so a parallel extraction
+# can hand them to the parent process, which writes every file's features in input order.
+_collected_saves = None
 
 def file_exists(file_name, extension, *args):
     # Construct the directory path
@@ -41,6 +49,105 @@ def save_numpy_file(data, file_name, *args):
     
     print(f"File saved to {file_path}")
 
+def feature_exists(file_name, *args):
+    """
+    Check whether a recording's feature is already in the feature store and still up to date.
+
+    For recordings registered with extraction_manifest.register_audio, the stored value only
+    counts if the manifest says it came from the same audio content and extractor version.
+    Both are in-memory lookups, so this is cheap enough to call for every parameter
+    combination of every file.
+
+    Parameters:
+    - file_name: name of the recording (any extension is removed)
+    - *args: additional arguments representing directory structure
+    """
+    return store_contains(file_name, *args) and is_current(file_name, *args)
+
+@contextmanager
+def collect_saves():
+    """
+    Hold back every feature saved in this block.
+
+    Yields the list the saves are collected in, to be written with write_saves
+    (or dropped with discard_saves).
+    """
+    global _collected_saves
+    previous, _collected_saves = _collected_saves, []
+    try:
+        yield _collected_saves
+    finally:
+        _collected_saves = previous
+
+def _write_save(save):
+    kind, values, file_name, args, sha1 = save
+    if kind == "array":
+        append_to_store(values, file_name, *args)
+    else:
+        append_staged_to_store(values, file_name, *args)
+    record_extraction(file_name, *args, sha1=sha1)
+
+def write_saves(saves):
+    """
+    Write features collected by collect_saves, in the order they were saved.
+
+    Parameters:
+    - saves: list yielded by collect_saves
+    """
+    for save in saves:
+        try:
+            _write_save(save)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+
+def discard_saves(saves):
+    """Drop features collected by collect_saves, deleting the values staged on disk."""
+    for kind, values, _, _, _ in saves:
+        if kind == "staged":
+            discard_staged(values)
+
+def save_feature(data, file_name, *args):
+    """
+    Append a recording's feature to the feature store for its configuration.
+
+    Parameters:
+    - data: numpy array to be saved
+    - file_name: name of the recording (without extension)
+    - *args: additional arguments representing directory structure
+    """
+    try:
+        save = ("array", np.asarray(data), file_name, args, registered_hash(file_name))
+        if _collected_saves is not None:
+            _collected_saves.append(save)
+        else:
+            _write_save(save)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+def save_feature_chunks(chunks, file_name, *args):
+    """
+    Append a recording's feature to the feature store one chunk at a time.
+
+    Parameters:
+    - chunks: iterable of numpy arrays, stored as one flat array
+    - file_name: name of the recording (without extension)
+    - *args: additional arguments representing directory structure
+
+    Returns:
+    - int, number of values saved (0 if saving failed)
+    """
+    try:
+        # Chunks are staged on disk, so a collected save holds a file path rather than the values
+        save = ("staged", stage_chunks(chunks, *args), file_name, args, registered_hash(file_name))
+        if _collected_saves is not None:
+            _collected_saves.append(save)
+        else:
+            _write_save(save)
+        return save[1][2]
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return 0
+
 def save_dataframe_to_csv(df, file_path):
     # Ensure the path is relative to the current working directory
     if file_path.startswith('/'):
@@ -1,9 +1,22 @@
 import os
+import struct
 import subprocess
 import json
-import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 # Uses FFProbe to identify contained file type and renames the file with correct extension.
+# Common containers are recognised from their magic bytes without starting ffprobe, and the
+# remaining files are probed by several ffprobe processes at once. Sniffed files are only trusted
+# once the sizes in their container structure show they are complete (see container_complete), so
+# truncated uploads are still reported as errors.
+
+# Number of ffprobe processes kept running at once
+PROBE_WORKERS = 8
+
+# Longest possible Ogg page: header, 255 lacing values and 255 segments of 255 bytes
+MAX_OGG_PAGE = 27 + 255 + 255 * 255
+EBML_SEGMENT_ID = 0x18538067
 
 def get_format_details(file_path):
     try:
@@ -25,6 +38,176 @@ def get_format_details(file_path):
     except Exception as e:
         return f"Error: {e}", "N/A", "N/A"
 
+def sniff_format(file_path):
+    """
+    Recognise common audio containers from the first bytes of a file.
+
+    Format names are the ones ffprobe reports for the same containers, so the result can be
+    used in place of get_format_details.
+
+    Parameters:
+    - file_path: str, path to the file
+
+    Returns:
+    - (format_name, format_long_name, codec_long_name) tuple, or None if the container
+      is not one of RIFF/WAVE, Ogg, EBML (Matroska/WebM) or ISO base media (ftyp)
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            header = file.read(12)
+    except OSError:
+        return None
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav", "WAV / WAVE", "N/A"
+    if header[:4] == b"OggS":
+        return "ogg", "Ogg", "N/A"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "matroska,webm", "Matroska / WebM", "N/A"
+    if header[4:8] == b"ftyp":
+        return "mov,mp4,m4a,3gp,3g2,mj2", "QuickTime / MOV", "N/A"
+    return None
+
+def _riff_complete(file, file_size):
+    riff_size = struct.unpack("<I", file.read(8)[4:8])[0]
+    # Streaming writers leave the size at 0 or 0xFFFFFFFF until the end
+    if riff_size in (0, 0xFFFFFFFF):
+        return None
+    return riff_size + 8 <= file_size
+
+def _ogg_complete(file, file_size):
+    # The last page must end exactly at the end of the file and close the stream
+    file.seek(max(0, file_size - MAX_OGG_PAGE))
+    tail = file.read()
+    start = tail.rfind(b"OggS")
+    while start >= 0:
+        header = tail[start:start + 27]
+        if len(header) == 27 and header[4] == 0:
+            segments = header[26]
+            lacing = tail[start + 27:start + 27 + segments]
+            if len(lacing) == segments and start + 27 + segments + sum(lacing) == len(tail):
+                return bool(header[5] & 0x04)
+        start = tail.rfind(b"OggS", 0, start)
+    return False
+
+def _ebml_number(file, keep_marker):
+    # EBML variable-length integer: the leading zero bits of the first byte give its length
+    first = file.read(1)
+    if not first:
+        return None, False
+    length = 9 - first[0].bit_length()
+    if length > 8:
+        return None, False
+    rest = file.read(length - 1)
+    if len(rest) < length - 1:
+        return None, False
+    value = first[0] if keep_marker else first[0] & (0xFF >> length)
+    all_ones = value == (0xFF >> length) and rest == b"\xff" * (length - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    return value, all_ones
+
+def _ebml_complete(file, file_size):
+    # The EBML header is followed by the Segment, which holds everything else
+    while True:
+        element_id, _ = _ebml_number(file, keep_marker=True)
+        size, unknown_size = _ebml_number(file, keep_marker=False)
+        if element_id is None or size is None:
+            return False
+        if element_id == EBML_SEGMENT_ID:
+            # Live recorders (e.g. browsers' MediaRecorder) don't know the size in advance
+            return None if unknown_size else file.tell() + size <= file_size
+        if unknown_size:
+            return None
+        file.seek(size, os.SEEK_CUR)
+        if file.tell() >= file_size:
+            return False
+
+def _isobmff_complete(file, file_size):
+    # Top-level boxes must tile the file exactly, and the moov box describing the media must be among them
+    offset, box_types = 0, set()
+    while offset < file_size:
+        file.seek(offset)
+        header = file.read(8)
+        if len(header) < 8:
+            return False
+        size, box_type = struct.unpack(">I4s", header)
+        if size == 1:
+            large_size = file.read(8)
+            if len(large_size) < 8:
+                return False
+            size = struct.unpack(">Q", large_size)[0]
+        elif size == 0:
+            # The last box runs to the end of the file
+            size = file_size - offset
+        if size < 8:
+            return False
+        box_types.add(box_type)
+        offset += size
+    return offset == file_size and b"moov" in box_types
+
+def container_complete(file_path, format_name):
+    """
+    Check that a sniffed file is as long as its container structure says, without decoding it.
+
+    Parameters:
+    - file_path: str, path to the file
+    - format_name: str, format name returned by sniff_format
+
+    Returns:
+    - True if the file is complete, False if it is truncated or corrupt, or None if the container
+      does not record its size (the file then has to be checked by ffprobe)
+    """
+    checks = {"wav": _riff_complete, "ogg": _ogg_complete, "matroska,webm": _ebml_complete,
+              "mov,mp4,m4a,3gp,3g2,mj2": _isobmff_complete}
+    try:
+        with open(file_path, 'rb') as file:
+            return checks[format_name](file, os.fstat(file.fileno()).st_size)
+    except (OSError, struct.error):
+        return False
+
+def probe_format(file_path, sniff=True):
+    """
+    Return the format details of a file, from its magic bytes if possible and otherwise from ffprobe.
+
+    Sniffed files whose container structure shows they are truncated are reported as errors,
+    like files ffprobe can't read. Those whose container doesn't record its size are probed.
+
+    Parameters:
+    - file_path: str, path to the file
+    - sniff: bool, try the magic bytes before running ffprobe (default is True)
+
+    Returns:
+    - (format_name, format_long_name, codec_long_name) tuple, see get_format_details
+    """
+    if sniff:
+        details = sniff_format(file_path)
+        if details is not None:
+            complete = container_complete(file_path, details[0])
+            if complete:
+                return details
+            if complete is False:
+                return f"Error: truncated or corrupt {details[1]} file", "N/A", "N/A"
+    return get_format_details(file_path)
+
+def probe_formats(file_paths, max_workers=PROBE_WORKERS, sniff=True):
+    """
+    Return the format details of several files, keeping up to max_workers ffprobe processes running.
+
+    Parameters:
+    - file_paths: list of str, paths to the files
+    - max_workers: int, number of concurrent probes (default is PROBE_WORKERS)
+    - sniff: bool, try the magic bytes before running ffprobe (default is True)
+
+    Returns:
+    - list of (format_name, format_long_name, codec_long_name) tuples, in the order of file_paths
+    """
+    if max_workers <= 1:
+        return [probe_format(file_path, sniff) for file_path in file_paths]
+    # Threads are enough here: each one only waits on its ffprobe subprocess
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda file_path: probe_format(file_path, sniff), file_paths))
+
 def get_extension_for_format(format_name, codec_long_name):
     # Lookup for specific formats
     if "webm" in format_name:
@@ -39,37 +222,40 @@ def get_extension_for_format(format_name, codec_long_name):
     # Default None if format is not recognized
     return None
 
-def rename_files_based_on_format(folder_path, log_file):
+def rename_files_based_on_format(folder_path, log_file, max_workers=PROBE_WORKERS, sniff=True):
     deleted_files_count = 0
+    file_paths = [os.path.join(root, file) for root, dirs, files in os.walk(folder_path) for file in files]
+    # Probe everything up front, concurrently, then rename in the original order
+    format_details = probe_formats(file_paths, max_workers, sniff)
     with open(log_file, 'w') as log:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                format_name, format_long_name, codec_long_name = get_format_details(file_path)
-                if "Error" not in format_name:
-                    new_extension = get_extension_for_format(format_name, codec_long_name)
-                    if new_extension:
-                        new_file_name = f"{os.path.splitext(file)[0]}.{new_extension}"
-                        new_file_path = os.path.join(root, new_file_name)
-                        os.rename(file_path, new_file_path)
-                        log.write(f"Renamed: {file} to {new_file_name} | Format: {format_name} ({format_long_name}), Codec: {codec_long_name}\n")
-                    else:
-                        os.remove(file_path)
-                        deleted_files_count += 1
-                        log.write(f"Deleted: {file} | Unrecognized format: {format_name} ({format_long_name}), Codec: {codec_long_name}\n")
+        for file_path, (format_name, format_long_name, codec_long_name) in zip(file_paths, format_details):
+            root, file = os.path.split(file_path)
+            if "Error" not in format_name:
+                new_extension = get_extension_for_format(format_name, codec_long_name)
+                if new_extension:
+                    new_file_name = f"{os.path.splitext(file)[0]}.{new_extension}"
+                    new_file_path = os.path.join(root, new_file_name)
+                    os.rename(file_path, new_file_path)
+                    log.write(f"Renamed: {file} to {new_file_name} | Format: {format_name} ({format_long_name}), Codec: {codec_long_name}\n")
                 else:
                     os.remove(file_path)
                     deleted_files_count += 1
-                    log.write(f"Deleted: {file} | Reason: {format_name}\n")
+                    log.write(f"Deleted: {file} | Unrecognized format: {format_name} ({format_long_name}), Codec: {codec_long_name}\n")
+            else:
+                os.remove(file_path)
+                deleted_files_count += 1
+                log.write(f"Deleted: {file} | Reason: {format_name}\n")
         print(f"Total files deleted: {deleted_files_count}")
         log.write(f"\nTotal files deleted: {deleted_files_count}\n")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python fixFileExtensions.py <folder_path>")
-        sys.exit(1) 
-    folder_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Rename every file in a folder with the extension of its container format.")
+    parser.add_argument("folder_path", type=str, help="The folder containing the audio files.")
+    parser.add_argument("--workers", type=int, default=PROBE_WORKERS, help="Number of ffprobe processes run at once.")
+    parser.add_argument("--no_sniff", action="store_true", help="Always run ffprobe instead of recognising common containers from their first bytes.")
+
+    args = parser.parse_args()
     
     log_file = "./logs/fixFileExtensions.log"
-    rename_files_based_on_format(folder_path, log_file)
+    rename_files_based_on_format(args.folder_path, log_file, args.workers, not args.no_sniff)
     print(f"Renaming and logging process completed. Check {log_file} for details.")
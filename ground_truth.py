@@ -0,0 +1,87 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Ground truth HRV per recording, parsed from lookup.csv once per process and indexed by Prolific ID.
+
+ID_COLUMN = 'Prolific ID'
+HRV_COLUMN = 'HRV (ms)'
+
+# Parsed lookups, keyed by absolute path, with the file size and modification time they were read at
+_lookups = {}
+
+def load_lookup(csv_file='lookup.csv'):
+    """
+    Load the ground truth lookup, parsing the CSV only once per process (again if the file changes).
+
+    HRV values are coerced to float. Rows without a usable HRV value are dropped, and only
+    the first row of a repeated ID is kept, so every ID maps to exactly one value.
+
+    Parameters:
+    - csv_file: str, path to the lookup CSV (default is 'lookup.csv')
+
+    Returns:
+    - (ids, hrv) tuple of a pandas Index of IDs (hashed, for fast lookups) and a float64
+      array of their HRV values
+    """
+    path = os.path.abspath(csv_file)
+    stat = os.stat(path)
+    cached = _lookups.get(path)
+    if cached is not None and cached[0] == (stat.st_size, stat.st_mtime_ns):
+        return cached[1]
+
+    df = pd.read_csv(path, usecols=[ID_COLUMN, HRV_COLUMN], dtype={ID_COLUMN: str})
+    hrv = pd.to_numeric(df[HRV_COLUMN], errors='coerce').to_numpy(dtype=np.float64)
+    ids = df[ID_COLUMN].to_numpy()
+    valid = ~np.isnan(hrv) & pd.notna(ids)
+    ids, hrv = ids[valid], hrv[valid]
+
+    first = ~pd.Index(ids).duplicated(keep='first')
+    lookup = (pd.Index(ids[first]), hrv[first])
+    _lookups[path] = ((stat.st_size, stat.st_mtime_ns), lookup)
+    return lookup
+
+def lookup_hrv(ids, csv_file='lookup.csv'):
+    """
+    Look up the HRV of several recordings with one vectorised index lookup.
+
+    Parameters:
+    - ids: sequence of recording IDs
+    - csv_file: str, path to the lookup CSV (default is 'lookup.csv')
+
+    Returns:
+    - (rows, hrv) tuple of the positions in ids that have a ground truth value and those values
+    """
+    index, hrv = load_lookup(csv_file)
+    codes = index.get_indexer(pd.Index(ids).astype(str))
+    rows = np.flatnonzero(codes >= 0)
+    return rows, hrv[codes[rows]]
+
+def attach_ground_truth(df, csv_file='lookup.csv'):
+    """
+    Keep the recordings of a feature DataFrame that have ground truth and add their HRV.
+
+    Parameters:
+    - df: pandas DataFrame with an 'ID' column
+    - csv_file: str, path to the lookup CSV (default is 'lookup.csv')
+
+    Returns:
+    - pandas DataFrame with 'HRV (ms)' inserted as the second column, rows in the order of df
+    """
+    rows, hrv = lookup_hrv(df['ID'], csv_file)
+    if len(rows) == len(df):
+        # Nothing to drop, so avoid copying the feature matrix
+        df = df.copy(deep=False)
+    else:
+        df = df.take(rows)
+    df.insert(1, HRV_COLUMN, hrv)
+    return df.reset_index(drop=True)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python ground_truth.py <lookup_csv>")
+        sys.exit(1)
+    else:
+        ids, hrv = load_lookup(sys.argv[1])
+        print(f"{len(ids)} recordings with HRV, mean {hrv.mean():.2f} ms")
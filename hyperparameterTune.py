@@ -6,53 +6,58 @@ from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LinearRegression, Ridge, Lasso
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler, PolynomialFeatures
+from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import r2_score, mean_squared_error
 import numpy as np
 import optuna
 
-# Function to list CSV files in a directory
-def list_csv_files(directory):
-    return [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith('.csv')]
+from cachingScripts import list_feature_tables, load_feature_table
+from feature_expansion import build_pipeline, preprocessing_memory, trim_preprocessing_cache
+from tuning_studies import open_study, optimize_study, data_fingerprint
 
-# Function to split data into train and test sets, now with feature engineering
+# Bump when the objective or preprocessing changes, so earlier studies are not resumed
+STUDY_VERSION = 1
+
+# Function to split data into train and test sets
+# Feature engineering (Polynomial and Interaction features, scaling) is part of the model pipeline,
+# so it is fitted on training rows only (see feature_expansion.build_pipeline)
 def split_data(df, test_size=0.2, random_state=42):
-    X = df.iloc[:, 1:]  # features
+    X = df.iloc[:, 1:].to_numpy(dtype=np.float32)  # features
     y = df.iloc[:, 0]   # target
     
-    # Apply feature engineering (Polynomial and Interaction features)
-    poly = PolynomialFeatures(degree=2, include_bias=False)
-    X_poly = poly.fit_transform(X)
-    
-    scaler = StandardScaler()
-    X_poly_scaled = scaler.fit_transform(X_poly)
-    
-    return train_test_split(X_poly_scaled, y, test_size=test_size, random_state=random_state)
+    return train_test_split(X, y, test_size=test_size, random_state=random_state)
 
-# Objective function for Optuna
-def objective(trial, X_train, y_train):
+# Objective function for Optuna, every trial reuses the preprocessing cached in memory
+def objective(trial, X_train, y_train, memory=None):
     n_estimators = trial.suggest_int('n_estimators', 10, 200)
     max_depth = trial.suggest_int('max_depth', 2, 32)
     min_samples_split = trial.suggest_int('min_samples_split', 2, 20)
     min_samples_leaf = trial.suggest_int('min_samples_leaf', 1, 20)
 
-    model = RandomForestRegressor(
+    model = build_pipeline(RandomForestRegressor(
         n_estimators=n_estimators,
         max_depth=max_depth,
         min_samples_split=min_samples_split,
         min_samples_leaf=min_samples_leaf
-    )
+    ), memory)
 
     model.fit(X_train, y_train)
     y_pred = model.predict(X_train)
     mse = mean_squared_error(y_train, y_pred)
     return mse
 
-def hyperparameter_tuning(X_train, y_train):
-    study = optuna.create_study(direction='minimize')
-    study.optimize(lambda trial: objective(trial, X_train, y_train), n_trials=100)
+def hyperparameter_tuning(X_train, y_train, feature_name, fingerprint, model_name='RandomForest', memory=None):
+    # Persistent study, resumed if this feature table's data was (partly) tuned before
+    study = open_study(feature_name, model_name, fingerprint, STUDY_VERSION)
+    optimize_study(study, lambda trial: objective(trial, X_train, y_train, memory), n_trials=100)
     return study.best_params
 
+# Parameters of the model itself, without those of the preprocessing steps of a pipeline
+def final_estimator_params(model):
+    if isinstance(model, Pipeline):
+        model = model[-1]
+    return model.get_params()
+
 def evaluate_model(model, X_test, y_test, model_name, feature_name):
     y_pred = model.predict(X_test)
     r2 = r2_score(y_test, y_pred)
@@ -66,7 +71,7 @@ def evaluate_model(model, X_test, y_test, model_name, feature_name):
 
     return {
         "model_name": model_name,
-        "model_params": model.get_params(),
+        "model_params": final_estimator_params(model),
         "feature_name": feature_name,
         "r2_score": r2,
         "mse": mse,
@@ -118,11 +123,14 @@ def main(path):
         files = [path]
         print(f"Processing single file: {path}")
     else:
-        files = list_csv_files(path)
-        print(f"Found {len(files)} CSV files in the directory.")
+        files = list_feature_tables(path)
+        print(f"Found {len(files)} feature tables in the directory.")
+
+    # Fitted preprocessing, shared by every trial and the final model trained on the same rows
+    memory = preprocessing_memory()
 
     for file in files:
-        df = pd.read_csv(file)
+        df = load_feature_table(file)
         print(f"Processing file: {file}")
         feature_name = os.path.basename(file).split('.')[0]
         print(f"Feature name: {feature_name}")
@@ -130,11 +138,11 @@ def main(path):
         X_train, X_test, y_train, y_test = split_data(df)
 
         # Hyperparameter tuning using Optuna
-        best_params = hyperparameter_tuning(X_train, y_train)
+        best_params = hyperparameter_tuning(X_train, y_train, feature_name, data_fingerprint(file, df), memory=memory)
         print(f"Best params for RandomForest: {best_params}")
 
         # Train the best model
-        best_rf_model = RandomForestRegressor(**best_params)
+        best_rf_model = build_pipeline(RandomForestRegressor(**best_params), memory)
         best_rf_model.fit(X_train, y_train)
 
         result = evaluate_model(best_rf_model, X_test, y_test, 'RandomForest', feature_name)
@@ -145,6 +153,8 @@ def main(path):
         # Save actual vs predicted values
         save_predictions_to_csv(result["y_test"], result["y_pred"], 'RandomForest', best_params, feature_name)
 
+        trim_preprocessing_cache(memory)
+
     return results
 
 # Example usage
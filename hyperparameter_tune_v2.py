@@ -3,20 +3,31 @@ import datetime
 import sys
 import csv
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, KFold
+from sklearn.base import clone
 from sklearn.linear_model import LinearRegression, Ridge, Lasso
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler, PolynomialFeatures
+from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import r2_score, mean_squared_error
 import numpy as np
 import optuna
 
 from save_prediction_evaluation import evaluate_and_save
-
-# Function to list CSV files in a directory
-def list_csv_files(directory):
-    return [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith('.csv')]
+from cachingScripts import list_feature_tables, load_feature_table
+from feature_expansion import build_pipeline, preprocessing_memory, trim_preprocessing_cache
+from tuning_studies import open_study, optimize_study, data_fingerprint
+
+# Number of cross-validation folds each trial is scored on
+CV_FOLDS = 5
+# Bump when the objective, CV or preprocessing changes, so earlier studies are not resumed
+STUDY_VERSION = 1
+# Trials per model, and how many worker processes run them (one trial each at a time, estimators single-threaded)
+N_TRIALS = 100
+N_WORKERS = os.cpu_count() or 1
+# Trials completed before pruning starts, and folds a trial always runs before it can be pruned
+PRUNER_STARTUP_TRIALS = 5
+PRUNER_WARMUP_FOLDS = 1
 
 # Define models and their corresponding hyperparameters
 def get_model_params():
@@ -48,47 +59,65 @@ def get_model_params():
         }
     }
 
-# Function to split data into train and test sets, now with feature engineering
+# Function to split data into train and test sets
+# Feature engineering (Polynomial and Interaction features, scaling) is part of the model pipeline,
+# so it is fitted on training rows only (see feature_expansion.build_pipeline)
 def split_data(df, test_size=0.2, random_state=42):
-    X = df.iloc[:, 1:]  # features
+    X = df.iloc[:, 1:].to_numpy(dtype=np.float32)  # features
     y = df.iloc[:, 0]   # target
     
-    # Apply feature engineering (Polynomial and Interaction features)
-    poly = PolynomialFeatures(degree=2, include_bias=False)
-    X_poly = poly.fit_transform(X)
-    
-    scaler = StandardScaler()
-    X_poly_scaled = scaler.fit_transform(X_poly)
-    
-    return train_test_split(X_poly_scaled, y, test_size=test_size, random_state=random_state)
+    return train_test_split(X, y, test_size=test_size, random_state=random_state)
 
 # General objective function for hyperparameter tuning with Optuna
-def objective(trial, model_class, X_train, y_train):
+def objective(trial, model_class, X_train, y_train, memory=None, n_folds=CV_FOLDS):
+    """
+    Score a trial's parameters by their mean validation MSE over K folds of the training set.
+
+    The running mean is reported after every fold, so the pruner can stop a trial that is
+    already worse than the median of earlier trials after two folds. The folds are the same
+    for every trial, so with a memory each fold's preprocessing is only fitted once.
+    """
     params = model_class["params"]
-    model = model_class["model"]
-    
-    # Set model parameters based on the trial
+
+    # Set model parameters based on the trial, on a copy of the shared model
     model_params = {param_name: param_fn(trial) for param_name, param_fn in params.items()}
-    model.set_params(**model_params)
-    
-    # Fit the model
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_train)
-    mse = mean_squared_error(y_train, y_pred)
-    
-    return mse
+    model = build_pipeline(clone(model_class["model"]).set_params(**model_params), memory)
+
+    X_train = np.asarray(X_train)
+    y_train = np.asarray(y_train)
+    fold_mse = []
+    folds = KFold(n_splits=n_folds, shuffle=True, random_state=42)
+    for fold, (train_index, validation_index) in enumerate(folds.split(X_train)):
+        model.fit(X_train[train_index], y_train[train_index])
+        y_pred = model.predict(X_train[validation_index])
+        fold_mse.append(mean_squared_error(y_train[validation_index], y_pred))
+
+        trial.report(np.mean(fold_mse), fold)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+
+    return np.mean(fold_mse)
 
 # Hyperparameter tuning function
-def hyperparameter_tuning(model_class, X_train, y_train):
+def hyperparameter_tuning(model_class, X_train, y_train, feature_name, model_name, fingerprint, memory=None, n_trials=N_TRIALS, workers=N_WORKERS):
     if not model_class["params"]:
         return model_class["model"].get_params()  # No tuning for models without hyperparameters
 
-    # Create Optuna study
-    study = optuna.create_study(direction='minimize')
-    study.optimize(lambda trial: objective(trial, model_class, X_train, y_train), n_trials=100)
-    
+    # Open the persistent study of this feature set and model, pruning trials whose running CV score is worse than the median
+    pruner = optuna.pruners.MedianPruner(n_startup_trials=PRUNER_STARTUP_TRIALS, n_warmup_steps=PRUNER_WARMUP_FOLDS)
+    study = open_study(feature_name, model_name, fingerprint, STUDY_VERSION, pruner=pruner)
+    optimize_study(study, lambda trial: objective(trial, model_class, X_train, y_train, memory), n_trials, workers)
+
+    pruned = sum(trial.state == optuna.trial.TrialState.PRUNED for trial in study.trials)
+    print(f"Best CV MSE: {study.best_value} ({pruned} of {len(study.trials)} trials pruned)")
     return study.best_params
 
+# Parameters of the model itself, without those of the preprocessing steps of a pipeline
+def final_estimator_params(model):
+    if isinstance(model, Pipeline):
+        model = model[-1]
+    return model.get_params()
+
 # Function to evaluate the model
 def evaluate_model(model, X_test, y_test, model_name, feature_name):
     y_pred = model.predict(X_test)
@@ -103,7 +132,7 @@ def evaluate_model(model, X_test, y_test, model_name, feature_name):
 
     return {
         "model_name": model_name,
-        "model_params": model.get_params(),
+        "model_params": final_estimator_params(model),
         "feature_name": feature_name,
         "r2_score": r2,
         "mse": mse,
@@ -153,7 +182,7 @@ def save_predictions_to_csv(y_test, y_pred, model_name, params, feature_name):
     print(f"Saved predictions to {filename}")
 
 # Evaluate all models
-def evaluate_all_models(X_train, X_test, y_train, y_test, feature_name):
+def evaluate_all_models(X_train, X_test, y_train, y_test, feature_name, fingerprint, memory=None):
     results = []
     model_classes = get_model_params()
 
@@ -161,13 +190,15 @@ def evaluate_all_models(X_train, X_test, y_train, y_test, feature_name):
         print(f"Processing model: {model_name}")
         
         # Perform hyperparameter tuning if applicable
-        best_params = hyperparameter_tuning(model_class, X_train, y_train)
+        best_params = hyperparameter_tuning(model_class, X_train, y_train, feature_name, model_name, fingerprint, memory)
         print(f"Best params for {model_name}: {best_params}")
         
-        # Train the model
-        model = model_class["model"]
-        model.set_params(**best_params)
+        # Train the model, with preprocessing fitted on the whole training set (shared by every model)
+        model = build_pipeline(clone(model_class["model"]).set_params(**best_params), memory)
         model.fit(X_train, y_train)
+        if memory is not None:
+            # Every model adds cached folds, so the cache is kept in bounds after each one
+            trim_preprocessing_cache(memory)
 
         # Evaluate the model
         result = evaluate_model(model, X_test, y_test, model_name, feature_name)
@@ -178,7 +209,7 @@ def evaluate_all_models(X_train, X_test, y_train, y_test, feature_name):
 
         # Save results and predictions
         append_results_to_csv(result, f"{date}_model_evaluation_results.csv")
-        save_predictions_to_csv(result["y_test"], result["y_pred"], model_name, model.get_params(), feature_name)
+        save_predictions_to_csv(result["y_test"], result["y_pred"], model_name, final_estimator_params(model), feature_name)
 
     return results
 
@@ -188,18 +219,21 @@ def main(path):
         files = [path]
         print(f"Processing single file: {path}")
     else:
-        files = list_csv_files(path)
-        print(f"Found {len(files)} CSV files in the directory.")
+        files = list_feature_tables(path)
+        print(f"Found {len(files)} feature tables in the directory.")
+
+    # Fitted preprocessing, shared by every trial and model trained on the same rows
+    memory = preprocessing_memory()
 
     for file in files:
-        df = pd.read_csv(file)
+        df = load_feature_table(file)
         print(f"Processing file: {file}")
         feature_name = os.path.basename(file).split('.')[0]
 
         X_train, X_test, y_train, y_test = split_data(df)
 
         # Evaluate all models
-        results = evaluate_all_models(X_train, X_test, y_train, y_test, feature_name)
+        results = evaluate_all_models(X_train, X_test, y_train, y_test, feature_name, data_fingerprint(file, df), memory)
         print(results)
 
     return results
@@ -0,0 +1,95 @@
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from fileSaveScripts import collect_saves, write_saves, discard_saves
+
+# Runs a per-file extraction function serially or across a pool of worker processes, returning results in input order.
+# Features the worker saves are collected and written by this process in input order, so the feature
+# stores of a parallel run are byte for byte the same as those of a serial run.
+
+def run_with_retries(worker, retries, item):
+    """
+    Call worker(item), retrying if it raises, and collect the features it saves.
+
+    The worker is expected to return the log text for the item. If every attempt fails,
+    the error messages are returned as the log text instead so the run can carry on.
+    The features saved by a failed attempt are dropped.
+
+    Parameters:
+    - worker: callable taking a single item and returning a str
+    - retries: int, number of extra attempts after the first failure
+    - item: the item to process (usually a file name)
+
+    Returns:
+    - (log, saves) tuple, log text for the item and the features saved for it (see fileSaveScripts.collect_saves)
+    """
+    errors = []
+    for attempt in range(retries + 1):
+        with collect_saves() as saves:
+            try:
+                return worker(item), saves
+            except Exception as e:
+                discard_saves(saves)
+                error_message = f"Error processing {item} (attempt {attempt + 1}/{retries + 1}): {e}\n{traceback.format_exc()}\n"
+                print(error_message)
+                errors.append(error_message)
+    return "".join(errors), []
+
+def _write_result(result):
+    log, saves = result
+    write_saves(saves)
+    return log
+
+def run_in_order(worker, items, workers=1, chunksize=1, retries=1):
+    """
+    Yield worker results for each item, in the order of items.
+
+    With workers <= 1 the items are processed one at a time in this process. Otherwise they
+    are fanned out to a process pool. Both paths go through run_with_retries and write each
+    item's saved features here, in input order, so the results and the feature stores are the
+    same either way.
+
+    Parameters:
+    - worker: picklable callable taking a single item and returning a str
+    - items: list of items to process
+    - workers: int, number of worker processes (default is 1, serial)
+    - chunksize: int, number of items sent to a worker at a time (default is 1)
+    - retries: int, number of extra attempts for an item that raises (default is 1)
+
+    Returns:
+    - generator of str results in input order
+    """
+    task = partial(run_with_retries, worker, retries)
+    items = list(items)
+
+    if workers is None or workers <= 1:
+        for item in items:
+            yield _write_result(task(item))
+        return
+
+    pending = items
+    while pending:
+        completed = 0
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(task, pending, chunksize=chunksize):
+                    completed += 1
+                    yield _write_result(result)
+            return
+        except BrokenProcessPool:
+            # A worker died outright (e.g. a crash in native code). Only the chunks that were in
+            # flight can hold the bad file, so run each of their items in its own process, then
+            # carry on with a full pool.
+            in_flight = pending[completed:completed + workers * chunksize]
+            print(f"Worker pool failed after {completed}/{len(pending)} items, isolating the next {len(in_flight)} items")
+            for item in in_flight:
+                try:
+                    with ProcessPoolExecutor(max_workers=1) as executor:
+                        yield _write_result(executor.submit(task, item).result())
+                except BrokenProcessPool:
+                    error_message = f"Worker process crashed while processing {item}, skipping\n"
+                    print(error_message)
+                    yield error_message
+            pending = pending[completed + len(in_flight):]
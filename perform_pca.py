@@ -4,17 +4,15 @@ import pandas as pd
 from sklearn.preprocessing import StandardScaler 
 from sklearn.decomposition import PCA
 
-debug = True
+from cachingScripts import list_feature_tables, load_feature_table, cache_features, table_name
 
-# Function to list CSV files in a directory
-def list_csv_files(directory):
-    return [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith('.csv')]
+debug = True
 
 def load_csv_data(file_path):
-    # Load the compiled MFCC data from CSV
-    data = pd.read_csv(file_path)
+    # Load the compiled MFCC data from the feature cache
+    data = load_feature_table(file_path)
     if debug:
-        print(f"Loaded .csv file: {file_path}")
+        print(f"Loaded feature table: {file_path}")
     return data
 
 def preprocess_data(data, exclude_columns):
@@ -42,12 +40,12 @@ def apply_pca(data, n_components):
     return pca_result, pca.explained_variance_ratio_
 
 def main(data, n_components):
-    # Load the data from CSV
+    # Load the data from the feature cache
     csv_file_path = data
     csv_data = load_csv_data(csv_file_path)
 
-    # remove the file extension
-    csv_file_name = os.path.splitext(os.path.basename(csv_file_path))[0]
+    # remove the file extension (.json, .csv or .view.json)
+    csv_file_name = table_name(csv_file_path)
     
     # Preprocess the data
     exclude_columns = ['HRV (ms)']  # Columns to exclude from PCA
@@ -66,7 +64,7 @@ def main(data, n_components):
     
     print(f"Explained variance by component: {explained_variance}")
     
-    # Optionally save the PCA result to a new CSV
+    # Save the PCA result as a new feature table
     pca_df = pd.DataFrame(pca_result)
 
     # Need to add back the 'HRV (ms)' column, append as first column
@@ -75,9 +73,9 @@ def main(data, n_components):
     # Create a new directory to store PCA features
     os.makedirs("pca_features", exist_ok=True)
 
-    pca_df.to_csv(f"./pca_features/{csv_file_name}_pca_n_components={n_components}.csv", index=False)
+    cache_features(f"./pca_features/{csv_file_name}_pca_n_components={n_components}", pca_df)
     if debug:
-        print(f"Saved PCA result to ./pca_features/{csv_file_name}_pca_n_components={n_components}.csv")    
+        print(f"Saved PCA result to ./pca_features/{csv_file_name}_pca_n_components={n_components}")    
     
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -86,9 +84,9 @@ if __name__ == "__main__":
     else:
         # get file path from command line argument
         directory = sys.argv[1]
-        files = list_csv_files(directory)
+        files = list_feature_tables(directory)
 
-        print(f"Found {len(files)} CSV files in the directory.")
+        print(f"Found {len(files)} feature tables in the directory.")
 
         n_components_array = [5, 10, 20, 50, 100]
         
@@ -0,0 +1,292 @@
+import os
+import re
+import csv
+import filecmp
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+
+from fixFileExtensions import probe_format, get_extension_for_format
+from renameFiles import clean_filename, remove_bracketed_number
+from cleanUpAudioDir import is_low_volume
+from trimSilence import trim_silence
+from audio_fingerprint import open_fingerprint_index, is_indexed, find_match, add_fingerprint, fingerprint_signal
+from convertToPCM import load_converted, is_conformant, TARGET_FORMAT, TARGET_EXTENSION
+
+# Runs every audio preprocessing stage on each file with a single decode:
+# probe -> convert -> hash -> duration/volume gate -> trim silence -> second gate.
+# Same stages as fixFileExtensions, convertToPCM, deleteDuplicates, renameFiles,
+# cleanUpAudioDir, trimSilence and cleanUpAudioDir again, which each decoded every file.
+# Files are processed in a worker pool, then duplicates and names are resolved across the
+# whole directory, each kept recording is written once as a wav and every decision is saved
+# to a single manifest. With a fingerprint index, re-encoded copies of recordings kept in this or
+# an earlier run are dropped too (see audio_fingerprint.py).
+
+MANIFEST_FIELDS = ["original", "status", "reason", "final_name", "format", "codec", "hash", "duplicate_of",
+                   "duration", "volume", "trim_start_ms", "trim_end_ms", "trimmed_duration", "trimmed_volume"]
+
+def preprocess_file(file_path, min_duration, volume_threshold, trimmed_min_duration, trimmed_volume_threshold,
+                    silence_thresh=-50, chunk_size=10, fingerprint=False):
+    """
+    Run every per-file preprocessing stage on one audio file.
+
+    Kept recordings are written to a temporary wav next to the original. The final name is
+    only decided once every file has been hashed (see plan_outputs).
+
+    Parameters:
+    - file_path: str, path to the audio file
+    - min_duration: float, minimum duration in seconds before trimming
+    - volume_threshold: float, minimum volume in dBFS before trimming
+    - trimmed_min_duration: float, minimum duration in seconds after trimming
+    - trimmed_volume_threshold: float, minimum volume in dBFS after trimming
+    - silence_thresh: float, silence threshold in dBFS used for trimming (default is -50)
+    - chunk_size: int, minimum silence length in ms used for trimming (default is 10)
+    - fingerprint: bool, compute the acoustic fingerprint of kept recordings (default is False)
+
+    Returns:
+    - dict, manifest record for the file ("status" is "keep", "delete" or "error";
+      kept records also have a "temp_path", and a "fingerprint" if requested)
+    """
+    record = {"original": file_path, "status": "delete"}
+
+    # Probe the container, as fixFileExtensions does (common containers without starting ffprobe)
+    format_name, format_long_name, codec_long_name = probe_format(file_path)
+    record["codec"] = codec_long_name
+    if "Error" in format_name:
+        record["reason"] = format_name
+        return record
+    record["format"] = get_extension_for_format(format_name, codec_long_name)
+    if record["format"] is None:
+        record["reason"] = f"Unrecognized format: {format_name} ({format_long_name})"
+        return record
+
+    try:
+        # The only decode of this file, converted in memory by convertToPCM's own conversion
+        audio = load_converted(file_path, format=record["format"])
+
+        # Same samples convertToPCM writes, so the same hash deleteDuplicates computes on the converted file
+        record["hash"] = hashlib.md5(audio.raw_data).hexdigest()
+
+        record["duration"] = round(len(audio) / 1000.0, 3)
+        record["volume"] = round(audio.dBFS, 2)
+        if record["duration"] < min_duration or is_low_volume(audio, volume_threshold):
+            record["reason"] = f"Failed first gate: duration={record['duration']:.2f}s, volume={record['volume']:.2f}dBFS"
+            return record
+
+        trimmed_audio, start_trim, end_trim = trim_silence(audio, silence_thresh, chunk_size)
+        record["trim_start_ms"] = start_trim
+        record["trim_end_ms"] = end_trim
+        record["trimmed_duration"] = round(len(trimmed_audio) / 1000.0, 3)
+        record["trimmed_volume"] = round(trimmed_audio.dBFS, 2)
+        if record["trimmed_duration"] < trimmed_min_duration or is_low_volume(trimmed_audio, trimmed_volume_threshold):
+            record["reason"] = f"Failed second gate: duration={record['trimmed_duration']:.2f}s, volume={record['trimmed_volume']:.2f}dBFS"
+            return record
+
+        if fingerprint:
+            samples = np.array(trimmed_audio.get_array_of_samples(), dtype=np.float32)
+            samples /= float(1 << (8 * trimmed_audio.sample_width - 1))
+            record["fingerprint"] = fingerprint_signal(samples, trimmed_audio.frame_rate)
+
+        temp_path = f"{file_path}.preprocessed.tmp"
+        trimmed_audio.export(temp_path, format=TARGET_FORMAT)
+        record["temp_path"] = temp_path
+        record["status"] = "keep"
+        return record
+
+    except Exception as e:
+        # Left in place for a look, like the problematic files in cleanUpAudioDir
+        record["status"] = "error"
+        record["reason"] = f"Error processing {file_path}: {e}"
+        print(record["reason"])
+        return record
+
+def output_name(filename):
+    """
+    Return the name a file is saved under before clashes are resolved, as renameFiles names it:
+    everything from the first hyphen is removed, or else bracketed numbers are removed.
+    """
+    name = os.path.splitext(filename)[0] + TARGET_EXTENSION
+    if '-' in name:
+        return clean_filename(name)
+    if re.search(r'\(\d+\)\.[a-zA-Z0-9]+$', name):
+        return remove_bracketed_number(name)
+    return name
+
+def is_output_name(filename):
+    """Return True if filename is a name plan_outputs can give a file, including a "(n)" clash suffix."""
+    name = output_name(filename)
+    if filename == name:
+        return True
+    base_name, extension = os.path.splitext(name)
+    return re.fullmatch(re.escape(base_name) + r'\(\d+\)' + re.escape(extension), filename) is not None
+
+def plan_outputs(records):
+    """
+    Drop duplicates and choose the final file name of every kept recording.
+
+    Recordings already in final form (a target format wav with an output name, e.g. from an
+    earlier run on the same directory) keep their name, since it is their recording ID, and win
+    over new files with the same audio hash. Otherwise the first recording (in directory order)
+    with a given audio hash is kept. Names follow renameFiles: everything from the first hyphen
+    is removed, bracketed numbers are removed, and clashing names get the next free "(n)" suffix.
+
+    Parameters:
+    - records: list of dicts returned by preprocess_file, in directory order
+    """
+    first_by_hash = {}
+    taken = set()
+    settled = []
+    for record in records:
+        if record["status"] == "error":
+            # Files that could not be processed stay where they are, so their names are not free
+            taken.add(record["original"])
+        elif record["status"] == "keep":
+            filename = os.path.basename(record["original"])
+            if is_output_name(filename) and is_conformant(record["original"]):
+                # Reserved before any new name is handed out, and never moved
+                taken.add(record["original"])
+                record["final_name"] = filename
+                settled.append(record)
+
+    settled_ids = {id(record) for record in settled}
+    for record in settled + [record for record in records if id(record) not in settled_ids]:
+        if record["status"] != "keep":
+            continue
+        if record["hash"] in first_by_hash:
+            record["status"] = "delete"
+            record["duplicate_of"] = first_by_hash[record["hash"]]
+            record["reason"] = f"Duplicate of {first_by_hash[record['hash']]}"
+            record.pop("final_name", None)
+            continue
+        first_by_hash[record["hash"]] = record["original"]
+        if id(record) in settled_ids:
+            continue
+
+        directory, filename = os.path.split(record["original"])
+        name = output_name(filename)
+        base_name, extension = os.path.splitext(name)
+        counter = 1
+        while os.path.join(directory, name) in taken:
+            name = f"{base_name}({counter}){extension}"
+            counter += 1
+        taken.add(os.path.join(directory, name))
+        record["final_name"] = name
+
+def drop_near_duplicates(records, index, log):
+    """
+    Delete kept recordings that are re-encoded copies of an indexed recording, and index the rest.
+
+    Runs after apply_outputs, so recordings are indexed with the size and modification time of
+    their final file and are skipped on later runs while that file is unchanged.
+
+    Parameters:
+    - records: list of dicts, after apply_outputs, with fingerprints
+    - index: dict returned by audio_fingerprint.open_fingerprint_index
+    - log: callable taking a message
+    """
+    for record in records:
+        if record["status"] != "keep":
+            continue
+        file_id = os.path.splitext(record["final_name"])[0]
+        final_path = os.path.join(os.path.dirname(record["original"]), record["final_name"])
+        if is_indexed(index, file_id, final_path):
+            continue
+        match = find_match(index, record["fingerprint"], exclude_id=file_id)
+        if match is not None:
+            record["status"] = "delete"
+            record["duplicate_of"] = match[0]
+            record["reason"] = f"Near duplicate of {match[0]} (bit error rate {match[1]:.3f})"
+            os.remove(final_path)
+            log(f"Deleted {final_path}: {record['reason']}")
+        else:
+            add_fingerprint(index, file_id, final_path, record["fingerprint"])
+
+def apply_outputs(records, log):
+    """
+    Move every kept recording's wav into place and delete the originals that were replaced or rejected.
+
+    Parameters:
+    - records: list of dicts, after plan_outputs
+    - log: callable taking a message
+    """
+    final_paths = set()
+    for record in records:
+        if record["status"] == "keep":
+            final_path = os.path.join(os.path.dirname(record["original"]), record["final_name"])
+            final_paths.add(final_path)
+            if final_path == record["original"] and filecmp.cmp(record["temp_path"], final_path, shallow=False):
+                # Already preprocessed, left untouched so its fingerprint stays indexed
+                os.remove(record["temp_path"])
+                continue
+            os.replace(record["temp_path"], final_path)
+            log(f"Saved {record['original']} as {final_path}")
+
+    for record in records:
+        # Duplicates were written before they could be recognised as such
+        if record["status"] == "delete" and record.get("temp_path"):
+            os.remove(record["temp_path"])
+        if record["status"] != "error" and record["original"] not in final_paths and os.path.exists(record["original"]):
+            os.remove(record["original"])
+            if record["status"] == "delete":
+                log(f"Deleted {record['original']}: {record.get('reason')}")
+
+def main(directory, manifest_file, log_file, min_duration=10, volume_threshold=-100, trimmed_min_duration=6,
+         trimmed_volume_threshold=-40, workers=1, index_directory=None):
+    with open(log_file, 'a') as log_handle:
+        def log(message):
+            log_handle.write(message + "\n")
+            print(message)
+
+        if not os.path.isdir(directory):
+            log(f"The directory {directory} does not exist.")
+            return []
+
+        file_paths = sorted(os.path.join(root, file) for root, _, files in os.walk(directory) for file in files
+                            if not file.endswith(".preprocessed.tmp"))
+        log(f"Preprocessing {len(file_paths)} files in {directory}")
+
+        task = partial(preprocess_file, min_duration=min_duration, volume_threshold=volume_threshold,
+                       trimmed_min_duration=trimmed_min_duration, trimmed_volume_threshold=trimmed_volume_threshold,
+                       fingerprint=index_directory is not None)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                records = list(executor.map(task, file_paths, chunksize=4))
+        else:
+            records = [task(file_path) for file_path in file_paths]
+
+        plan_outputs(records)
+        apply_outputs(records, log)
+        if index_directory is not None:
+            drop_near_duplicates(records, open_fingerprint_index(index_directory), log)
+
+        with open(manifest_file, mode='w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=MANIFEST_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(records)
+
+        kept = sum(record["status"] == "keep" for record in records)
+        errors = [record["original"] for record in records if record["status"] == "error"]
+        log(f"Kept {kept}, deleted {len(records) - kept - len(errors)}, left {len(errors)} files that could not be processed.")
+        for file in errors:
+            log(f"Could not process {file}")
+        log(f"Manifest saved to {manifest_file}")
+        return records
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess every audio file in a directory with a single decode per file.")
+    parser.add_argument("directory", type=str, help="The directory containing the audio files.")
+    parser.add_argument("--min_duration", type=float, default=10.0, help="Minimum duration in seconds before trimming.")
+    parser.add_argument("--volume_threshold", type=float, default=-100.0, help="Minimum volume in dBFS before trimming.")
+    parser.add_argument("--trimmed_min_duration", type=float, default=6.0, help="Minimum duration in seconds after trimming.")
+    parser.add_argument("--trimmed_volume_threshold", type=float, default=-40.0, help="Minimum volume in dBFS after trimming.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default 1 runs serially).")
+    parser.add_argument("--fingerprint_index", type=str, default=None,
+                        help="Fingerprint index directory. Re-encoded copies of indexed recordings are dropped and kept recordings are indexed.")
+
+    log_file = "./logs/preprocess_audio.log"
+    manifest_file = "./logs/preprocess_audio_manifest.csv"
+    args = parser.parse_args()
+    main(args.directory, manifest_file, log_file, args.min_duration, args.volume_threshold,
+         args.trimmed_min_duration, args.trimmed_volume_threshold, args.workers, args.fingerprint_index)
@@ -11,6 +11,8 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import r2_score, mean_squared_error
 import numpy as np
 
+from cachingScripts import list_feature_tables, load_feature_table
+
 models = {
     'LinearRegression': {
         'model': LinearRegression(),
@@ -35,10 +37,6 @@ models = {
         'params': {'n_estimators': [10, 50, 100]}
     }
 }
-# Function to list CSV files in a directory
-def list_csv_files(directory):
-    return [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith('.csv')]
-
 # Function to split data into train and test sets
 def split_data(df, test_size=0.2, random_state=42):
     X = df.iloc[:, 1:]  # features
@@ -112,19 +110,15 @@ def save_predictions_to_csv(y_test, y_pred, model_name, params, feature_name):
     print(f"Saved predictions to {filename}")
     return filename
 
-# Define the list_csv_files function (mock implementation for example)
-def list_csv_files(directory):
-    return [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.csv')]
-
 # Main function to iterate over files, train and evaluate models
 def main(directory):
     results = []
-    files = list_csv_files(directory)
+    files = list_feature_tables(directory)
 
-    print(f"Found {len(files)} CSV files in the directory.")
+    print(f"Found {len(files)} feature tables in the directory.")
     
     for file in files:
-        df = pd.read_csv(file)
+        df = load_feature_table(file)
         print(f"Processing file: {file}")
         feature_name = os.path.basename(file).split('.')[0]
         print(f"Feature name: {feature_name}")
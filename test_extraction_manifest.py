@@ -0,0 +1,18 @@
+import extraction_manifest
+from extraction_manifest import load_manifest, manifest_path, record_extraction, register_audio
+
+def test_manifest_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(extraction_manifest, "MIN_SUPERSEDED_LINES", 10)
+    audio = tmp_path / "rec.wav"
+    for content in range(20):
+        # Every re-extraction of changed audio supersedes the previous hash and feature record
+        audio.write_bytes(bytes([content]) * 100)
+        register_audio(str(audio), "speechFeatures")
+        record_extraction("rec.wav", "speechFeatures", "mfcc", "n_mfcc=13")
+    expected = load_manifest("speechFeatures", reload=True)
+
+    with open(manifest_path("speechFeatures")) as manifest_file:
+        assert len(manifest_file.readlines()) == 2
+    assert load_manifest("speechFeatures", reload=True) == expected
+    assert extraction_manifest.is_current("rec.wav", "speechFeatures", "mfcc", "n_mfcc=13")
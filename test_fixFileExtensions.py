@@ -0,0 +1,18 @@
+import numpy as np
+import soundfile as sf
+
+from fixFileExtensions import probe_format
+
+def write_truncated(path, subtype, format=None, cut=500):
+    samples = np.random.default_rng(0).uniform(-0.5, 0.5, 48000).astype(np.float32)
+    sf.write(path, samples, 16000, subtype=subtype, format=format)
+    data = path.read_bytes()
+    truncated = path.with_name("truncated-" + path.name)
+    truncated.write_bytes(data[:-cut])
+    return truncated
+
+def test_truncated_uploads_are_not_trusted(tmp_path):
+    for name, subtype, format, format_name in (("a.wav", "PCM_16", None, "wav"), ("a.ogg", "VORBIS", "OGG", "ogg")):
+        truncated = write_truncated(tmp_path / name, subtype, format)
+        assert probe_format(str(tmp_path / name))[0] == format_name
+        assert probe_format(str(truncated))[0].startswith("Error")
@@ -0,0 +1,40 @@
+import os
+import time
+import numpy as np
+
+from feature_store import STORE_DATA_FILE, STORE_INDEX_FILE, STORE_META_FILE
+from fileSaveScripts import save_feature, save_feature_chunks
+from parallel_extraction import run_in_order
+
+ITEMS = [f"file{i}" for i in range(12)]
+
+def fake_extraction(file_name):
+    # Later files finish first, so completion order is the reverse of input order
+    index = int(file_name[len("file"):])
+    time.sleep(0.02 * (len(ITEMS) - index))
+    save_feature(np.full(index + 1, index, dtype=np.float32), file_name, "speechFeatures", "fake", "default")
+    chunks = (np.arange(index * 3 + 1, dtype=np.float64) for _ in range(2))
+    save_feature_chunks(chunks, file_name, "speechFeatures", "fake_chunks", "default")
+    return f"Processed {file_name}\n"
+
+def store_bytes(root):
+    contents = {}
+    for directory in ("fake", "fake_chunks"):
+        for store_file in (STORE_DATA_FILE, STORE_INDEX_FILE, STORE_META_FILE):
+            with open(os.path.join(root, "speechFeatures", directory, "default", store_file), 'rb') as f:
+                contents[(directory, store_file)] = f.read()
+    return contents
+
+def test_parallel_stores_match_serial(tmp_path, monkeypatch):
+    logs = {}
+    for name, workers in (("serial", 1), ("parallel", 4)):
+        run_directory = tmp_path / name
+        run_directory.mkdir()
+        monkeypatch.chdir(run_directory)
+        logs[name] = list(run_in_order(fake_extraction, ITEMS, workers=workers))
+
+    assert logs["serial"] == logs["parallel"] == [f"Processed {item}\n" for item in ITEMS]
+    assert store_bytes(tmp_path / "serial") == store_bytes(tmp_path / "parallel")
+    # No staged chunk files are left behind
+    assert not [file for file in os.listdir(tmp_path / "parallel" / "speechFeatures" / "fake_chunks" / "default")
+                if file.endswith(".tmp")]
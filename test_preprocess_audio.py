@@ -0,0 +1,62 @@
+import os
+import hashlib
+import numpy as np
+import soundfile as sf
+
+from preprocess_audio import main
+
+SAMPLE_RATE = 44100
+
+def write_tone(path, frequency, seconds=2.0):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    sf.write(path, (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32), SAMPLE_RATE, subtype='PCM_16')
+
+def audio_by_name(directory):
+    names = {}
+    for file in sorted(os.listdir(directory)):
+        samples, _ = sf.read(os.path.join(directory, file), dtype='int16')
+        names[file] = hashlib.md5(samples.tobytes()).hexdigest()
+    return names
+
+def run(directory, tmp_path):
+    return main(str(directory), str(tmp_path / "manifest.csv"), str(tmp_path / "preprocess.log"),
+                min_duration=1, volume_threshold=-100, trimmed_min_duration=1, trimmed_volume_threshold=-40)
+
+def test_rerun_keeps_recording_ids(tmp_path):
+    directory = tmp_path / "audio"
+    directory.mkdir()
+    write_tone(directory / "x-first.wav", 220)
+    write_tone(directory / "x-second.wav", 330)
+    run(directory, tmp_path)
+    first_run = audio_by_name(directory)
+    assert sorted(first_run) == ["x(1).wav", "x.wav"]
+
+    # A re-sync adds an upload whose name clashes with both, and a copy of x.wav
+    write_tone(directory / "x-new.wav", 440)
+    write_tone(directory / "x-copy.wav", 220)
+    records = run(directory, tmp_path)
+    second_run = audio_by_name(directory)
+
+    for name, audio in first_run.items():
+        assert second_run[name] == audio
+    assert sorted(second_run) == ["x(1).wav", "x(2).wav", "x.wav"]
+    copy = next(record for record in records if record["original"].endswith("x-copy.wav"))
+    assert copy["status"] == "delete" and copy["duplicate_of"].endswith("x.wav")
+
+    # A run with nothing new changes nothing
+    run(directory, tmp_path)
+    assert audio_by_name(directory) == second_run
+
+def test_rerun_does_not_grow_fingerprint_index(tmp_path):
+    directory = tmp_path / "audio"
+    directory.mkdir()
+    write_tone(directory / "a-first.wav", 220)
+    write_tone(directory / "b-first.wav", 500)
+    index_directory = tmp_path / "index"
+    index_file = index_directory / "features.index.csv"
+
+    for _ in range(3):
+        main(str(directory), str(tmp_path / "manifest.csv"), str(tmp_path / "preprocess.log"),
+             min_duration=1, trimmed_min_duration=1, index_directory=str(index_directory))
+        # Header and one row per recording, however often the directory is processed
+        assert len(index_file.read_text().splitlines()) == 3
@@ -0,0 +1,133 @@
+import os
+import sys
+import hashlib
+import multiprocessing
+import optuna
+import pandas as pd
+from optuna.storages import JournalStorage
+from optuna.storages.journal import JournalFileBackend
+from optuna.study import MaxTrialsCallback
+from concurrent.futures import ProcessPoolExecutor
+
+from cachingScripts import table_fingerprint
+
+# Optuna studies persisted to a journal file, so finished trials survive a crash or Ctrl-C and
+# a re-run resumes where it stopped. Every study is named after its (feature set, model) pair, the
+# fingerprint of the feature table's data and the version of the tuner's objective, so a recompiled
+# table or a changed objective starts a fresh study instead of resuming one tuned on something else.
+# The journal file is locked around every write, so several tuner processes can work on the
+# same study at once and together stop once it has the requested number of trials. optimize_study
+# runs trials in worker processes this way, since trials on threads are held back by the GIL.
+
+STUDY_STORAGE_FILE = "./optuna_studies/studies.journal"
+
+# Trials that count towards a study's total; trials left running by a crashed process are run again
+FINISHED_STATES = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+
+# Characters of the data fingerprint kept in study names
+FINGERPRINT_LENGTH = 12
+
+# (study, objective) optimised by forked worker processes, which inherit it instead of unpickling it
+_forked_optimization = None
+
+def study_storage(storage_file=STUDY_STORAGE_FILE):
+    """Return the journal storage in storage_file, creating its directory if needed."""
+    directory = os.path.dirname(storage_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return JournalStorage(JournalFileBackend(storage_file))
+
+def data_fingerprint(file_path, df):
+    """
+    Fingerprint the data of a feature table.
+
+    Parameters:
+    - file_path: str, path of the table
+    - df: pandas DataFrame loaded from it
+
+    Returns:
+    - str, the input fingerprint stored with a compiled table, or a hash of the values
+      for tables without one (CSV files, feature views)
+    """
+    fingerprint = table_fingerprint(file_path) if not file_path.endswith(".csv") else None
+    if fingerprint is None:
+        row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        fingerprint = hashlib.sha1(row_hashes.tobytes() + str(list(df.columns)).encode()).hexdigest()
+    return fingerprint
+
+def study_name(feature_name, model_name, fingerprint, version):
+    """Return the name of the study tuning a model on a feature table's data with an objective version."""
+    return f"{feature_name}/{model_name}/{fingerprint[:FINGERPRINT_LENGTH]}/v{version}"
+
+def open_study(feature_name, model_name, fingerprint, version, storage_file=STUDY_STORAGE_FILE, **kwargs):
+    """
+    Create the persistent study of a (feature set, model) pair, or load it if it exists.
+
+    Only a study tuned on the same data with the same objective version is resumed.
+
+    Parameters:
+    - feature_name: str, name of the feature set
+    - model_name: str, name of the model
+    - fingerprint: str, fingerprint of the feature table's data (see data_fingerprint)
+    - version: int, version of the objective, CV and preprocessing of the tuner
+    - storage_file: str, journal file the study is stored in (default is STUDY_STORAGE_FILE)
+    - **kwargs: passed to optuna.create_study (e.g. pruner)
+
+    Returns:
+    - optuna.Study minimising the objective
+    """
+    return optuna.create_study(study_name=study_name(feature_name, model_name, fingerprint, version),
+                               storage=study_storage(storage_file), load_if_exists=True, direction='minimize', **kwargs)
+
+def finished_trials(study):
+    """Return the number of trials of a study that finished (completed or pruned)."""
+    return len(study.get_trials(deepcopy=False, states=FINISHED_STATES))
+
+def _optimize_forked(n_trials, max_trials):
+    study, objective = _forked_optimization
+    study.optimize(objective, n_trials=n_trials, callbacks=[MaxTrialsCallback(max_trials, states=FINISHED_STATES)])
+
+def optimize_study(study, objective, n_trials, workers=1):
+    """
+    Run trials until the study has n_trials finished trials, counting those of earlier runs and other processes.
+
+    With workers > 1, trials run in that many forked processes sharing the study's journal
+    storage, one trial at a time each. The objective and the data it refers to are inherited
+    by the workers (copy-on-write), not pickled, so it may be a closure.
+
+    Parameters:
+    - study: optuna.Study, returned by open_study
+    - objective: callable taking a trial
+    - n_trials: int, total number of finished trials the study should have
+    - workers: int, number of worker processes running trials (default is 1, in this process)
+
+    Returns:
+    - optuna.Study
+    """
+    finished = finished_trials(study)
+    if finished >= n_trials:
+        print(f"Study {study.study_name} already has {finished} of {n_trials} trials, skipping tuning.")
+        return study
+    if finished > 0:
+        print(f"Resuming study {study.study_name} at {finished} of {n_trials} trials.")
+
+    # The callback stops each process once all processes together have finished n_trials
+    if workers is None or workers <= 1:
+        study.optimize(objective, n_trials=n_trials - finished, callbacks=[MaxTrialsCallback(n_trials, states=FINISHED_STATES)])
+        return study
+
+    global _forked_optimization
+    _forked_optimization = (study, objective)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            list(executor.map(_optimize_forked, [n_trials - finished] * workers, [n_trials] * workers))
+    finally:
+        _forked_optimization = None
+    return study
+
+if __name__ == "__main__":
+    storage_file = sys.argv[1] if len(sys.argv) > 1 else STUDY_STORAGE_FILE
+    storage = study_storage(storage_file)
+    for summary in optuna.get_all_study_summaries(storage):
+        best = summary.best_trial.value if summary.best_trial is not None else None
+        print(f"{summary.study_name}: {summary.n_trials} trials, best value {best}")